@@ -1,17 +1,35 @@
 import os
-import time
 import json
+import time
+import socket
 import asyncio
-import tempfile
-from collections import defaultdict
+import hashlib
+from datetime import datetime, timezone
 
 import discord
 from discord.ext import commands
 from discord import app_commands, Interaction
 from discord.ui import Button, View
 from dotenv import load_dotenv
-import pandas as pd
-import requests
+
+from deverse_api import DeverseClient
+from registry import EpicIdRegistry
+from registry_export import export_registry_csv
+from cache import MISSING, TTLCache, CoalescingCache
+from assets import ASSETS, WalletBalance
+from ratelimit import CommandRateLimits, SharedRateLimits, DEFAULT_SWEEP_INTERVAL
+from conversations import DmRouter, ConversationSuperseded, SharedDmInbox, DEFAULT_RELAY_INTERVAL
+from metrics import REGISTRY, instrument_command, start_metrics_server
+from profiler import SamplingProfiler
+from loop_monitor import LoopLagMonitor, DEFAULT_LAG_INTERVAL, DEFAULT_LAG_THRESHOLD
+from storage import create_registry_store, sync_registry, DEFAULT_CHANGE_LOG_MAX_AGE, DEFAULT_PRUNE_INTERVAL
+from payout_csv import PayoutCsvError, validate_payout_csv
+from payout_plan import SHORTFALL_POLICIES, build_payout_plan
+from payout_jobs import PayoutJournal, PayoutJobRunner, BANK_WALLET_ID
+from payout_report import PayoutReport, MESSAGE_LIMIT
+from payout_schedule import ScheduleStore, PayoutScheduler, OffPeakWindow, parse_start_time, DEFAULT_OFF_PEAK, DEFAULT_SCHEDULER_POLL, SCHEDULE_ACTIVE, SCHEDULE_PAUSED, SCHEDULE_CANCELLED
+from balance_snapshot import take_snapshot, DEFAULT_SNAPSHOT_CONCURRENCY, DEFAULT_SNAPSHOT_REQUESTS_PER_SECOND, DEFAULT_SNAPSHOT_MAX_AGE
+from distribution import DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUESTS_PER_SECOND
 
 # Load environment variables from .env file
 load_dotenv()  # Loads the environment variables from a .env file
@@ -21,40 +39,99 @@ DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')  # Gets the Discord bot token from th
 BEAR_TOKEN = os.getenv('BEAR_TOKEN')  # Gets the bearer token for API authentication
 DW_TOKEN = os.getenv('DW_TOKEN')  # Gets the Deverse World API key from the environment
 
-if DISCORD_TOKEN is None:
-    raise ValueError("Discord token not found. Please check your .env file.")  # Raises an error if the token is not found
-
 # Set up intentsf
 intents = discord.Intents.default()  # Creates a default set of intents for the bot
 intents.messages = True  # Allows the bot to receive messages
 intents.message_content = True  # Allows the bot to read the content of the messages
 intents.guilds = True  # Allows the bot to access guild information
 
+# Sharding, large deployments split the gateway shards over several processes that share their state through SQLite files
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))  # Total shards across all processes, 0 runs a single unsharded bot
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(",") if shard.strip()]  # Shards run by this process, empty runs all of them
+MULTI_PROCESS = bool(SHARD_IDS)  # Other processes run the remaining shards, cooldowns, DM replies and registrations are shared
+SHARED_STATE_DB = os.getenv("SHARED_STATE_DB", "shared_state.db")  # Cooldowns and relayed DMs of a multi-process deployment
+REGISTRY_SYNC_INTERVAL = float(os.getenv("REGISTRY_SYNC_INTERVAL", 1))  # Seconds between replays of registrations made by other processes
+REGISTRY_CHANGE_MAX_AGE = float(os.getenv("REGISTRY_CHANGE_MAX_AGE", DEFAULT_CHANGE_LOG_MAX_AGE))  # Seconds registry changes are kept for other processes to replay
+PAYOUT_WORKERS = os.getenv("PAYOUT_WORKERS", "inline")  # "inline" runs payouts in the bot, "external" queues them for payout_worker.py
+
+# Bot subclass that owns the lifetime of the shared API client
+class DeverseBot(commands.AutoShardedBot if SHARD_COUNT else commands.Bot):
+    metrics_runner = None  # aiohttp runner serving /metrics, when enabled
+
+    async def setup_hook(self):
+        if not MULTI_PROCESS or 0 in SHARD_IDS:
+            await sync_commands_if_changed(self)  # Runs once per deployment, not on every reconnect like on_ready
+        self.loop.create_task(loop_monitor.run())  # Measure event loop lag from the start
+        if LOOP_DEV_MODE:
+            loop_monitor.detect_blocking_calls(self.loop)
+        self.loop.create_task(sweep_rate_limits())  # Keep the cooldown state bounded
+        self.loop.create_task(prune_registry_changes())  # Keep the registry change log bounded
+        if PAYOUT_WORKERS != "external" and (not MULTI_PROCESS or 0 in SHARD_IDS):
+            self.loop.create_task(resume_unfinished_payouts())  # Pick up payouts interrupted by a restart, once per deployment, workers resume their own
+        self.loop.create_task(run_payout_schedules())  # Start scheduled distributions when they are due
+        if MULTI_PROCESS:
+            self.loop.create_task(follow_registry())  # Apply registrations made on other shards
+            self.loop.create_task(relay_direct_messages())  # Receive prompt replies that reached another process
+        if METRICS_PORT:
+            self.metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)  # Expose /metrics for scraping
+
+    async def close(self):
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()  # Stop serving /metrics
+        await deverse.close()  # Close the pooled HTTP session before shutting down
+        await super().close()
+        if WALLET_CACHE_PERSIST:
+            await epic_store.save_wallet_cache(wallet_cache.snapshot())  # Keep resolved wallets for the next start
+        epic_store.close()  # Flush pending registry writes
+        payout_journal.close()  # Flush pending journal writes
+        payout_schedules.close()
+        if MULTI_PROCESS:
+            shared_limits.close()
+            dm_inbox.close()
+
+# Global command sync is slow and rate limited, so it only happens when the command definitions change
+COMMAND_SYNC_STATE = os.getenv("COMMAND_SYNC_STATE", ".command_sync_hash")  # File holding the hash of the last synced commands
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"  # Set to 1 to sync on the next start regardless of the hash
+
+# Hash of the command payload Discord would receive, tied to the application it was synced for
+def command_tree_hash(client):
+    payload = [command.to_dict(client.tree) for command in client.tree.get_commands()]
+    data = json.dumps({"application_id": client.application_id, "commands": payload}, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+# Sync the command tree globally only if it differs from the last successful sync
+async def sync_commands_if_changed(client):
+    current = command_tree_hash(client)
+    try:
+        with open(COMMAND_SYNC_STATE, 'r') as file:
+            previous = file.read().strip()
+    except FileNotFoundError:
+        previous = None
+    if previous == current and not FORCE_COMMAND_SYNC:
+        print("Command definitions unchanged, skipping command sync.")
+        return
+    await client.tree.sync(guild=None)  # Sync commands globally
+    with open(COMMAND_SYNC_STATE, 'w') as file:
+        file.write(current)  # Written only after the sync succeeded, a failed sync is retried on the next start
+    print("Synced the commands.")
+
 # Initialize the bot
-bot = commands.Bot(command_prefix="!", intents=intents)  # Initializes the bot with a command prefix and intents
+shard_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS or None} if SHARD_COUNT else {}
+bot = DeverseBot(command_prefix="!", intents=intents, **shard_options)  # Initializes the bot with a command prefix and intents
 
 # Function to validate EPIC Account ID
 def is_valid_epic_id(epic_id):
     return len(epic_id) == 32 and epic_id.isalnum()  # Checks if the EPIC ID is 32 characters long and alphanumeric
 
-# JSON file path for storing user EPIC IDs
-epic_ids_file = 'epic_ids.json'  # Specifies the path to the JSON file where EPIC IDs are stored
-
-# Load the user_epic_ids from a JSON file
-def load_epic_ids():
-    try:
-        with open(epic_ids_file, 'r') as f:
-            return json.load(f)  # Loads existing EPIC IDs from the JSON file
-    except FileNotFoundError:
-        return {}  # Returns an empty dictionary if the file doesn't exist
-
-# Save the user_epic_ids to a JSON file
-def save_epic_ids():
-    with open(epic_ids_file, 'w') as f:
-        json.dump(user_epic_ids, f)  # Saves the current EPIC IDs to the JSON file
+# Storage for user EPIC IDs, SQLite by default with automatic migration from the legacy JSON file
+epic_ids_file = 'epic_ids.json'  # Specifies the path to the legacy JSON file where EPIC IDs were stored
+epic_ids_db = os.getenv("EPIC_ID_DB", "epic_ids.db")  # Specifies the path to the SQLite database
+epic_store = create_registry_store(os.getenv("EPIC_ID_STORE", "sqlite"), epic_ids_file, epic_ids_db)
+if MULTI_PROCESS and os.getenv("EPIC_ID_STORE", "sqlite") != "sqlite":
+    raise ValueError("Running shards in several processes needs EPIC_ID_STORE=sqlite so registrations are shared.")
 
 # Load existing data when the bot starts
-user_epic_ids = load_epic_ids()  # Loads the EPIC IDs from the JSON file at startup
+epic_registry = EpicIdRegistry(epic_store.load())  # Loads the EPIC IDs from storage at startup and indexes them
 
 # Admin role name
 admin_role_name = "Admins"  # Sets the name of the admin role that has special permissions
@@ -64,9 +141,6 @@ def is_admin(interaction: discord.Interaction):
     admin_role = discord.utils.get(interaction.guild.roles, name=admin_role_name)
     return admin_role in interaction.user.roles  # Checks if the user invoking the command has the Admin role
 
-# Cooldown dictionary
-cooldowns = defaultdict(lambda: 0)  # Initializes a cooldown dictionary to prevent spamming
-
 # Common messages used throughout the bot
 DM_REASON = "To protect your privacy and prevent potential attacks on your account, please check your DMs to provide your EPIC Account ID."
 PROVIDE_EPIC_ID_MSG = "Please provide your EPIC Account ID within 60 seconds:"
@@ -77,71 +151,330 @@ TOOK_TOO_LONG_MSG = "You took too long to respond. Please try again."
 EPIC_ID_SET_MSG = "Click the button below to set your EPIC Account ID."
 EPIC_ID_EDIT_MSG = "Click the button below to edit your EPIC Account ID."
 COOLDOWN_TIME = 10  # Cooldown time in seconds to prevent spamming
+PROMPT_VIEW_TIMEOUT = 180  # Seconds before the set, edit and remove buttons stop responding
+TOO_FAST_MSG = "You are clicking too fast! Please wait a few seconds."
+
+# Per-user button cooldowns for each command, entries expire once the cooldown has passed
+button_limits = CommandRateLimits(capacity=1, per=COOLDOWN_TIME)  # One click per cooldown, as before
+
+# Pending EPIC ID prompts, each DM goes straight to the flow waiting on its author
+dm_router = DmRouter()
+DM_REPLY_TIMEOUT = 60  # Seconds a user has to answer a prompt
+
+# The same cooldowns kept in the shared file when other processes serve some of the users
+shared_limits = SharedRateLimits(SHARED_STATE_DB, capacity=1, per=COOLDOWN_TIME) if MULTI_PROCESS else None
+dm_inbox = SharedDmInbox(SHARED_STATE_DB) if MULTI_PROCESS else None  # Replies that reached the process running shard 0
+
+# Seconds a user must wait before clicking a command button again, 0.0 if they may click now
+async def button_cooldown(command, user_id):
+    if shared_limits is not None:
+        return await shared_limits.acquire(command, user_id)
+    return button_limits.acquire(command, user_id)
+
+# Drop expired cooldowns even when nobody is clicking
+async def sweep_rate_limits():
+    while True:
+        await asyncio.sleep(DEFAULT_SWEEP_INTERVAL)
+        button_limits.sweep()
+        if shared_limits is not None:
+            await shared_limits.sweep()
+
+# Drop registry changes every process has long since replayed, the log grows with every set, edit and remove
+async def prune_registry_changes():
+    while True:
+        try:
+            await epic_store.prune_changes(REGISTRY_CHANGE_MAX_AGE)
+        except Exception as e:
+            print(f"Pruning the registry change log failed, retrying: {e}")
+        await asyncio.sleep(DEFAULT_PRUNE_INTERVAL)
+
+# Hand DMs posted by the process running shard 0 to the prompts waiting in this one
+async def relay_direct_messages():
+    while True:
+        await asyncio.sleep(DEFAULT_RELAY_INTERVAL)
+        if dm_router:
+            for message in await dm_inbox.take(dm_router.waiting()):
+                dm_router.dispatch(message.author_id, message)
 
 # Get the URL from the environment variable
 api_url_base = os.getenv("API_URL")
 base_api_url = os.getenv("BALANCE_API_URL")
-chain_info = "testnet_leafchain_aether/fts"
-
-# Function to make an API call to retrieve the wallet using the EPIC ID
-def get_wallet_by_epic_id(epic_id):
-    wallet_api_url = f"{api_url_base}{epic_id}"
-    wallet_headers = {"x-dw-api-key": f"{DW_TOKEN}"}
-    
+transfer_api_url = os.getenv("TRANSFER_API_URL")
+
+# Cache of EPIC ID -> wallet ID lookups, the mapping almost never changes
+WALLET_CACHE_SIZE = int(os.getenv("WALLET_CACHE_SIZE", 100000))  # Maximum number of cached wallets
+WALLET_CACHE_TTL = float(os.getenv("WALLET_CACHE_TTL", 3600))  # Seconds a resolved wallet stays cached
+WALLET_CACHE_NEGATIVE_TTL = float(os.getenv("WALLET_CACHE_NEGATIVE_TTL", 60))  # Seconds a missing wallet stays cached
+WALLET_CACHE_PERSIST = os.getenv("WALLET_CACHE_PERSIST", "1") == "1"  # Save the cache in the datastore across restarts
+wallet_cache = TTLCache(WALLET_CACHE_SIZE, WALLET_CACHE_TTL)
+if WALLET_CACHE_PERSIST:
+    wallet_cache.restore(epic_store.load_wallet_cache())
+
+# Short-lived cache of wallet balances so bursts of /view share upstream calls
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", 5))  # Seconds a fetched balance stays cached
+balance_cache = CoalescingCache(WALLET_CACHE_SIZE, BALANCE_CACHE_TTL)
+
+# Circuit breakers around each API, a degraded backend fails fast instead of piling up requests
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))  # Consecutive failures that open a circuit
+BREAKER_RECOVERY_TIME = float(os.getenv("BREAKER_RECOVERY_TIME", 30))  # Seconds before a trial request is let through
+
+# Shared async client for the wallet, balance and transfer APIs
+deverse = DeverseClient(api_url_base, base_api_url, transfer_api_url, DW_TOKEN, BEAR_TOKEN,
+                        wallet_cache=wallet_cache, negative_ttl=WALLET_CACHE_NEGATIVE_TTL, balance_cache=balance_cache,
+                        failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_time=BREAKER_RECOVERY_TIME)
+
+# Largest payout CSV accepted by /dw-commands distribute
+PAYOUT_CSV_MAX_BYTES = int(os.getenv("PAYOUT_CSV_MAX_BYTES", 100 * 1024 * 1024))
+
+# Default handling of payouts that ask for more than the bank holds: reject, order or pro_rata
+PAYOUT_SHORTFALL_POLICY = os.getenv("PAYOUT_SHORTFALL_POLICY", "reject")
+
+# Concurrency and request budget for /dw-commands distribute
+DISTRIBUTE_MAX_IN_FLIGHT = int(os.getenv("DISTRIBUTE_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT))
+DISTRIBUTE_REQUESTS_PER_SECOND = float(os.getenv("DISTRIBUTE_REQUESTS_PER_SECOND", DEFAULT_REQUESTS_PER_SECOND))
+PAYOUT_PROGRESS_EDIT_INTERVAL = float(os.getenv("PAYOUT_PROGRESS_EDIT_INTERVAL", 5))  # Seconds between edits of a payout status message, Discord rate limits edits
+
+# Bulk balance snapshots for /dw-commands balances
+SNAPSHOT_CONCURRENCY = int(os.getenv("SNAPSHOT_CONCURRENCY", DEFAULT_SNAPSHOT_CONCURRENCY))  # Wallets fetched at once
+SNAPSHOT_REQUESTS_PER_SECOND = float(os.getenv("SNAPSHOT_REQUESTS_PER_SECOND", DEFAULT_SNAPSHOT_REQUESTS_PER_SECOND))  # Upstream request budget of a snapshot
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", DEFAULT_SNAPSHOT_MAX_AGE))  # Seconds a balance from the last snapshot is reused
+last_snapshot = None  # Kept so the next snapshot only refreshes stale entries
+snapshot_lock = asyncio.Lock()  # One snapshot at a time
+
+EMBED_FIELD_LIMIT = 1024  # Characters Discord accepts in one embed field value
+
+# Paginated /dw-commands list
+LIST_PAGE_SIZE = 20  # EPIC IDs per page, embeds allow at most 25 fields
+LIST_VIEW_TIMEOUT = 600  # Seconds before the list buttons stop responding
+USER_FETCH_CONCURRENCY = 5  # Discord user fetches in flight at once for a page
+
+# Memoized Discord user names so paging back and forth never refetches
+user_name_cache = TTLCache(100000, 3600)
+user_fetch_semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
+
+# Resolve user names from the member cache first and fetch only the misses, concurrently
+async def resolve_user_names(guild, user_ids):
+    names = {}
+    misses = []
+    for user_id in user_ids:
+        name = user_name_cache.get(user_id)
+        if name is MISSING:
+            user = (guild.get_member(int(user_id)) if guild else None) or bot.get_user(int(user_id))
+            if user is None:
+                misses.append(user_id)
+                continue
+            name = user.name
+            user_name_cache.set(user_id, name)
+        names[user_id] = name
+
+    async def fetch_name(user_id):
+        async with user_fetch_semaphore:
+            try:
+                user = await bot.fetch_user(int(user_id))
+                name = user.name
+            except discord.NotFound:
+                name = None  # The account no longer exists, remember that too
+            except discord.HTTPException:
+                return  # Leave it out of the cache so the next view tries again
+        user_name_cache.set(user_id, name)
+        names[user_id] = name
+
+    await asyncio.gather(*(fetch_name(user_id) for user_id in misses))
+    return names
+
+# Exports larger than this many rows are gzip-compressed to stay under Discord's upload limit
+EXPORT_GZIP_THRESHOLD = int(os.getenv("EXPORT_GZIP_THRESHOLD", 50000))
+
+# Journal of payout jobs, lets an interrupted distribution resume exactly where it stopped
+payout_journal = PayoutJournal(os.getenv("PAYOUT_JOURNAL_DB", "payout_jobs.db"))
+PAYOUT_OWNER = f"bot-{socket.gethostname()}-{os.getpid()}"  # Lease holder of the payout jobs this process runs inline
+payout_runner = PayoutJobRunner(deverse, payout_journal, epic_registry.user_for_epic_id, BANK_WALLET_ID,
+                                DISTRIBUTE_MAX_IN_FLIGHT, DISTRIBUTE_REQUESTS_PER_SECOND, owner=PAYOUT_OWNER)
+
+# Scheduled and recurring distributions, kept in the payout journal database so they survive restarts
+SCHEDULE_OFF_PEAK = OffPeakWindow.parse(os.getenv("SCHEDULE_OFF_PEAK", DEFAULT_OFF_PEAK))  # Daily UTC window "offpeak" schedules run in
+SCHEDULE_REQUESTS_PER_SECOND = float(os.getenv("SCHEDULE_REQUESTS_PER_SECOND", DISTRIBUTE_REQUESTS_PER_SECOND))  # Transfer budget of a scheduled run
+SCHEDULE_ERROR_PREVIEW = 80  # Characters of a failed run's error shown per schedule in /dw-commands schedules
+SCHEDULE_POLL_INTERVAL = float(os.getenv("SCHEDULE_POLL_INTERVAL", DEFAULT_SCHEDULER_POLL))  # Seconds between checks for due schedules
+payout_schedules = ScheduleStore(payout_journal.path)
+
+# Metrics endpoint, disabled unless a port is set
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Local only by default
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Port serving /metrics, 0 disables the endpoint
+
+# Sizes read at scrape time, nothing is added to the command paths
+REGISTRY.gauge("dw_registered_epic_ids", "Registered EPIC IDs").set_function(lambda: len(epic_registry))
+REGISTRY.gauge("dw_wallet_cache_entries", "Cached wallet lookups").set_function(lambda: len(wallet_cache))
+REGISTRY.gauge("dw_pending_dm_prompts", "Users being asked for their EPIC ID").set_function(lambda: len(dm_router))
+
+# Sampling profiler of the event loop thread, toggled by an admin
+profiler = SamplingProfiler()
+
+# Event loop lag watchdog, logs the stack of whatever blocks the loop for longer than the threshold
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", DEFAULT_LAG_INTERVAL))  # Seconds between heartbeats
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", DEFAULT_LAG_THRESHOLD))  # Seconds of lag logged as a stall
+LOOP_DEV_MODE = os.getenv("LOOP_DEV_MODE", "0") == "1"  # Set to 1 to also flag every synchronous I/O call on the loop thread, slows the bot down
+loop_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD, app_root=os.path.dirname(os.path.abspath(__file__)),
+                              histogram=REGISTRY.histogram("dw_event_loop_lag_seconds", "Delay of the event loop heartbeat"))
+
+# Replay registrations other processes wrote to the shared store and drop cached wallets of the IDs involved
+async def follow_registry():
+    def invalidate(old_epic_id, new_epic_id):
+        for epic_id in (old_epic_id, new_epic_id):
+            if epic_id is not None:
+                deverse.invalidate_wallet(epic_id)
+
+    while True:
+        await asyncio.sleep(REGISTRY_SYNC_INTERVAL)
+        try:
+            await sync_registry(epic_store, epic_registry, invalidate)
+        except Exception as e:
+            print(f"Registry sync failed, retrying: {e}")
+
+# Progress callback that edits a payout status message at most once per PAYOUT_PROGRESS_EDIT_INTERVAL
+# Edits run in the background and never overlap, so a rate limited edit cannot hold up the transfers
+def payout_progress(status_message, job_id, report=None):
+    last_edit = 0.0
+    editing = None
+
+    async def edit(content):
+        try:
+            await status_message.edit(content=content)
+        except discord.HTTPException:
+            pass  # A failed progress update should never stop the payout
+
+    async def progress(done, total):
+        nonlocal last_edit, editing
+        now = time.monotonic()
+        if (editing is not None and not editing.done()) or now - last_edit < PAYOUT_PROGRESS_EDIT_INTERVAL:
+            return  # Skipped counts are folded into the next edit, the final report follows anyway
+        last_edit = now
+        details = f" {report.progress_line()}" if report is not None else ""
+        editing = asyncio.ensure_future(edit(f"Distribution job {job_id} in progress: {done}/{total} rows processed.{details}"))
+
+    return progress
+
+# Validate a payout CSV, returns the validation or raises ValueError with the problems found
+async def check_payout_csv(csv_bytes):
     try:
-        wallet_response = requests.get(wallet_api_url, headers=wallet_headers)
-        if wallet_response.status_code in [200, 201]:
-            wallet_data = wallet_response.json().get('data', {})
-            id_wallet = wallet_data.get('thx', {}).get('id_wallet')
-            if id_wallet:
-                return id_wallet, None  # Successfully retrieved the wallet ID
-            else:
-                return None, "'id_wallet' not found in the response data."  # Handle the case where 'id_wallet' is missing
-        else:
-            return None, f"API responded with status code: {wallet_response.status_code}. Response: {wallet_response.text}"
-    except Exception as e:
-        return None, str(e)  # Return None for id_wallet and an error message if something goes wrong
-
-# Function to retrieve the balance of a wallet using its id_wallet
-def get_wallet_balance(id_wallet):
-    balance_api_url = f"{base_api_url}{id_wallet}/{chain_info}"
-    balance_headers = {"Authorization": f"Bearer {BEAR_TOKEN}"}
+        validation = await asyncio.to_thread(validate_payout_csv, csv_bytes)  # Validate every row before any transfer starts
+    except PayoutCsvError as e:
+        raise ValueError(str(e))  # The CSV cannot be read or lacks the required columns
+    if not validation.ok:
+        raise ValueError(f"The CSV file has problems, no transfers were made:\n{validation.summary()}")  # Reject the whole payout so it can be fixed
+    return validation
+
+# Validate a payout, check it against a fresh bank balance and record it as a durable job
+# Shared by /dw-commands distribute and scheduled runs, returns (job_id, validation, plan) or raises ValueError
+async def prepare_payout(csv_bytes, policy, admin_id, channel_id, requests_per_second=None):
+    if not epic_registry:
+        raise ValueError("No EPIC Account IDs have been set yet.")
+    validation = await check_payout_csv(csv_bytes)
+
+    bot_balance_data, error = await deverse.get_wallet_balance(BANK_WALLET_ID, use_cache=False)  # Check the bot's bank account balance, always fresh before a payout
+    if error or not bot_balance_data:
+        raise ValueError(f"Failed to check Bot Bank Account balance. {error}")
+    balances = WalletBalance.from_api(bot_balance_data).as_dict()  # Bank balance per asset ID
+
+    # Compare the CSV totals with the bank before making a single transfer
+    plan = await asyncio.to_thread(build_payout_plan, csv_bytes, epic_registry.user_for_epic_id, balances, policy or PAYOUT_SHORTFALL_POLICY)
+    if not plan.feasible:
+        raise ValueError(f"Insufficient balance in the Bot Bank Account for one or more resources.\n{plan.summary()}")
+
+    # Record the payout as a durable job so it can be resumed without paying anyone twice
+    # Inline jobs are leased to this process from the start, so a restarting process does not resume them before they run
+    owner = PAYOUT_OWNER if PAYOUT_WORKERS != "external" else None
+    job_id = await payout_journal.create_job(csv_bytes, plan, validation.total_rows, admin_id, channel_id, requests_per_second, owner)
+    return job_id, validation, plan
+
+# Run a payout job in this process, or queue it for the payout workers and wait for them to finish it
+# Returns the PayoutReport of the job or raises ValueError
+async def run_payout(job_id, status_message=None, balances=None):
+    if PAYOUT_WORKERS == "external":
+        await payout_journal.enqueue(job_id)  # Workers read the bank balance themselves, the job may wait in the queue
+        return await payout_journal.wait_for_job(job_id, payout_progress(status_message, job_id) if status_message else None)
+    report = PayoutReport()
+    await payout_runner.run(job_id, progress=payout_progress(status_message, job_id, report) if status_message else None, report=report, balances=balances)
+    return report
+
+# Every row's outcome as a gzip-compressed CSV attachment, built off the event loop
+async def payout_report_file(job_id, report):
+    return discord.File(await asyncio.to_thread(report.export_csv), filename=f"payout_{job_id}.csv.gz")
+
+# Send a payout summary with the full outcome attached, falling back to a DM once the interaction token has expired
+async def send_payout_report(interaction, job_id, report):
+    summary = report.summary(f"Distribution job {job_id} completed.")
+    try:
+        await interaction.followup.send(summary, file=await payout_report_file(job_id, report), ephemeral=True)
+    except discord.HTTPException:
+        await notify_admin(interaction.user.id, summary, await payout_report_file(job_id, report))
 
+# Send a DM to an admin, used for payouts that outlive their interaction
+async def notify_admin(admin_id, message, file=None):
     try:
-        balance_response = requests.get(balance_api_url, headers=balance_headers)
-        if balance_response.status_code == 200:
-            balance_data = balance_response.json().get('result', {})
-            return balance_data, None  # Return the balance data if the API call is successful
-        else:
-            return None, f"API responded with status code: {balance_response.status_code}."
-    except Exception as e:
-        return None, str(e)  # Return None for balance data and an error message if something goes wrong
-
-# Function to transfer resources to a wallet
-def transfer_resource(id_wallet, points, asset_id):
-    transfer_api_url = os.getenv("TRANSFER_API_URL")
-    transfer_payload = {
-        "receiver_id_wallet_address": id_wallet,
-        "transfer_value_human": points,
-        "native": False,
-        "asset_id": asset_id
-    }
-    transfer_headers = {"Authorization": f"Bearer {BEAR_TOKEN}"}
-    
+        admin = await bot.fetch_user(int(admin_id))
+        await admin.send(message, file=file)
+    except discord.HTTPException as e:
+        print(f"Could not notify admin {admin_id}: {e}")
+
+# Run a due schedule through the same checks and job path as /dw-commands distribute, the admin gets the report by DM
+async def run_scheduled_payout(schedule):
+    schedule_id, admin_id = schedule["schedule_id"], schedule["admin_id"]
     try:
-        transfer_response = requests.post(transfer_api_url, headers=transfer_headers, json=transfer_payload)
-        if transfer_response.status_code == 200:
-            return True, None  # Return True if the transfer was successful
-        else:
-            return False, f"API responded with status code: {transfer_response.status_code}."
-    except Exception as e:
-        return False, str(e)  # Return False and an error message if something goes wrong
+        job_id, _, plan = await prepare_payout(schedule["csv"], schedule["policy"], admin_id, schedule["channel_id"], SCHEDULE_REQUESTS_PER_SECOND)
+        report = await run_payout(job_id, balances=plan.balances)
+    except ValueError as e:
+        await notify_admin(admin_id, f"Scheduled distribution {schedule_id} did not run. {e}")
+        raise
+    await notify_admin(admin_id, report.summary(f"Scheduled distribution {schedule_id} completed as job {job_id}."),
+                       await payout_report_file(job_id, report))
+    return job_id
+
+payout_scheduler = PayoutScheduler(payout_schedules, run_scheduled_payout, SCHEDULE_OFF_PEAK, SCHEDULE_POLL_INTERVAL)
+
+# Start scheduled distributions once they are due, every process checks but only one claims each run
+async def run_payout_schedules():
+    await bot.wait_until_ready()
+    await payout_scheduler.run_forever()
+
+# Resume payout jobs that were still running when their process stopped, jobs another live process holds the lease on are left alone
+async def resume_unfinished_payouts():
+    await bot.wait_until_ready()
+    for job_id in await payout_journal.unfinished_jobs():
+        job = await payout_journal.get_job(job_id)
+        print(f"Resuming distribution job {job_id}.")
+        try:
+            report = await run_payout(job_id)
+        except Exception as e:  # Journal errors too, one broken job must not keep the others from resuming
+            await notify_admin(job["admin_id"], f"Distribution job {job_id} could not be resumed after a restart. {e}")
+            continue
+        await notify_admin(job["admin_id"], report.summary(f"Distribution job {job_id} was resumed after a restart and has completed."),
+                           await payout_report_file(job_id, report))
+
+# Delete the message an interaction responded with, if it is still there
+async def delete_prompt(interaction):
+    try:
+        await interaction.delete_original_response()
+    except discord.errors.HTTPException:
+        pass  # Already deleted, or the interaction token has expired
+
+# Timeout handler for a view, deletes the message the view was attached to
+def remove_prompt(interaction):
+    async def on_timeout():
+        await delete_prompt(interaction)
+    return on_timeout
+
+# Route direct messages to the waiting set or edit flow, a listener so prefix commands keep working
+@bot.listen('on_message')
+async def route_direct_message(message):
+    if isinstance(message.channel, discord.DMChannel) and not message.author.bot:
+        if not dm_router.dispatch(message.author.id, message) and dm_inbox is not None:
+            await dm_inbox.post(message.author.id, message.content)  # The prompt may be waiting in another process
 
 # Event triggered when the bot is ready
 @bot.event
 async def on_ready():
-    await bot.tree.sync(guild=None)  # Sync commands globally
-    print(f'We have logged in as {bot.user} and synced the commands.')  # Print a message indicating the bot is ready
+    print(f'We have logged in as {bot.user}.')  # Print a message indicating the bot is ready, commands are synced in setup_hook
 
 # Create a command group
 class DwCommands(app_commands.Group):
@@ -150,6 +483,7 @@ class DwCommands(app_commands.Group):
 
     # Help command within the dw-commands group
     @app_commands.command(name="help", description="Displays information on how to use the dw-commands and their descriptions.")
+    @instrument_command("help")
     async def dw_help(self, interaction: discord.Interaction):
         # Create an embed for the help message
         embed = discord.Embed(title="Help - DW Commands", color=discord.Color.blue())
@@ -166,6 +500,13 @@ class DwCommands(app_commands.Group):
         embed.add_field(name="/dw-commands remove", value="Remove your existing EPIC Account ID.", inline=False)
         embed.add_field(name="/dw-commands list (Admin only)", value="List all EPIC Account IDs registered with the bot. Admins can also export this list.", inline=False)
         embed.add_field(name="/dw-commands distribute (Admin only)", value="Distribute DP, Oil, and Energy to users.", inline=False)
+        embed.add_field(name="/dw-commands job (Admin only)", value="List, inspect or resume distribution jobs.", inline=False)
+        embed.add_field(name="/dw-commands schedule (Admin only)", value="Schedule a distribution for a later time, the off-peak window, or daily or weekly.", inline=False)
+        embed.add_field(name="/dw-commands schedules (Admin only)", value="List, pause, resume or cancel scheduled distributions.", inline=False)
+        embed.add_field(name="/dw-commands balances (Admin only)", value="Snapshot the DP, Oil and Energy balances of all registered users as a CSV.", inline=False)
+        embed.add_field(name="/dw-commands stats (Admin only)", value="Show registry size and cache statistics.", inline=False)
+        embed.add_field(name="/dw-commands profile (Admin only)", value="Start or stop the sampling profiler of the bot.", inline=False)
+        embed.add_field(name="/dw-commands diagnostics (Admin only)", value="Show event loop lag and the code that last blocked the bot.", inline=False)
         
         embed.add_field(name="Example Commands", value="• Use `/dw-commands set` to set your EPIC Account ID.\n• Use `/dw-commands view` to view your account info.", inline=False)
         
@@ -176,6 +517,7 @@ class DwCommands(app_commands.Group):
 
     # Command to display game information for Deverse World: Season 0
     @app_commands.command(name="gameinfo", description="Show information about Deverse World: Season 0")
+    @instrument_command("gameinfo")
     async def dw_gameinfo(self, interaction: discord.Interaction):
         # Manually create the game information
         game_title = "Deverse World: Season 0"
@@ -217,57 +559,61 @@ class DwCommands(app_commands.Group):
 
     # Command to set the EPIC Account ID
     @app_commands.command(name="set", description="Set your EPIC Account ID")
+    @instrument_command("set")
     async def dw_set(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)  # Get the user's Discord ID as a string
 
         # Callback function for the button to set EPIC Account ID
         async def button_callback(button_interaction):
-            now = time.time()
-            if now < cooldowns[button_interaction.user.id]:
-                await button_interaction.response.send_message("You are clicking too fast! Please wait a few seconds.", ephemeral=True)
+            if await button_cooldown("set", button_interaction.user.id):
+                await button_interaction.response.send_message(TOO_FAST_MSG, ephemeral=True)
                 return  # Prevent the user from spamming the button
 
-            cooldowns[button_interaction.user.id] = now + COOLDOWN_TIME  # Update the cooldown time
-
             if button_interaction.user.id != int(user_id):
                 await button_interaction.response.send_message("You are not authorized to use this button.", ephemeral=True)
                 return  # Ensure the button interaction is authorized
 
-            if user_id in user_epic_ids:
+            if user_id in epic_registry:
                 await button_interaction.response.send_message("You already have an EPIC Account ID set. You cannot set it again.", ephemeral=True)
                 return  # Prevent users from setting their EPIC ID again if it's already set
 
             await button_interaction.response.send_message(DM_REASON, ephemeral=True)  # Prompt the user to check their DMs for privacy
-
-            def check(msg):
-                return msg.author == button_interaction.user and isinstance(msg.channel, discord.DMChannel)  # Check if the message is from the user in DMs
+            view.stop()  # The DM flow owns the prompt now, the view timeout must not delete it midway
 
             try:
                 await button_interaction.user.send(PROVIDE_EPIC_ID_MSG)  # Ask the user to provide their EPIC ID in DMs
                 while True:
-                    msg = await bot.wait_for('message', check=check, timeout=60)  # Wait for the user's response
+                    msg = await dm_router.wait_for_reply(button_interaction.user.id, DM_REPLY_TIMEOUT)  # Wait for the user's response in DMs
                     epic_id = msg.content
 
                     if is_valid_epic_id(epic_id):  # Validate the provided EPIC ID
-                        if epic_id in user_epic_ids.values():
+                        if epic_registry.is_taken(epic_id):
                             await button_interaction.user.send(ID_IN_USE_MSG)  # Check if the EPIC ID is already in use
                         else:
-                            user_epic_ids[user_id] = epic_id  # Save the EPIC ID for the user
-                            save_epic_ids()  # Save the updated EPIC IDs to the JSON file
+                            try:
+                                await epic_store.put(user_id, epic_id)  # Persist first, the store refuses an ID another shard registered meanwhile
+                            except ValueError:
+                                await button_interaction.user.send(ID_IN_USE_MSG)
+                                continue
+                            epic_registry.apply(user_id, epic_id)  # Save the EPIC ID for the user
                             await button_interaction.user.send(THANK_YOU_MSG)  # Thank the user for providing their EPIC ID
                             await button_interaction.followup.send('Setup completed successfully!', ephemeral=True)
                             await interaction.channel.send(f'{button_interaction.user.mention} has successfully set their EPIC Account ID.')
-                            await interaction.delete_original_response()  # Delete the original interaction response
+                            await delete_prompt(interaction)  # Delete the original interaction response
                             break
                     else:
                         await button_interaction.user.send(INVALID_EPIC_ID_MSG)  # Notify the user if the EPIC ID is invalid
             except asyncio.TimeoutError:
                 await button_interaction.user.send(TOOK_TOO_LONG_MSG)  # Notify the user if they took too long to respond
                 await button_interaction.followup.send(TOOK_TOO_LONG_MSG, ephemeral=True)
-                await interaction.delete_original_response()  # Delete the original interaction response if timed out
+                await delete_prompt(interaction)  # Delete the original interaction response if timed out
+            except ConversationSuperseded:
+                await delete_prompt(interaction)  # The view no longer times out, so remove the stale prompt here
+                return  # The user opened a newer prompt, which now receives their replies
 
             set_button.disabled = True  # Disable the button after interaction
             view.clear_items()  # Clear all items from the view to prevent further interactions
+            view.stop()  # Stop listening so the view and its callbacks can be freed
             try:
                 await button_interaction.message.edit(view=view)  # Update the message view
             except discord.errors.NotFound:
@@ -279,6 +625,7 @@ class DwCommands(app_commands.Group):
         help_button = Button(label="Help", style=discord.ButtonStyle.link, url="https://www.epicgames.com/help/en-US/c-Category_EpicAccount/c-AccountSecurity/what-is-an-epic-account-id-and-where-can-i-find-it-a000084674")  # Create a help button linking to Epic Games' support page
 
         async def close_button_callback(button_interaction):
+            view.stop()  # Stop listening so the view and its callbacks can be freed
             try:
                 await interaction.delete_original_response()  # Delete the original interaction response
             except discord.errors.NotFound:
@@ -287,7 +634,8 @@ class DwCommands(app_commands.Group):
         close_button = Button(label="Close", style=discord.ButtonStyle.danger)  # Create a close button
         close_button.callback = close_button_callback  # Set the callback function for the close button
 
-        view = View()  # Create a view to hold the buttons
+        view = View(timeout=PROMPT_VIEW_TIMEOUT)  # Create a view to hold the buttons, it is dropped once it times out
+        view.on_timeout = remove_prompt(interaction)  # Remove the stale prompt when the buttons expire
         view.add_item(set_button)  # Add the set button to the view
         view.add_item(help_button)  # Add the help button to the view
         view.add_item(close_button)  # Add the close button to the view
@@ -296,23 +644,20 @@ class DwCommands(app_commands.Group):
 
     # Command to view the EPIC Account ID
     @app_commands.command(name="view", description="View your EPIC Account ID and balance")
+    @instrument_command("view")
     async def dw_view(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)  # Get the user's Discord ID as a string
 
-        epic_id = user_epic_ids.get(user_id)  # Retrieve the EPIC ID associated with the user's Discord ID
+        epic_id = epic_registry.get(user_id)  # Retrieve the EPIC ID associated with the user's Discord ID
         if not epic_id:
             await interaction.response.send_message('You have not provided an EPIC Account ID yet.', ephemeral=True)
             return  # Notify the user if they haven't set an EPIC ID
 
         await interaction.response.defer(ephemeral=True)  # Defer the response to ensure enough time for processing
 
-        id_wallet, error = get_wallet_by_epic_id(epic_id)  # Retrieve the wallet ID using the EPIC ID
+        balance = None  # Stays None when the wallet or its balances cannot be retrieved
+        id_wallet, error = await deverse.get_wallet_by_epic_id(epic_id)  # Retrieve the wallet ID using the EPIC ID
         if not id_wallet:
-            # If wallet retrieval fails, explicitly set balances to None
-            dp_balance = None
-            oil_balance = None
-            energy_balance = None
-
             # Notify the user of the failure and include their Discord name and EPIC Account ID
             await interaction.followup.send(
                 f"Failed to retrieve wallet for {interaction.user.name} (EPIC Account ID: {epic_id}). {error}", 
@@ -320,81 +665,81 @@ class DwCommands(app_commands.Group):
             )
         else:
             # Retrieve the wallet balances if wallet retrieval was successful
-            balance_data, error = get_wallet_balance(id_wallet)
+            balance_data, error = await deverse.get_wallet_balance(id_wallet)
             if error:
-                dp_balance = None
-                oil_balance = None
-                energy_balance = None
-
                 await interaction.followup.send(f"Failed to retrieve balance. {error}", ephemeral=True)
             else:
-                dp_balance = next((item['balance'] for item in balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 1), 0)
-                oil_balance = next((item['balance'] for item in balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 2), 0)
-                energy_balance = next((item['balance'] for item in balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 3), 0)
+                balance = WalletBalance.from_api(balance_data)  # All assets in a single pass over the response
 
         embed = discord.Embed(title="Your Account Information", color=discord.Color.blue())  # Create an embed for displaying account information
         embed.add_field(name="Discord Name", value=interaction.user.name, inline=True)  # Add the user's Discord name to the embed
         embed.add_field(name="EPIC Account ID", value=epic_id, inline=True)  # Add the EPIC ID to the embed
         embed.add_field(name="Wallet ID", value=f"{id_wallet}" if id_wallet else "None", inline=False)  # Add the wallet ID or "None" to the embed
-        embed.add_field(name="DP", value=f"{dp_balance}" if dp_balance is not None else "None", inline=True)  # Add the DP balance or "None" to the embed
-        embed.add_field(name="Oil", value=f"{oil_balance}" if oil_balance is not None else "None", inline=True)  # Add the oil balance or "None" to the embed
-        embed.add_field(name="Energy", value=f"{energy_balance}" if energy_balance is not None else "None", inline=True)  # Add the energy balance or "None" to the embed
+        for asset in ASSETS:
+            embed.add_field(name=asset.name, value=f"{balance[asset.asset_id]}" if balance is not None else "None", inline=True)  # Add each balance or "None" to the embed
         embed.set_thumbnail(url=interaction.user.avatar.url)  # Set the user's avatar as the thumbnail in the embed
 
         await interaction.followup.send(embed=embed, ephemeral=True)  # Send the embed as a response
 
     # Command to edit the EPIC Account ID
     @app_commands.command(name="edit", description="Edit your EPIC Account ID")
+    @instrument_command("edit")
     async def dw_edit(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)  # Get the user's Discord ID as a string
 
         async def button_callback(button_interaction):
-            now = time.time()
-            if now < cooldowns[button_interaction.user.id]:
-                await button_interaction.response.send_message("You are clicking too fast! Please wait a few seconds.", ephemeral=True)
+            if await button_cooldown("edit", button_interaction.user.id):
+                await button_interaction.response.send_message(TOO_FAST_MSG, ephemeral=True)
                 return  # Prevent the user from spamming the button
 
-            cooldowns[button_interaction.user.id] = now + COOLDOWN_TIME  # Update the cooldown time
-
             if button_interaction.user.id != int(user_id):
                 await button_interaction.response.send_message("You are not authorized to use this button.", ephemeral=True)
                 return  # Ensure the button interaction is authorized
 
-            if user_id not in user_epic_ids:
+            if user_id not in epic_registry:
                 await button_interaction.response.send_message("You do not have an EPIC Account ID set yet. Please set it first using the /dw set command.", ephemeral=True)
                 return  # Prevent the user from editing their EPIC ID if it's not set
 
             await button_interaction.response.send_message(DM_REASON, ephemeral=True)  # Prompt the user to check their DMs for privacy
-
-            def check(msg):
-                return msg.author == button_interaction.user and isinstance(msg.channel, discord.DMChannel)  # Check if the message is from the user in DMs
+            view.stop()  # The DM flow owns the prompt now, the view timeout must not delete it midway
 
             try:
                 await button_interaction.user.send("Please provide your new EPIC Account ID within 60 seconds:")  # Ask the user to provide their new EPIC ID in DMs
                 while True:
-                    msg = await bot.wait_for('message', check=check, timeout=60)  # Wait for the user's response
+                    msg = await dm_router.wait_for_reply(button_interaction.user.id, DM_REPLY_TIMEOUT)  # Wait for the user's response in DMs
                     new_epic_id = msg.content
 
                     if is_valid_epic_id(new_epic_id):  # Validate the provided EPIC ID
-                        if new_epic_id in user_epic_ids.values():
+                        if epic_registry.is_taken(new_epic_id):
                             await button_interaction.user.send(ID_IN_USE_MSG)  # Check if the new EPIC ID is already in use
                         else:
-                            user_epic_ids[user_id] = new_epic_id  # Save the new EPIC ID for the user
-                            save_epic_ids()  # Save the updated EPIC IDs to the JSON file
+                            try:
+                                await epic_store.put(user_id, new_epic_id)  # Persist first, the store refuses an ID another shard registered meanwhile
+                            except ValueError:
+                                await button_interaction.user.send(ID_IN_USE_MSG)
+                                continue
+                            old_epic_id = epic_registry.apply(user_id, new_epic_id)  # Save the new EPIC ID for the user
+                            if old_epic_id is not None:
+                                deverse.invalidate_wallet(old_epic_id)  # Drop cached wallet lookups for both IDs
+                            deverse.invalidate_wallet(new_epic_id)
                             await button_interaction.user.send('Thank you! Your EPIC Account ID has been updated.')  # Thank the user for providing their new EPIC ID
                             await button_interaction.followup.send('Update completed successfully!', ephemeral=True)
                             await interaction.channel.send(f'{button_interaction.user.mention} has successfully updated their EPIC Account ID.')
-                            await interaction.delete_original_response()  # Delete the original interaction response
+                            await delete_prompt(interaction)  # Delete the original interaction response
                             break
                     else:
                         await button_interaction.user.send(INVALID_EPIC_ID_MSG)  # Notify the user if the EPIC ID is invalid
             except asyncio.TimeoutError:
                 await button_interaction.user.send(TOOK_TOO_LONG_MSG)  # Notify the user if they took too long to respond
                 await button_interaction.followup.send(TOOK_TOO_LONG_MSG, ephemeral=True)
-                await interaction.delete_original_response()  # Delete the original interaction response if timed out
+                await delete_prompt(interaction)  # Delete the original interaction response if timed out
+            except ConversationSuperseded:
+                await delete_prompt(interaction)  # The view no longer times out, so remove the stale prompt here
+                return  # The user opened a newer prompt, which now receives their replies
 
             button.disabled = True  # Disable the button after interaction
             view.clear_items()  # Clear all items from the view to prevent further interactions
+            view.stop()  # Stop listening so the view and its callbacks can be freed
             try:
                 await button_interaction.message.edit(view=view)  # Update the message view
             except discord.errors.NotFound:
@@ -405,6 +750,7 @@ class DwCommands(app_commands.Group):
 
         # Close button callback
         async def close_button_callback(button_interaction):
+            view.stop()  # Stop listening so the view and its callbacks can be freed
             try:
                 await interaction.delete_original_response()  # Delete the original interaction response
             except discord.errors.NotFound:
@@ -413,7 +759,8 @@ class DwCommands(app_commands.Group):
         close_button = Button(label="Close", style=discord.ButtonStyle.danger)  # Create a close button
         close_button.callback = close_button_callback  # Set the callback function for the close button
 
-        view = View()  # Create a view to hold the buttons
+        view = View(timeout=PROMPT_VIEW_TIMEOUT)  # Create a view to hold the buttons, it is dropped once it times out
+        view.on_timeout = remove_prompt(interaction)  # Remove the stale prompt when the buttons expire
         view.add_item(button)  # Add the edit button to the view
         view.add_item(close_button)  # Add the close button to the view
 
@@ -421,11 +768,12 @@ class DwCommands(app_commands.Group):
 
     # Command to remove the EPIC Account ID
     @app_commands.command(name="remove", description="Remove your EPIC Account ID")
+    @instrument_command("remove")
     async def dw_remove(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)  # Get the user's Discord ID as a string
 
         # Check if the user has an EPIC Account ID
-        if user_id not in user_epic_ids:
+        if user_id not in epic_registry:
             await interaction.response.send_message("You don't have an EPIC Account ID set.", ephemeral=True)
             return  # If the user doesn't have an EPIC ID, notify them and exit
 
@@ -435,8 +783,11 @@ class DwCommands(app_commands.Group):
                 await button_interaction.response.send_message("You are not authorized to use this button.", ephemeral=True)
                 return  # Ensure the button interaction is authorized
 
-            del user_epic_ids[user_id]  # Remove the EPIC ID from the dictionary
-            save_epic_ids()  # Save the updated EPIC IDs to the JSON file
+            view.stop()  # Stop listening so the view and its callbacks can be freed
+            await epic_store.delete(user_id)  # Persist first, the registry only changes once the store has
+            removed_epic_id = epic_registry.apply(user_id, None)  # Remove the EPIC ID from the registry
+            if removed_epic_id is not None:
+                deverse.invalidate_wallet(removed_epic_id)  # Drop the cached wallet lookup
 
             await button_interaction.response.send_message("Your EPIC Account ID has been removed.", ephemeral=True)
             await interaction.channel.send(f"{button_interaction.user.mention} has successfully removed their EPIC Account ID.")
@@ -448,6 +799,7 @@ class DwCommands(app_commands.Group):
         close_button = Button(label="Cancel", style=discord.ButtonStyle.secondary)  # Create a close button
 
         async def close_button_callback(button_interaction):
+            view.stop()  # Stop listening so the view and its callbacks can be freed
             try:
                 await interaction.delete_original_response()  # Delete the original interaction response
             except discord.errors.NotFound:
@@ -455,7 +807,8 @@ class DwCommands(app_commands.Group):
 
         close_button.callback = close_button_callback  # Set the callback for the close button
 
-        view = View()  # Create a view to hold the buttons
+        view = View(timeout=PROMPT_VIEW_TIMEOUT)  # Create a view to hold the buttons, it is dropped once it times out
+        view.on_timeout = remove_prompt(interaction)  # Remove the stale prompt when the buttons expire
         view.add_item(confirm_button)  # Add the confirm button
         view.add_item(close_button)  # Add the close button
 
@@ -463,39 +816,69 @@ class DwCommands(app_commands.Group):
 
     # Command to list all EPIC Account IDs (Admin only)
     @app_commands.command(name="list", description="List all EPIC Account IDs (Admin only)")
+    @instrument_command("list")
     async def dw_list(self, interaction: discord.Interaction):
         if not is_admin(interaction):
             await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
             return  # Ensure that only users with the Admin role can use this command
 
-        if user_epic_ids:
-            embed = discord.Embed(title="List of EPIC Account IDs", color=discord.Color.green())  # Create an embed for listing EPIC IDs
-            data_list = []
+        if epic_registry:
+            page = 0  # Index of the page currently shown
 
-            for user_id, epic_id in user_epic_ids.items():
-                user = await bot.fetch_user(int(user_id))
-                username = user.name if user else f"User ID: {user_id}"  # Get the username or user ID if the user is not found
-                embed.add_field(name=username, value=epic_id, inline=False)  # Add each user's EPIC ID to the embed
-                data_list.append({'EpicID': epic_id, 'Points': 0, 'OilPoints': 0, 'EnergyPoints': 0})  # Prepare data for CSV export
+            # Build the embed for the current page, resolving only the names shown on it
+            async def build_page_embed():
+                nonlocal page
+                page_count = max(1, -(-len(epic_registry) // LIST_PAGE_SIZE))
+                page = max(0, min(page, page_count - 1))  # The registry may have shrunk since the last click
+                entries = epic_registry.page(page * LIST_PAGE_SIZE, LIST_PAGE_SIZE)
+                names = await resolve_user_names(interaction.guild, [user_id for user_id, _ in entries])
+
+                embed = discord.Embed(title="List of EPIC Account IDs", color=discord.Color.green())  # Create an embed for listing EPIC IDs
+                for user_id, epic_id in entries:
+                    embed.add_field(name=names.get(user_id) or f"User ID: {user_id}", value=epic_id, inline=False)  # Add each user's EPIC ID to the embed
+                embed.set_footer(text=f"Page {page + 1}/{page_count} - {len(epic_registry)} EPIC Account IDs")
+                prev_button.disabled = page == 0
+                next_button.disabled = page >= page_count - 1
+                return embed
+
+            prev_button = Button(label="Previous", style=discord.ButtonStyle.secondary)  # Create a button to go to the previous page
+            next_button = Button(label="Next", style=discord.ButtonStyle.secondary)  # Create a button to go to the next page
+
+            async def change_page(button_interaction, step):
+                nonlocal page
+                page += step
+                await button_interaction.response.defer()  # Resolving the names may outlast the 3 second interaction deadline
+                embed = await build_page_embed()
+                await button_interaction.edit_original_response(embed=embed, view=view)  # Show the new page in place
+
+            async def prev_button_callback(button_interaction):
+                await change_page(button_interaction, -1)
+
+            async def next_button_callback(button_interaction):
+                await change_page(button_interaction, 1)
+
+            prev_button.callback = prev_button_callback  # Set the callback function for the previous button
+            next_button.callback = next_button_callback  # Set the callback function for the next button
 
             export_button = Button(label="Export to CSV", style=discord.ButtonStyle.primary)  # Create an export button to export the list to a CSV file
 
             async def export_button_callback(button_interaction):
-                df = pd.DataFrame(data_list)
+                await button_interaction.response.defer(ephemeral=True, thinking=True)  # Large registries take a moment to export
+                epic_ids = list(epic_registry.as_dict().values())  # Snapshot the IDs so registrations during the export cannot disturb it
+                compress = len(epic_ids) > EXPORT_GZIP_THRESHOLD
+                export_file = await asyncio.to_thread(export_registry_csv, epic_ids, compress)  # Stream the rows into a buffer off the event loop
+                filename = "epic_ids_list.csv.gz" if compress else "epic_ids_list.csv"
                 try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_file:
-                        temp_file_path = tmp_file.name
-                        df.to_csv(temp_file_path, index=False)  # Save the data to a temporary CSV file
-
-                    await button_interaction.response.send_message(file=discord.File(temp_file_path, filename="epic_ids_list.csv"), ephemeral=True)  # Send the CSV file as a response
+                    await button_interaction.followup.send(file=discord.File(export_file, filename=filename), ephemeral=True)  # Send the CSV file as a response
                 finally:
-                    os.remove(temp_file_path)  # Clean up the temporary file after sending
+                    export_file.close()  # Release the buffer after sending
 
             export_button.callback = export_button_callback  # Set the callback function for the export button
 
             close_button = Button(label="Close", style=discord.ButtonStyle.danger)  # Create a close button
 
             async def close_button_callback(button_interaction):
+                view.stop()  # Stop listening so the view and its callbacks can be freed
                 try:
                     await interaction.delete_original_response()  # Delete the original interaction response
                 except discord.errors.NotFound:
@@ -503,92 +886,348 @@ class DwCommands(app_commands.Group):
 
             close_button.callback = close_button_callback  # Set the callback function for the close button
 
-            view = View()  # Create a view to hold the buttons
+            view = View(timeout=LIST_VIEW_TIMEOUT)  # Create a view to hold the buttons
+            view.add_item(prev_button)  # Add the previous page button to the view
+            view.add_item(next_button)  # Add the next page button to the view
             view.add_item(export_button)  # Add the export button to the view
             view.add_item(close_button)  # Add the close button to the view
 
-            await interaction.response.send_message(embed=embed, view=view, ephemeral=True)  # Send the embed with the buttons
+            await interaction.response.defer(ephemeral=True)  # Resolving names may take a moment
+            embed = await build_page_embed()
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)  # Send the embed with the buttons
         else:
             await interaction.response.send_message("No EPIC Account IDs have been set yet.", ephemeral=True)  # Notify the user if there are no EPIC IDs set
 
     # Command to distribute DP based on a CSV file (Admin only)
     @app_commands.command(name="distribute", description="Distribute DP, Oil, and Energy based on a CSV file (Admin only)")
-    async def dw_distribute(self, interaction: Interaction, file: discord.Attachment):
+    @app_commands.describe(policy="What to do if the CSV asks for more than the Bot Bank Account holds")
+    @app_commands.choices(policy=[app_commands.Choice(name=description, value=name) for name, description in SHORTFALL_POLICIES.items()])
+    @instrument_command("distribute")
+    async def dw_distribute(self, interaction: Interaction, file: discord.Attachment, policy: str = None):
         await interaction.response.defer(ephemeral=True)  # Defer the response to ensure enough time for processing
 
         if not is_admin(interaction):
             await interaction.followup.send("You do not have the necessary permissions to use this command.", ephemeral=True)
             return  # Ensure that only users with the Admin role can use this command
 
-        if user_epic_ids:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_file:
-                temp_file_path = tmp_file.name
+        if file.size > PAYOUT_CSV_MAX_BYTES:
+            await interaction.followup.send(f"The CSV file is too large. The limit is {PAYOUT_CSV_MAX_BYTES // (1024 * 1024)} MB.", ephemeral=True)
+            return  # Refuse files that would not fit in memory
 
-            await file.save(fp=temp_file_path)  # Save the uploaded CSV file to a temporary location
+        csv_bytes = await file.read()  # Read the uploaded CSV into memory, no temporary file needed
 
-            data = pd.read_csv(temp_file_path)  # Load the CSV file into a DataFrame
-            data.columns = data.columns.str.strip()  # Strip any whitespace from the column names
+        try:
+            job_id, validation, plan = await prepare_payout(csv_bytes, policy, str(interaction.user.id), str(interaction.channel_id))
+        except ValueError as e:
+            await interaction.followup.send(str(e), ephemeral=True)
+            return  # Nothing was transferred, the CSV or the bank balance has to be fixed first
 
-            required_columns = {"EpicID", "Points", "OilPoints", "EnergyPoints"}  # Define the required columns in the CSV
-            if not required_columns.issubset(data.columns):
-                await interaction.followup.send("The CSV file must contain 'EpicID', 'Points', 'OilPoints', and 'EnergyPoints' columns.", ephemeral=True)
-                return  # Check if the CSV file has the required columns
+        status_message = await interaction.followup.send(f"Validation passed.\n{validation.summary()}\n{plan.summary()}\nDistribution job {job_id} started for {validation.total_rows} rows...", ephemeral=True, wait=True)
 
-            data['EpicID'] = data['EpicID'].str.strip().str.lower()  # Normalize the EPIC IDs for case-insensitive comparison
-            normalized_user_epic_ids = {k: v.strip().lower() for k, v in user_epic_ids.items()}  # Normalize the stored EPIC IDs
+        try:
+            report = await run_payout(job_id, status_message, plan.balances)  # Planned against a balance fetched moments ago
+        except ValueError as e:
+            await interaction.followup.send(f"Distribution job {job_id} failed. {e}", ephemeral=True)
+            return  # Notify the admin if the job could not run
 
-            bot_balance_data, error = get_wallet_balance("5DSFYPkB2b6auEwZxqbkAWa213EbBfDtRuaRrnivA3RvoMyg")  # Check the bot's bank account balance
-            if error or not bot_balance_data:
-                await interaction.followup.send(f"Failed to check Bot Bank Account balance. {error}", ephemeral=True)
-                return  # Notify the user if the balance retrieval fails
+        await send_payout_report(interaction, job_id, report)  # Totals in the message, every row in the attached CSV
 
-            dp_balance = next((item['balance'] for item in bot_balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 1), 0)
-            oil_balance = next((item['balance'] for item in bot_balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 2), 0)
-            energy_balance = next((item['balance'] for item in bot_balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 3), 0)
 
-            if dp_balance <= 0 or oil_balance <= 0 or energy_balance <= 0:
-                await interaction.followup.send("Insufficient balance in the Bot Bank Account for one or more resources.", ephemeral=True)
-                return  # Ensure the bot has enough resources to distribute
+    # Command to show registry and cache statistics (Admin only)
+    @app_commands.command(name="stats", description="Show registry and cache statistics (Admin only)")
+    @instrument_command("stats")
+    async def dw_stats(self, interaction: discord.Interaction):
+        if not is_admin(interaction):
+            await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
 
-            results = []  # Initialize a list to store results for reporting
+        wallet_stats = wallet_cache.stats()
+        balance_stats = balance_cache.stats()
+        embed = discord.Embed(title="Bot Statistics", color=discord.Color.green())
+        embed.add_field(name="Registered EPIC IDs", value=f"{len(epic_registry)}", inline=False)
+        embed.add_field(name="Wallet Cache", value=(
+            f"Entries: {wallet_stats['size']}\n"
+            f"Hits: {wallet_stats['hits']}\n"
+            f"Misses: {wallet_stats['misses']}\n"
+            f"Hit rate: {wallet_stats['hit_rate']:.1%}"
+        ), inline=True)
+        embed.add_field(name="Balance Cache", value=(
+            f"Entries: {balance_stats['size']}\n"
+            f"Hits: {balance_stats['hits']}\n"
+            f"Misses: {balance_stats['misses']}\n"
+            f"Coalesced: {balance_stats['coalesced']}"
+        ), inline=True)
+        embed.add_field(name="API Circuits", value="\n".join(
+            f"{endpoint}: {breaker.state}, limit {int(deverse.limits[endpoint].limit)}" for endpoint, breaker in deverse.breakers.items()), inline=True)
+        cooldown_stats = await shared_limits.stats() if shared_limits is not None else button_limits.stats()
+        embed.add_field(name="Pending DM Prompts", value=f"{len(dm_router)}", inline=True)
+        embed.add_field(name="Active Cooldowns", value="\n".join(f"{command}: {count}" for command, count in cooldown_stats.items()) or "None", inline=True)
 
-            for _, row in data.iterrows():
-                epic_id = row['EpicID']
-                dp_points = row['Points']
-                oil_points = row['OilPoints']
-                energy_points = row['EnergyPoints']
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
-                if dp_points > dp_balance or oil_points > oil_balance or energy_points > energy_balance:
-                    results.append(f"Not enough resources to distribute to {epic_id}.")
-                    continue  # Skip the distribution if there aren't enough resources
+    # Command to list, inspect or resume distribution jobs (Admin only)
+    @app_commands.command(name="job", description="List, inspect or resume distribution jobs (Admin only)")
+    @app_commands.describe(action="What to do", job_id="The job ID shown when the distribution started")
+    @app_commands.choices(action=[
+        app_commands.Choice(name="List recent jobs", value="list"),
+        app_commands.Choice(name="Inspect a job", value="inspect"),
+        app_commands.Choice(name="Resume a job", value="resume"),
+    ])
+    @instrument_command("job")
+    async def dw_job(self, interaction: discord.Interaction, action: str, job_id: str = None):
+        if not is_admin(interaction):
+            await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
 
-                user_id = {v: k for k, v in normalized_user_epic_ids.items()}.get(epic_id)
+        await interaction.response.defer(ephemeral=True)  # Defer the response to ensure enough time for processing
 
-                if user_id:
-                    id_wallet, error = get_wallet_by_epic_id(epic_id)
-                    if error or not id_wallet:
-                        results.append(f"Failed to retrieve wallet for Epic ID {epic_id}. {error}")
-                        continue  # Skip the distribution if the wallet retrieval fails
+        if action == "list":
+            jobs = await payout_journal.list_jobs()
+            if not jobs:
+                await interaction.followup.send("No distribution jobs have been run yet.", ephemeral=True)
+                return
+            lines = [f"`{job['job_id']}` {job['status']} - {job['total_rows']} rows - started <t:{int(job['created_at'])}:R>" for job in jobs]
+            await interaction.followup.send("Recent distribution jobs:\n" + "\n".join(lines), ephemeral=True)
+            return
+
+        job = await payout_journal.get_job(job_id) if job_id else None
+        if job is None:
+            await interaction.followup.send("Please provide a valid job ID. Use the list action to see recent jobs.", ephemeral=True)
+            return  # Both inspect and resume need an existing job
+
+        if action == "inspect":
+            counts = await payout_journal.transfer_counts(job_id)
+            uncertain = await payout_journal.uncertain_transfers(job_id)
+            embed = discord.Embed(title=f"Distribution Job {job_id}", color=discord.Color.green())
+            embed.add_field(name="Status", value=job['status'], inline=True)
+            embed.add_field(name="Rows", value=f"{job['total_rows']}", inline=True)
+            embed.add_field(name="Started", value=f"<t:{int(job['created_at'])}:f>", inline=True)
+            embed.add_field(name="Transfers", value=(
+                f"Succeeded: {counts.get('succeeded', 0)}\n"
+                f"Failed: {counts.get('failed', 0)}\n"
+                f"Unknown outcome: {counts.get('sent', 0)}"
+            ), inline=False)
+            if uncertain:
+                lines = []
+                for item in uncertain:
+                    line = f"Row {item['row_index'] + 2}: asset {item['asset_id']}, {item['points']:g} to {item['epic_id']}"
+                    if sum(len(kept) + 1 for kept in lines) + len(line) > EMBED_FIELD_LIMIT - 40:
+                        break  # Leave room for the line counting the rest
+                    lines.append(line)
+                remaining = counts.get('sent', 0) - len(lines)
+                if remaining > 0:
+                    lines.append(f"...and {remaining} more.")
+                embed.add_field(name="Check manually", value="\n".join(lines), inline=False)
+            await interaction.followup.send(embed=embed, ephemeral=True)
+            return
+
+        # Resume the job from its journal, transfers that already went out are skipped
+        status_message = await interaction.followup.send(f"Resuming distribution job {job_id}...", ephemeral=True, wait=True)
+
+        try:
+            report = await run_payout(job_id, status_message)
+        except ValueError as e:
+            await interaction.followup.send(str(e), ephemeral=True)
+            return
+
+        await send_payout_report(interaction, job_id, report)
+
+    # Command to schedule a distribution for later or on repeat (Admin only)
+    @app_commands.command(name="schedule", description="Schedule a distribution from a CSV file for later or on repeat (Admin only)")
+    @app_commands.describe(when="UTC time: HH:MM, YYYY-MM-DD HH:MM, 'in 2h', or 'offpeak' for the next off-peak window",
+                           repeat="Run it once, every day or every week",
+                           policy="What to do if the CSV asks for more than the Bot Bank Account holds at run time")
+    @app_commands.choices(repeat=[
+        app_commands.Choice(name="Once", value="once"),
+        app_commands.Choice(name="Daily", value="daily"),
+        app_commands.Choice(name="Weekly", value="weekly"),
+    ], policy=[app_commands.Choice(name=description, value=name) for name, description in SHORTFALL_POLICIES.items()])
+    @instrument_command("schedule")
+    async def dw_schedule(self, interaction: Interaction, file: discord.Attachment, when: str, repeat: str = "once", policy: str = None):
+        await interaction.response.defer(ephemeral=True)  # Defer the response to ensure enough time for processing
 
-                    for resource_name, points, asset_id in [("DP", dp_points, 1), ("Oil", oil_points, 2), ("Energy", energy_points, 3)]:
-                        if points > 0:
-                            success, error = transfer_resource(id_wallet, points, asset_id)
-                            if success:
-                                results.append(f"Successfully distributed {points} {resource_name} to {epic_id} (User: {user_id}).")
-                            else:
-                                results.append(f"Failed to distribute {points} {resource_name} to {epic_id}. {error}")
+        if not is_admin(interaction):
+            await interaction.followup.send("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
 
-                else:
-                    results.append(f"User with Epic ID {epic_id} not found in the server.")  # Notify if the EPIC ID is not found
+        if file.size > PAYOUT_CSV_MAX_BYTES:
+            await interaction.followup.send(f"The CSV file is too large. The limit is {PAYOUT_CSV_MAX_BYTES // (1024 * 1024)} MB.", ephemeral=True)
+            return  # Refuse files that would not fit in memory
+
+        csv_bytes = await file.read()
+
+        try:
+            start, off_peak = parse_start_time(when, datetime.now(timezone.utc), SCHEDULE_OFF_PEAK)
+            validation = await check_payout_csv(csv_bytes)  # Catch a broken CSV now, the bank balance is checked at run time
+        except ValueError as e:
+            await interaction.followup.send(str(e), ephemeral=True)
+            return
+
+        schedule_id = await payout_schedules.create(csv_bytes, validation.total_rows, start, repeat, off_peak, policy,
+                                                    str(interaction.user.id), str(interaction.channel_id), file.filename)
+        window = f" within the off-peak window {SCHEDULE_OFF_PEAK}" if off_peak else ""
+        await interaction.followup.send(f"Distribution {schedule_id} of {validation.total_rows} rows scheduled {repeat} from <t:{int(start.timestamp())}:f>{window}. "
+                                        "You will get the report by DM after each run.", ephemeral=True)
+
+    # Command to list, pause, resume or cancel scheduled distributions (Admin only)
+    @app_commands.command(name="schedules", description="List, pause, resume or cancel scheduled distributions (Admin only)")
+    @app_commands.describe(action="What to do", schedule_id="The schedule ID shown when the distribution was scheduled")
+    @app_commands.choices(action=[
+        app_commands.Choice(name="List scheduled distributions", value="list"),
+        app_commands.Choice(name="Pause a schedule", value="pause"),
+        app_commands.Choice(name="Resume a schedule", value="resume"),
+        app_commands.Choice(name="Cancel a schedule", value="cancel"),
+    ])
+    @instrument_command("schedules")
+    async def dw_schedules(self, interaction: discord.Interaction, action: str, schedule_id: str = None):
+        if not is_admin(interaction):
+            await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
 
-            result_message = "\n".join(results)  # Combine all results into a single message
-            await interaction.followup.send(f"Distribution process completed:\n{result_message}", ephemeral=True)  # Send the results as a response
-        else:
-            await interaction.followup.send("No EPIC Account IDs have been set yet.", ephemeral=True)  # Notify if no EPIC IDs are set
+        if action == "list":
+            schedules = await payout_schedules.list()
+            if not schedules:
+                await interaction.response.send_message("No distributions are scheduled.", ephemeral=True)
+                return
+            message = "Scheduled distributions:"
+            for shown, schedule in enumerate(schedules):
+                state = "running" if schedule['schedule_id'] in payout_scheduler.running else schedule['status']
+                line = f"`{schedule['schedule_id']}` {state} - {schedule['repeat']} - {schedule['total_rows']} rows - next <t:{int(schedule['next_run'])}:R>"
+                if schedule['last_run']:
+                    outcome = schedule['last_error'].splitlines()[0][:SCHEDULE_ERROR_PREVIEW] if schedule['last_error'] else f"job {schedule['last_job_id']}"
+                    line += f" - last run <t:{int(schedule['last_run'])}:R>: {outcome}"  # Full errors were sent to the admin by DM
+                more = f"\n...and {len(schedules) - shown} more."
+                if len(message) + len(line) + 1 + len(more) > MESSAGE_LIMIT:
+                    message += more
+                    break
+                message += "\n" + line
+            await interaction.response.send_message(message, ephemeral=True)
+            return
+
+        status = {"pause": SCHEDULE_PAUSED, "resume": SCHEDULE_ACTIVE, "cancel": SCHEDULE_CANCELLED}[action]
+        if not schedule_id or not await payout_schedules.set_status(schedule_id, status):
+            await interaction.response.send_message("Please provide the ID of a pending schedule. Use the list action to see them.", ephemeral=True)
+            return
+        running = " The run in progress finishes first." if schedule_id in payout_scheduler.running and action != "resume" else ""
+        await interaction.response.send_message(f"Schedule {schedule_id} is now {status}.{running}", ephemeral=True)
+
+    # Command to snapshot the balances of all registered users (Admin only)
+    @app_commands.command(name="balances", description="Snapshot the balances of all registered users (Admin only)")
+    @app_commands.describe(max_age="Reuse balances from the last snapshot younger than this many seconds, 0 refreshes everything")
+    @instrument_command("balances")
+    async def dw_balances(self, interaction: discord.Interaction, max_age: int = None):
+        global last_snapshot
+        if not is_admin(interaction):
+            await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
+
+        if not epic_registry:
+            await interaction.response.send_message("No EPIC Account IDs have been set yet.", ephemeral=True)
+            return
+        if snapshot_lock.locked():
+            await interaction.response.send_message("A balance snapshot is already running. Please wait for it to finish.", ephemeral=True)
+            return
 
+        await interaction.response.defer(ephemeral=True)  # Defer the response to ensure enough time for processing
+        status_message = await interaction.followup.send(f"Taking a balance snapshot of {len(epic_registry)} EPIC Account IDs...", ephemeral=True, wait=True)
+
+        async def report_progress(done, total):
+            try:
+                await status_message.edit(content=f"Balance snapshot in progress: {done}/{total} wallets.")
+            except discord.HTTPException:
+                pass  # A failed progress update should never stop the snapshot
+
+        async with snapshot_lock:
+            started = time.monotonic()
+            entries = list(epic_registry.items())  # Registrations during the snapshot cannot disturb it
+            snapshot = await take_snapshot(deverse, entries, last_snapshot, SNAPSHOT_MAX_AGE if max_age is None else max_age,
+                                           SNAPSHOT_CONCURRENCY, SNAPSHOT_REQUESTS_PER_SECOND, progress=report_progress)
+            last_snapshot = snapshot
+            elapsed = time.monotonic() - started
+
+        totals = snapshot.totals()
+        embed = discord.Embed(title="Balance Snapshot", color=discord.Color.green())
+        embed.add_field(name="Wallets", value=(
+            f"Total: {len(snapshot)}\n"
+            f"Refreshed: {snapshot.fetched}\n"
+            f"Reused: {snapshot.reused}\n"
+            f"Failed: {snapshot.failed}"
+        ), inline=True)
+        embed.add_field(name="Totals", value="\n".join(f"{asset.name}: {totals[asset.asset_id]:,.0f}" for asset in ASSETS), inline=True)
+        embed.set_footer(text=f"Taken in {elapsed:.1f}s")
+
+        compress = len(snapshot) > EXPORT_GZIP_THRESHOLD
+        export_file = await asyncio.to_thread(snapshot.export_csv, compress)  # Build the CSV off the event loop
+        filename = "balance_snapshot.csv.gz" if compress else "balance_snapshot.csv"
+        try:
+            try:
+                await interaction.followup.send(embed=embed, file=discord.File(export_file, filename=filename), ephemeral=True)
+            except discord.HTTPException:
+                export_file.seek(0)
+                await interaction.user.send(embed=embed, file=discord.File(export_file, filename=filename))  # The interaction token expired during a long snapshot
+        finally:
+            export_file.close()
+
+    # Command to toggle the sampling profiler (Admin only)
+    @app_commands.command(name="profile", description="Start or stop the sampling profiler (Admin only)")
+    @app_commands.describe(action="What to do")
+    @app_commands.choices(action=[
+        app_commands.Choice(name="Start profiling", value="start"),
+        app_commands.Choice(name="Stop and show the report", value="stop"),
+    ])
+    @instrument_command("profile")
+    async def dw_profile(self, interaction: discord.Interaction, action: str):
+        if not is_admin(interaction):
+            await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
+
+        try:
+            if action == "start":
+                profiler.start()
+                await interaction.response.send_message("Profiler started. Run this command with the stop action to see where the time went.", ephemeral=True)
+            else:
+                report = profiler.stop()
+                await interaction.response.send_message(f"```\n{report[:1900]}\n```", ephemeral=True)  # Stay under Discord's message limit
+        except ValueError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+
+    # Command to show event loop lag and recent stalls (Admin only)
+    @app_commands.command(name="diagnostics", description="Show event loop lag and recent stalls (Admin only)")
+    @instrument_command("diagnostics")
+    async def dw_diagnostics(self, interaction: discord.Interaction):
+        if not is_admin(interaction):
+            await interaction.response.send_message("You do not have the necessary permissions to use this command.", ephemeral=True)
+            return  # Ensure that only users with the Admin role can use this command
+
+        lag = loop_monitor.stats()
+        embed = discord.Embed(title="Event Loop Diagnostics", color=discord.Color.green())
+        embed.add_field(name="Lag", value=(
+            f"p50: {lag['p50']:.1f} ms\n"
+            f"p95: {lag['p95']:.1f} ms\n"
+            f"p99: {lag['p99']:.1f} ms\n"
+            f"Max: {lag['max']:.1f} ms"
+        ), inline=True)
+        embed.add_field(name="Stalls", value=(
+            f"Over {LOOP_LAG_THRESHOLD * 1000:.0f} ms: {lag['stalls']}\n"
+            f"Heartbeats: {lag['samples']}"
+        ), inline=True)
+        if loop_monitor.stalls:
+            lines = []
+            for stall in reversed(loop_monitor.stalls):
+                duration = f"{stall['lag'] * 1000:.0f} ms" if stall['lag'] is not None else "ongoing"
+                lines.append(f"<t:{int(stall['at'])}:R> {duration} in `{stall['where']}`")
+            embed.add_field(name="Recent stalls", value="\n".join(lines)[:1024], inline=False)  # Full stacks are in the log
+        if LOOP_DEV_MODE:
+            embed.add_field(name="Blocking calls on the loop", value="\n".join(
+                f"`{site}` {event} x{count}" for (event, site), count in loop_monitor.blocking_calls.most_common(10))[:1024] or "None", inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # Register the command group with the bot
 bot.tree.add_command(DwCommands())  # Add the command group to the bot's command tree
 
-# Run the bot with your token
-bot.run(DISCORD_TOKEN)  # Start the bot with the Discord token
+# Run the bot with your token, importing the module only builds the bot so benchmarks can drive the commands offline
+if __name__ == "__main__":
+    if DISCORD_TOKEN is None:
+        raise ValueError("Discord token not found. Please check your .env file.")  # Raises an error if the token is not found
+    bot.run(DISCORD_TOKEN)  # Start the bot with the Discord token
@@ -0,0 +1,56 @@
+# An asset the bot shows, exports and distributes
+class Asset:
+    __slots__ = ("asset_id", "name", "csv_column")
+
+    def __init__(self, asset_id, name, csv_column):
+        self.asset_id = asset_id
+        self.name = name  # Shown in embeds and reports
+        self.csv_column = csv_column  # Points column of the payout CSV
+
+    def __repr__(self):
+        return f"Asset({self.asset_id}, {self.name!r})"
+
+
+# Every asset in display and CSV column order, adding one here adds it to embeds, exports, plans and transfers
+ASSETS = (
+    Asset(1, "DP", "Points"),
+    Asset(2, "Oil", "OilPoints"),
+    Asset(3, "Energy", "EnergyPoints"),
+)
+ASSET_IDS = tuple(asset.asset_id for asset in ASSETS)
+ASSETS_BY_ID = {asset.asset_id: asset for asset in ASSETS}
+POINT_COLUMNS = [asset.csv_column for asset in ASSETS]
+_POSITIONS = {asset.asset_id: position for position, asset in enumerate(ASSETS)}
+
+
+# Balances of one wallet, one slot per asset in ASSETS order
+# Slots and a tuple keep it small, bulk snapshots hold one per registered user
+class WalletBalance:
+    __slots__ = ("amounts",)
+
+    def __init__(self, amounts):
+        self.amounts = tuple(amounts)
+
+    # Build from a balance API result in a single pass, assets missing from the response hold 0
+    @classmethod
+    def from_api(cls, balance_data):
+        amounts = [0] * len(ASSETS)
+        for item in balance_data.get('non_native_ft_balances', ()):
+            position = _POSITIONS.get(item['asset_id'])
+            if position is not None:
+                amounts[position] = item['balance']
+        return cls(amounts)
+
+    def __getitem__(self, asset_id):
+        return self.amounts[_POSITIONS[asset_id]]
+
+    # (asset, balance) pairs in display order
+    def items(self):
+        return zip(ASSETS, self.amounts)
+
+    # Balances keyed by asset ID, the shape used by payout plans and budgets
+    def as_dict(self):
+        return dict(zip(ASSET_IDS, self.amounts))
+
+    def __repr__(self):
+        return f"WalletBalance({', '.join(f'{asset.name}={amount}' for asset, amount in self.items())})"
@@ -0,0 +1,120 @@
+import time
+import asyncio
+from array import array
+
+from assets import ASSETS, WalletBalance
+from registry import normalize_epic_id
+from registry_export import write_csv
+from distribution import DistributionEngine, DEFAULT_PROGRESS_INTERVAL
+
+SNAPSHOT_COLUMNS = ["EpicID", "UserID", "WalletID"] + [asset.name for asset in ASSETS] + ["FetchedAt", "Error"]
+
+DEFAULT_SNAPSHOT_CONCURRENCY = 32  # Wallets fetched at once
+DEFAULT_SNAPSHOT_REQUESTS_PER_SECOND = 100  # Upstream request budget of a snapshot
+DEFAULT_SNAPSHOT_MAX_AGE = 900  # Seconds an entry of the previous snapshot is reused without refetching
+
+
+# Balances of all registered users stored column by column, one row per EPIC ID in registry order
+class BalanceSnapshot:
+    def __init__(self, size):
+        self.epic_ids = [None] * size
+        self.user_ids = [None] * size
+        self.wallets = [None] * size
+        self.balances = {asset.asset_id: array('d', bytes(8 * size)) for asset in ASSETS}  # Packed doubles, 8 bytes a row
+        self.fetched_at = array('d', bytes(8 * size))
+        self.errors = [None] * size
+        self.taken_at = time.time()
+        self.reused = 0  # Rows copied from the previous snapshot
+        self.fetched = 0  # Rows refreshed from the API
+        self._rows = None
+
+    def __len__(self):
+        return len(self.epic_ids)
+
+    # Row of an EPIC ID, or None if it is not in the snapshot
+    def row(self, epic_id):
+        if self._rows is None:
+            self._rows = {normalize_epic_id(epic_id): index for index, epic_id in enumerate(self.epic_ids) if epic_id}
+        return self._rows.get(normalize_epic_id(epic_id))
+
+    @property
+    def failed(self):
+        return sum(error is not None for error in self.errors)
+
+    # Sum of every asset over the rows that were fetched successfully
+    def totals(self):
+        return {asset_id: sum(column) for asset_id, column in self.balances.items()}  # Failed rows hold zeros
+
+    # Stream the snapshot into a CSV, optionally gzip-compressed, returns a file object at the start
+    def export_csv(self, compress=False):
+        columns = [self.balances[asset.asset_id] for asset in ASSETS]
+        return write_csv(SNAPSHOT_COLUMNS, (
+            (self.epic_ids[i], self.user_ids[i], self.wallets[i] or "", *(_format(column[i]) for column in columns),
+             int(self.fetched_at[i]), self.errors[i] or "")
+            for i in range(len(self))), compress)
+
+
+# Show whole balances without a decimal point
+def _format(value):
+    return int(value) if value.is_integer() else value
+
+
+# Fetch the balances of every (user_id, epic_id) entry with bounded parallel fan-out
+# Rows of the previous snapshot younger than max_age are reused, older ones keep their wallet ID and only refresh the balance
+async def take_snapshot(client, entries, previous=None, max_age=DEFAULT_SNAPSHOT_MAX_AGE, concurrency=DEFAULT_SNAPSHOT_CONCURRENCY,
+                        requests_per_second=DEFAULT_SNAPSHOT_REQUESTS_PER_SECOND, progress=None, progress_interval=DEFAULT_PROGRESS_INTERVAL):
+    entries = list(entries)
+    snapshot = BalanceSnapshot(len(entries))
+    engine = DistributionEngine(client, max_in_flight=concurrency, requests_per_second=requests_per_second)
+    now = time.time()
+    pending = iter(range(len(entries)))
+    done = 0
+    last_report = time.monotonic()
+
+    def copy_previous(index, old):
+        snapshot.wallets[index] = previous.wallets[old]
+        for asset_id, column in snapshot.balances.items():
+            column[index] = previous.balances[asset_id][old]
+        snapshot.fetched_at[index] = previous.fetched_at[old]
+
+    async def fetch(index):
+        user_id, epic_id = entries[index]
+        snapshot.user_ids[index] = user_id
+        snapshot.epic_ids[index] = epic_id
+
+        old = previous.row(epic_id) if previous is not None else None
+        if old is not None and previous.errors[old] is None:
+            if now - previous.fetched_at[old] < max_age:
+                copy_previous(index, old)
+                snapshot.reused += 1
+                return
+            id_wallet = previous.wallets[old]  # Wallet IDs do not change, only the balance is stale
+        else:
+            id_wallet, error = await engine.call(client.get_wallet_by_epic_id, epic_id)
+            if error or not id_wallet:
+                snapshot.errors[index] = f"Failed to retrieve wallet. {error}"
+                return
+
+        snapshot.wallets[index] = id_wallet
+        balance_data, error = await engine.call(client.get_wallet_balance, id_wallet)
+        if error or balance_data is None:
+            snapshot.errors[index] = f"Failed to retrieve balance. {error}"
+            return
+        for asset, balance in WalletBalance.from_api(balance_data).items():
+            snapshot.balances[asset.asset_id][index] = balance
+        snapshot.fetched_at[index] = time.time()
+        snapshot.fetched += 1
+
+    async def worker():
+        nonlocal done, last_report
+        for index in pending:  # Workers share one iterator, each index is taken exactly once
+            await fetch(index)
+            done += 1
+            if progress and time.monotonic() - last_report >= progress_interval:
+                last_report = time.monotonic()
+                await progress(done, len(entries))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(entries))))))
+    if progress:
+        await progress(done, len(entries))
+    return snapshot
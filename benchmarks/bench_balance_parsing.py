@@ -0,0 +1,47 @@
+# Benchmark parsing balance API results: the old three next() scans per response against WalletBalance.from_api
+# Also compares the memory held by many parsed balances as dicts and as WalletBalance objects
+# Usage: python -m benchmarks.bench_balance_parsing [responses]
+import sys
+import time
+import tracemalloc
+
+from assets import ASSET_IDS, WalletBalance
+
+
+def make_response(i, extra_assets):
+    balances = [{"asset_id": asset_id, "balance": i * 10 + asset_id} for asset_id in range(10, 10 + extra_assets)]  # Assets the bot does not track
+    balances += [{"asset_id": asset_id, "balance": i + asset_id} for asset_id in ASSET_IDS]
+    return {"non_native_ft_balances": balances}
+
+
+def parse_with_next(balance_data):
+    dp_balance = next((item['balance'] for item in balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 1), 0)
+    oil_balance = next((item['balance'] for item in balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 2), 0)
+    energy_balance = next((item['balance'] for item in balance_data.get('non_native_ft_balances', []) if item['asset_id'] == 3), 0)
+    return {1: dp_balance, 2: oil_balance, 3: energy_balance}
+
+
+def measure(parse, responses):
+    start = time.perf_counter()
+    for response in responses:
+        parse(response)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    kept = [parse(response) for response in responses]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return elapsed, current
+
+
+def main(count):
+    for extra_assets in (0, 10):
+        responses = [make_response(i, extra_assets) for i in range(count)]
+        print(f"{count} responses, {extra_assets} untracked assets listed first")
+        for label, parse in (("3x next()", parse_with_next), ("from_api", WalletBalance.from_api)):
+            elapsed, held = measure(parse, responses)
+            print(f"  {label:>10}: {elapsed / count * 1e6:6.2f} us/response  {held / count:6.0f} bytes held per balance")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,54 @@
+# Benchmark a balance snapshot of many wallets against the stub API: one-at-a-time /view style lookups against the fan-out
+# Also times a second snapshot that reuses fresh rows of the first one
+# Usage: python -m benchmarks.bench_balance_snapshot [wallets] [latency_ms]
+import sys
+import time
+import asyncio
+
+from deverse_api import DeverseClient
+from balance_snapshot import take_snapshot, DEFAULT_SNAPSHOT_CONCURRENCY
+from benchmarks.stub_api import StubDeverseApi
+
+SEQUENTIAL_SAMPLE = 200  # Wallets timed one at a time, the full sequential run is extrapolated
+
+
+async def main(wallets, latency):
+    stub = await StubDeverseApi(latency=latency).start()
+    entries = [(str(i), f"{i:032x}") for i in range(wallets)]
+    try:
+        client = DeverseClient(*stub.urls, "dw-token", "bear-token")
+        start = time.perf_counter()
+        for _, epic_id in entries[:SEQUENTIAL_SAMPLE]:
+            id_wallet, _ = await client.get_wallet_by_epic_id(epic_id)
+            await client.get_wallet_balance(id_wallet)
+        per_wallet = (time.perf_counter() - start) / SEQUENTIAL_SAMPLE
+        await client.close()
+        print(f"{wallets} wallets, {latency * 1000:.0f} ms upstream latency")
+        print(f"  one at a time: {per_wallet * wallets / 60:7.1f} min (extrapolated from {SEQUENTIAL_SAMPLE})")
+
+        client = DeverseClient(*stub.urls, "dw-token", "bear-token", max_concurrency=DEFAULT_SNAPSHOT_CONCURRENCY)
+        for label, previous_snapshot, max_age in (("fan-out", None, 0), ("re-run, all fresh", "first", 900), ("re-run, all stale", "first", 0)):
+            previous = snapshot if previous_snapshot else None
+            calls = dict(stub.calls)
+            start = time.perf_counter()
+            result = await take_snapshot(client, entries, previous, max_age=max_age, requests_per_second=None)
+            elapsed = time.perf_counter() - start
+            upstream = sum(stub.calls.values()) - sum(calls.values())
+            print(f"  {label:>17}: {elapsed:7.1f} s  {wallets / elapsed:7.0f} wallets/s  {upstream:6} upstream calls  {result.failed} failed")
+            if previous_snapshot is None:
+                snapshot = result
+        await client.close()
+
+        start = time.perf_counter()
+        export_file = snapshot.export_csv(compress=True)
+        export_file.seek(0, 2)
+        print(f"  export: {(time.perf_counter() - start) * 1000:.0f} ms, {export_file.tell() / 1e6:.2f} MB gzip")
+        export_file.close()
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    wallets = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+    asyncio.run(main(wallets, latency))
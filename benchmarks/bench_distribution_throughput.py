@@ -0,0 +1,41 @@
+# Benchmark payout throughput of the distribution engine against a local fake transfer API
+# Usage: python -m benchmarks.bench_distribution_throughput [rows] [latency_seconds] [requests_per_second]
+import sys
+import time
+import asyncio
+
+from deverse_api import DeverseClient
+from distribution import DistributionEngine, BudgetTracker
+from payout_report import OUTCOME_PAID
+from benchmarks.stub_api import StubDeverseApi
+
+
+async def run(label, client, rows, max_in_flight, requests_per_second):
+    engine = DistributionEngine(client, max_in_flight=max_in_flight, requests_per_second=requests_per_second)
+    budget = BudgetTracker({1: 10**12, 2: 10**12, 3: 10**12})
+    start = time.perf_counter()
+    report = await engine.run(rows, lambda epic_id: "user", budget)
+    elapsed = time.perf_counter() - start
+    ok = report.outcomes[OUTCOME_PAID]
+    print(f"{label:>12}: {len(rows)} rows in {elapsed:7.2f}s  {len(rows) / elapsed:8.1f} rows/s  {ok} transfers ok")
+
+
+async def main(row_count, latency, requests_per_second):
+    stub = StubDeverseApi(latency=latency).start_in_thread()
+    client = DeverseClient(*stub.urls, dw_token="x", bear_token="x")
+    rows = [(f"{i:032d}", 10, 5, 1) for i in range(row_count)]
+    try:
+        print(f"{row_count} rows, {latency * 1000:.0f}ms upstream latency, {requests_per_second} req/s budget")
+        await run("sequential", client, rows[:max(1, row_count // 10)], 1, None)
+        await run("concurrent", client, rows, 20, requests_per_second)
+        print(f"upstream calls: {stub.calls}")
+    finally:
+        await client.close()
+        stub.stop_thread()
+
+
+if __name__ == "__main__":
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    requests_per_second = float(sys.argv[3]) if len(sys.argv) > 3 else 500
+    asyncio.run(main(row_count, latency, requests_per_second))
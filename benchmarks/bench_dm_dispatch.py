@@ -0,0 +1,87 @@
+# Benchmark message dispatch with many EPIC ID prompts open at once, bot.wait_for listeners against the DM router
+# Every incoming message, DM or not, is checked against all wait_for predicates, the router does one dict lookup
+# Usage: python -m benchmarks.bench_dm_dispatch [pending_prompts] [messages]
+import sys
+import time
+import asyncio
+
+import discord
+
+from conversations import DmRouter
+
+
+# The parts of a discord.Message the predicates look at
+class FakeMessage:
+    def __init__(self, author_id, is_dm):
+        self.author = author_id
+        self.is_dm = is_dm
+        self.content = "x" * 32
+
+
+async def bench_wait_for(pending, messages):
+    client = discord.Client(intents=discord.Intents.default())
+    client.loop = asyncio.get_running_loop()  # wait_for needs the loop, no login required
+
+    def waiter(user_id):
+        # Same shape as the old check: author matches and the message is a DM
+        return client.wait_for('message', check=lambda msg: msg.author == user_id and msg.is_dm, timeout=60)
+
+    tasks = [asyncio.ensure_future(waiter(user_id)) for user_id in range(pending)]
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    for i in range(messages):
+        client.dispatch('message', FakeMessage(pending + i, i % 2 == 0))  # Traffic from users without an open prompt
+    elapsed = time.perf_counter() - start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return elapsed
+
+
+async def bench_router(pending, messages):
+    router = DmRouter()
+    tasks = [asyncio.ensure_future(router.wait_for_reply(user_id, 60)) for user_id in range(pending)]
+    await asyncio.sleep(0)
+
+    def on_message(message):  # What the bot's on_message listener does
+        if message.is_dm:
+            router.dispatch(message.author, message)
+
+    start = time.perf_counter()
+    for i in range(messages):
+        on_message(FakeMessage(pending + i, i % 2 == 0))
+    elapsed = time.perf_counter() - start
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return elapsed
+
+
+# Time from a reply arriving to the waiting flow resuming, for every pending prompt answered at once
+async def bench_replies(pending):
+    router = DmRouter()
+    tasks = [asyncio.ensure_future(router.wait_for_reply(user_id, 60)) for user_id in range(pending)]
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    for user_id in range(pending):
+        router.dispatch(user_id, FakeMessage(user_id, True))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+async def main(pending, messages):
+    print(f"{pending} pending prompts, {messages} incoming messages")
+    for label, bench in (("wait_for", bench_wait_for), ("router", bench_router)):
+        elapsed = await bench(pending, messages)
+        print(f"  {label:>8}: {elapsed * 1000:8.1f} ms total  {elapsed / messages * 1e6:8.2f} us/message")
+    elapsed = await bench_replies(pending)
+    print(f"  answering all {pending} prompts through the router: {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    pending = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    asyncio.run(main(pending, messages))
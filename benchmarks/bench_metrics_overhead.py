@@ -0,0 +1,72 @@
+# Benchmark the cost of instrumentation per call: raw metric updates and the command and API decorators
+# Usage: python -m benchmarks.bench_metrics_overhead [iterations]
+import sys
+import time
+import asyncio
+
+from metrics import MetricsRegistry, instrument_api, instrument_command
+
+BUDGET_US = 5.0  # Per-call overhead we accept, an upstream call takes milliseconds
+
+
+def per_call_us(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def per_await_us(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def plain_api():
+    return "wallet", None
+
+
+@instrument_api("bench")
+async def instrumented_api():
+    return "wallet", None
+
+
+async def plain_command():
+    return None
+
+
+@instrument_command("bench")
+async def instrumented_command():
+    return None
+
+
+async def main(iterations):
+    registry = MetricsRegistry()
+    counter = registry.counter("bench_total", "Bench counter", ["endpoint", "status"])
+    histogram = registry.histogram("bench_seconds", "Bench histogram", ["endpoint"])
+
+    results = [
+        ("counter.inc", per_call_us(lambda: counter.inc("balance", "ok"), iterations), 0.0),
+        ("histogram.observe", per_call_us(lambda: histogram.observe(0.042, "balance"), iterations), 0.0),
+    ]
+    baseline = await per_await_us(plain_api, iterations)
+    results.append(("instrument_api", await per_await_us(instrumented_api, iterations), baseline))
+    baseline = await per_await_us(plain_command, iterations)
+    results.append(("instrument_command", await per_await_us(instrumented_command, iterations), baseline))
+
+    for label, cost, baseline in results:
+        overhead = cost - baseline
+        verdict = "ok" if overhead <= BUDGET_US else "OVER BUDGET"
+        print(f"{label:>20}: {overhead:6.3f} us/call overhead  ({verdict}, budget {BUDGET_US} us)")
+
+    start = time.perf_counter()
+    for i in range(20):
+        histogram.observe(0.01, f"endpoint{i}")
+    text = registry.render()
+    print(f"{'render':>20}: {(time.perf_counter() - start) * 1000:6.3f} ms for {len(text.splitlines())} lines")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    asyncio.run(main(iterations))
@@ -0,0 +1,50 @@
+# Benchmark streaming ingestion and validation of a large payout CSV
+# Usage: python -m benchmarks.bench_payout_ingestion [rows] [chunk_size]
+import sys
+import time
+import asyncio
+import tracemalloc
+
+from payout_csv import validate_payout_csv, aiter_payout_rows, DEFAULT_CHUNK_SIZE
+
+
+def build_csv(rows):
+    lines = ["EpicID,Points,OilPoints,EnergyPoints"]
+    lines.extend(f"{i:032x},{i % 100},{i % 10},1" for i in range(rows))
+    return ("\n".join(lines) + "\n").encode()
+
+
+async def consume(csv_bytes, chunk_size):
+    count = 0
+    async for _ in aiter_payout_rows(csv_bytes, chunk_size):
+        count += 1
+    return count
+
+
+def main(rows, chunk_size):
+    csv_bytes = build_csv(rows)
+    print(f"{rows} rows, {len(csv_bytes) / 1e6:.1f} MB, chunks of {chunk_size}")
+
+    # Time and peak memory are measured in separate runs, tracemalloc slows pandas down considerably
+    start = time.perf_counter()
+    validation = validate_payout_csv(csv_bytes, chunk_size)
+    validate_time = time.perf_counter() - start
+    start = time.perf_counter()
+    count = asyncio.run(consume(csv_bytes, chunk_size))
+    stream_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    validate_payout_csv(csv_bytes, chunk_size)
+    _, validate_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    asyncio.run(consume(csv_bytes, chunk_size))
+    _, stream_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"validate: {validate_time:7.2f}s  peak {validate_peak / 1e6:8.1f} MB  ok={validation.ok}")
+    print(f"  stream: {stream_time:7.2f}s  peak {stream_peak / 1e6:8.1f} MB  rows={count}")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CHUNK_SIZE
+    main(rows, chunk_size)
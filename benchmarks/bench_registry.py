@@ -0,0 +1,43 @@
+# Micro-benchmark of EPIC ID uniqueness checks and payout matching before and after the reverse index
+# Usage: python -m benchmarks.bench_registry [users] [payout_rows]
+import sys
+import time
+
+from registry import EpicIdRegistry
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(users, payout_rows):
+    user_epic_ids = {str(10**17 + i): f"{i:032x}" for i in range(users)}
+    registry = EpicIdRegistry(user_epic_ids)
+    probes = [f"{i:032x}" for i in range(users - 100, users)]  # Worst case for the linear scan
+    csv_ids = [f"{i * 7 % users:032x}" for i in range(payout_rows)]
+
+    print(f"{users} registered users, {payout_rows} payout rows")
+
+    scan = timed(lambda: [epic_id in user_epic_ids.values() for epic_id in probes]) / len(probes)
+    indexed = timed(lambda: [registry.is_taken(epic_id) for epic_id in probes]) / len(probes)
+    print(f"uniqueness check   before {scan * 1e6:12.1f}us  after {indexed * 1e6:8.3f}us")
+
+    # The old loop rebuilt both the normalized map and its inverse for every CSV row, sample a few rows and extrapolate
+    sample = csv_ids[:20]
+
+    def old_matching():
+        normalized = {k: v.strip().lower() for k, v in user_epic_ids.items()}
+        for epic_id in sample:
+            {v: k for k, v in normalized.items()}.get(epic_id)
+
+    before = timed(old_matching) / len(sample) * payout_rows
+    after = timed(lambda: [registry.user_for_epic_id(epic_id) for epic_id in csv_ids])
+    print(f"payout matching    before {before:12.2f}s   after {after:8.4f}s")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    payout_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+    main(users, payout_rows)
@@ -0,0 +1,61 @@
+# Benchmark peak memory and time of the registry CSV export, old pandas path against the streaming export
+# Usage: python -m benchmarks.bench_registry_export [sizes...]
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+from registry_export import export_registry_csv
+
+
+def pandas_export(epic_ids):
+    import pandas as pd
+    data_list = [{'EpicID': epic_id, 'Points': 0, 'OilPoints': 0, 'EnergyPoints': 0} for epic_id in epic_ids]
+    df = pd.DataFrame(data_list)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_file:
+        temp_file_path = tmp_file.name
+        df.to_csv(temp_file_path, index=False)
+    size = os.path.getsize(temp_file_path)
+    os.remove(temp_file_path)
+    return size
+
+
+def streaming_export(epic_ids, compress):
+    export_file = export_registry_csv(epic_ids, compress)
+    export_file.seek(0, os.SEEK_END)
+    size = export_file.tell()
+    export_file.close()
+    return size
+
+
+def measure(func, *args):
+    # Time and peak memory come from separate runs, tracemalloc slows allocation-heavy code down
+    start = time.perf_counter()
+    size = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main(sizes):
+    for size in sizes:
+        epic_ids = [f"{i:032x}" for i in range(size)]
+        print(f"{size} users")
+        try:
+            import pandas  # noqa: F401
+            rows = [("pandas", pandas_export, (epic_ids,))]
+        except ImportError:
+            rows = []
+        rows += [("stream", streaming_export, (epic_ids, False)), ("stream+gz", streaming_export, (epic_ids, True))]
+        for label, func, args in rows:
+            elapsed, peak, output = measure(func, *args)
+            print(f"  {label:>9}: {elapsed:6.2f}s  peak {peak / 1e6:8.1f} MB  file {output / 1e6:6.1f} MB")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    main(sizes)
@@ -0,0 +1,85 @@
+# Benchmark bot cold start: import time of the helper modules, time to ready and resident memory
+# Usage: python -m benchmarks.bench_startup [--live]
+# --live starts Discord_bot.py for real and needs DISCORD_TOKEN in the environment or .env
+import sys
+import time
+import subprocess
+
+HELPER_MODULES = ["deverse_api", "registry", "registry_export", "cache", "storage", "payout_csv", "payout_plan", "payout_jobs", "distribution"]
+HEAVY_MODULES = ["pandas", "numpy"]
+READY_TIMEOUT = 120
+
+
+# Import every helper module in a fresh interpreter so nothing is already cached
+def measure_imports():
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"for name in {HELPER_MODULES!r}: __import__(name)\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]\n"
+        "rss = [line.split()[1] for line in open('/proc/self/status') if line.startswith('VmRSS')]\n"
+        "print(elapsed, ','.join(heavy) or '-', rss[0] if rss else 0)\n"
+    )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), output[1], int(output[2])
+
+
+# Cost of the deferred imports, paid by the first payout instead of by every start
+def measure_deferred():
+    code = "import time; start = time.perf_counter(); import pandas; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    return float(result.stdout) if result.returncode == 0 else None
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+# Start the bot and time the log lines for login and ready
+def measure_live():
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", "Discord_bot.py"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    logged_in = ready = None
+    try:
+        for line in process.stdout:
+            now = time.perf_counter() - start
+            if logged_in is None and "logging in using static token" in line:
+                logged_in = now
+            if "We have logged in as" in line:
+                ready = now
+                break
+            if now > READY_TIMEOUT:
+                break
+        rss = rss_kb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    return logged_in, ready, rss
+
+
+def main(live):
+    elapsed, heavy, rss = measure_imports()
+    print(f"helper imports: {elapsed * 1000:7.1f} ms  rss {rss / 1024:6.1f} MB  heavy modules loaded: {heavy}")
+    deferred = measure_deferred()
+    if deferred is not None:
+        print(f"deferred pandas import: {deferred * 1000:7.1f} ms (paid on the first payout or validation)")
+
+    if live:
+        logged_in, ready, rss = measure_live()
+        if ready is None:
+            print("bot did not become ready, check DISCORD_TOKEN and the bot output")
+            return
+        login = f"{logged_in:6.2f}s" if logged_in is not None else "     -"
+        print(f"login: {login}  ready: {ready:6.2f}s  rss at ready {rss / 1024:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main("--live" in sys.argv[1:])
@@ -0,0 +1,56 @@
+# Benchmark per-write latency and startup load time of the EPIC ID registry stores
+# Usage: python -m benchmarks.bench_storage [sizes...]
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+
+from storage import JsonRegistryStore, SqliteRegistryStore
+
+
+def seed(directory, size):
+    data = {str(10**17 + i): f"{i:032x}" for i in range(size)}
+    json_path = os.path.join(directory, f"epic_ids_{size}.json")
+    with open(json_path, 'w') as f:
+        json.dump(data, f)
+    return json_path
+
+
+async def measure(store, writes):
+    start = time.perf_counter()
+    store.load()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(writes):
+        await store.put(str(i), f"bench{i:027d}")  # Never collides with the seeded hex IDs
+    write_time = (time.perf_counter() - start) / writes
+    return load_time, write_time
+
+
+async def main(sizes):
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            json_path = seed(directory, size)
+            json_writes = 3 if size >= 1_000_000 else 10  # Every JSON write rewrites the whole file
+
+            store = JsonRegistryStore(json_path)
+            json_load, json_write = await measure(store, json_writes)
+            store.close()
+
+            store = SqliteRegistryStore(os.path.join(directory, f"epic_ids_{size}.db"), legacy_json_path=json_path)
+            start = time.perf_counter()
+            store.load()  # First start migrates the JSON file
+            migrate = time.perf_counter() - start
+            sqlite_load, sqlite_write = await measure(store, 1000)
+            store.close()
+
+            print(f"{size:>9} users  json: load {json_load:7.3f}s write {json_write * 1000:9.2f}ms   "
+                  f"sqlite: migrate {migrate:7.3f}s load {sqlite_load:7.3f}s write {sqlite_write * 1000:7.3f}ms")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    asyncio.run(main(sizes))
@@ -0,0 +1,72 @@
+# Benchmark /dw-commands view latency under concurrent load against a local stub API
+# Usage: python -m benchmarks.bench_view_latency [users] [latency_seconds]
+import sys
+import time
+import asyncio
+
+from deverse_api import DeverseClient
+from benchmarks.stub_api import StubDeverseApi, percentile
+
+
+# Measure how late a 10ms ticker wakes up while the load runs
+async def measure_loop_lag(samples, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(time.perf_counter() - start - 0.01)
+
+
+# The API work done by dw_view through the async client
+async def view_async(client, epic_id):
+    id_wallet, error = await client.get_wallet_by_epic_id(epic_id)
+    if id_wallet:
+        await client.get_wallet_balance(id_wallet)
+
+
+# The API work done by dw_view with the old blocking requests helpers
+async def view_blocking(urls, epic_id):
+    import requests
+    wallet_url, balance_url, _ = urls
+    wallet = requests.get(f"{wallet_url}{epic_id}").json()['data']['thx']['id_wallet']
+    requests.get(f"{balance_url}{wallet}/chain")
+
+
+async def run(label, view, users):
+    latencies, lag = [], []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(measure_loop_lag(lag, stop))
+
+    async def one(i):
+        start = time.perf_counter()
+        await view(f"{i:032d}")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(users)))
+    total = time.perf_counter() - start
+    stop.set()
+    await ticker
+    print(f"{label:>9}: total {total:7.3f}s  p50 {percentile(latencies, 50) * 1000:8.1f}ms  "
+          f"p99 {percentile(latencies, 99) * 1000:8.1f}ms  max loop lag {max(lag, default=0) * 1000:8.1f}ms")
+
+
+async def main(users, latency):
+    stub = StubDeverseApi(latency=latency).start_in_thread()
+    client = DeverseClient(*stub.urls, dw_token="x", bear_token="x")
+    try:
+        print(f"{users} concurrent /view users, {latency * 1000:.0f}ms upstream latency")
+        try:
+            import requests  # noqa: F401
+            await run("blocking", lambda epic_id: view_blocking(stub.urls, epic_id), users)
+        except ImportError:
+            print(" blocking: skipped (requests not installed)")
+        await run("async", lambda epic_id: view_async(client, epic_id), users)
+    finally:
+        await client.close()
+        stub.stop_thread()
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    asyncio.run(main(users, latency))
@@ -0,0 +1,117 @@
+# Fault injection against the stub API: outages, slow responses and recovery, with and without circuit breakers
+# Each scenario prints what happened and PASS or FAIL for the behaviour the breakers are meant to guarantee
+# Usage: python -m benchmarks.fault_injection
+import time
+import asyncio
+
+from deverse_api import DeverseClient
+from distribution import DistributionEngine, BudgetTracker
+from payout_report import OUTCOME_PAID
+from benchmarks.stub_api import StubDeverseApi, percentile
+
+NO_BREAKER = 10**9  # Failure threshold that never opens the circuit
+
+
+def make_client(stub, failure_threshold, recovery_time=1.0, timeout=5):
+    return DeverseClient(*stub.urls, "dw-token", "bear-token", timeout=timeout,
+                         failure_threshold=failure_threshold, recovery_time=recovery_time)
+
+
+def verdict(ok):
+    return "PASS" if ok else "FAIL"
+
+
+# Many /view clicks while the wallet API answers 503 after a delay
+async def scenario_outage(stub):
+    print("outage: wallet API returns 503 after 200 ms, 200 concurrent lookups")
+    stub.latency, stub.error_rate = 0.2, 1.0
+    stats = {}
+    for label, threshold in (("aimd only", NO_BREAKER), ("breaker", 5)):
+        client = make_client(stub, threshold)
+        stub.calls["wallet"] = 0
+        latencies = []
+
+        async def lookup(i):
+            start = time.perf_counter()
+            await client.get_wallet_by_epic_id(f"{i:032x}")
+            latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(lookup(i) for i in range(200)))
+        await client.close()
+        stats[label] = (stub.calls["wallet"], percentile(latencies, 50))
+        print(f"  {label:>10}: {stub.calls['wallet']:4} upstream calls  p50 {percentile(latencies, 50) * 1000:7.1f} ms  p99 {percentile(latencies, 99) * 1000:7.1f} ms")
+    print(f"  {verdict(stats['breaker'][0] < stats['aimd only'][0] / 4)}: the breaker sheds most upstream calls")
+
+
+# Responses slower than the client timeout count as failures too
+async def scenario_timeouts(stub):
+    print("timeouts: balance API takes 2 s, client timeout 0.5 s, 50 lookups in sequence")
+    stub.latency, stub.error_rate = 2.0, 0.0
+    client = make_client(stub, 3, recovery_time=10, timeout=0.5)
+    stub.calls["balance"] = 0
+    start = time.perf_counter()
+    for i in range(50):
+        await client.get_wallet_balance(f"wallet-{i}", use_cache=False)
+    elapsed = time.perf_counter() - start
+    await client.close()
+    print(f"  {stub.calls['balance']} upstream calls in {elapsed:.1f}s, circuit {client.breakers['balance'].state}")
+    print(f"  {verdict(stub.calls['balance'] == 3 and elapsed < 3)}: three timeouts open the circuit, the rest fail immediately")
+
+
+# Overload shrinks the concurrency limit, a healthy endpoint grows it back
+async def scenario_aimd(stub):
+    print("aimd: transfer API fails 50% of requests, then recovers")
+    client = make_client(stub, NO_BREAKER)
+    limit = client.limits["transfer"]
+    stub.latency, stub.error_rate = 0.01, 0.5
+    await asyncio.gather(*(client.transfer_resource(f"wallet-{i}", 1, 1) for i in range(200)))
+    degraded = limit.limit
+    stub.error_rate = 0.0
+    await asyncio.gather(*(client.transfer_resource(f"wallet-{i}", 1, 1) for i in range(2000)))
+    recovered = limit.limit
+    await client.close()
+    print(f"  limit {limit.maximum} -> {degraded:.1f} under errors -> {recovered:.1f} after recovery")
+    print(f"  {verdict(degraded < limit.maximum / 2 and recovered > degraded * 2)}: the limit backs off and grows back")
+
+
+# A payout started during an outage pauses and completes once the API is back
+async def scenario_distribution(stub):
+    print("distribution: APIs down for the first 3 s of a 100 row payout")
+    rows = [(f"{i:032x}", 1, 0, 0) for i in range(100)]
+    for label, threshold in (("aimd only", NO_BREAKER), ("breaker", 5)):
+        client = make_client(stub, threshold, recovery_time=0.5)
+        engine = DistributionEngine(client, max_in_flight=10, requests_per_second=None, backoff=0.05)
+        stub.latency, stub.error_rate = 0.01, 0.0
+        stub.calls["transfer"] = 0
+        stub.transfers.clear()
+
+        async def outage():
+            stub.error_rate = 1.0
+            await asyncio.sleep(3)
+            stub.error_rate = 0.0
+
+        outage_task = asyncio.ensure_future(outage())
+        start = time.perf_counter()
+        report = await engine.run(rows, lambda epic_id: "user", BudgetTracker({1: 10**9, 2: 0, 3: 0}))
+        elapsed = time.perf_counter() - start
+        await outage_task
+        await client.close()
+        paid = report.outcomes[OUTCOME_PAID]  # One transfer per row
+        print(f"  {label:>10}: {paid:3}/100 rows paid in {elapsed:4.1f}s, {stub.calls['transfer']:4} transfer calls")
+        if threshold != NO_BREAKER:
+            print(f"  {verdict(paid == 100)}: every row waited for the API instead of failing")
+
+
+async def main():
+    stub = await StubDeverseApi().start()
+    try:
+        await scenario_outage(stub)
+        await scenario_timeouts(stub)
+        await scenario_aimd(stub)
+        await scenario_distribution(stub)
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,323 @@
+# Offline load test of the slash commands: drives the DwCommands handlers with synthetic interactions and DMs
+# The bot module is imported without connecting to Discord and talks to the stub Deverse API
+# Usage: python -m benchmarks.load_harness [--users N] [--concurrency N] [--latency MS] [--save FILE] [--compare FILE]
+# --compare exits with status 1 when a command got slower or lost throughput beyond --tolerance, use it as a regression gate
+import io
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import importlib
+
+import discord
+
+from assets import POINT_COLUMNS
+from benchmarks.stub_api import StubDeverseApi, percentile
+
+ADMIN_ROLE = "Admins"
+LIST_PAGES = 5  # Pages an admin flips through per /list
+DISTRIBUTE_RUNS = 3  # Payouts of every registered user, each is heavy
+MIN_TAIL_SAMPLES = 20  # Fewer calls than this are compared on their median
+
+
+# Minimal stand-ins for the discord.py objects the handlers touch
+class FakeMessage:
+    def __init__(self, content=None, author=None, channel=None):
+        self.content = content
+        self.author = author
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeAvatar:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeUser:
+    bot = False
+    avatar = FakeAvatar()
+
+    def __init__(self, user_id, roles=()):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.roles = list(roles)
+        self.on_dm = None  # Called with every DM the bot sends, the simulated user answers through it
+        self.dm_channel = discord.DMChannel.__new__(discord.DMChannel)  # Only checked with isinstance by the DM router
+
+    async def send(self, content=None, **kwargs):
+        if self.on_dm is not None:
+            self.on_dm(content)
+        return FakeMessage(content)
+
+
+class FakeGuild:
+    def __init__(self, roles):
+        self.roles = roles
+
+    def get_member(self, user_id):
+        return FakeUser(user_id)  # Every name resolves from the member cache
+
+
+class FakeChannel:
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(content)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, view=None, **kwargs):
+        self.done = True
+        self.interaction.sent.append(content)
+        if view is not None:
+            self.interaction.view = view
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def edit_message(self, **kwargs):
+        self.done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, view=None, **kwargs):
+        self.interaction.sent.append(content)
+        if view is not None:
+            self.interaction.view = view
+        return FakeMessage(content)
+
+
+class FakeInteraction:
+    def __init__(self, user, guild, channel):
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.channel_id = 1
+        self.message = FakeMessage()
+        self.sent = []  # Everything the handler sent back, in order
+        self.view = None  # Last view attached to a response
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def delete_original_response(self):
+        pass
+
+    # Click the button with this label on the view the handler attached
+    async def click(self, label, user=None):
+        button = next(item for item in self.view.children if getattr(item, "label", None) == label)
+        button_interaction = FakeInteraction(user or self.user, self.guild, self.channel)
+        await button.callback(button_interaction)
+        return button_interaction
+
+
+class FakeAttachment:
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.filename = "payout.csv"
+
+    async def read(self):
+        return self.data
+
+
+class LoadHarness:
+    def __init__(self, bot_module, users, concurrency):
+        self.bot = bot_module
+        self.group = bot_module.bot.tree.get_command("dw-commands")
+        self.users = users
+        self.concurrency = concurrency
+        admin_role = FakeRole(ADMIN_ROLE)
+        self.guild = FakeGuild([admin_role])
+        self.channel = FakeChannel()
+        self.admin = FakeUser(10**17, roles=[admin_role])
+
+    def interaction(self, user):
+        return FakeInteraction(user, self.guild, self.channel)
+
+    async def invoke(self, name, interaction, **options):
+        await self.group.get_command(name).callback(self.group, interaction, **options)
+
+    # Run one task per item, at most concurrency at a time, returns (latencies, elapsed seconds)
+    async def drive(self, items, task):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+
+        async def timed(item):
+            async with semaphore:
+                start = time.perf_counter()
+                await task(item)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(timed(item) for item in items))
+        return latencies, time.perf_counter() - start
+
+    # /set, the button click and the EPIC ID answered by DM
+    async def set_epic_id(self, index):
+        user = FakeUser(index + 1)
+
+        def answer(content):
+            if content == self.bot.PROVIDE_EPIC_ID_MSG:
+                message = FakeMessage(f"{index:032x}", author=user, channel=user.dm_channel)
+                asyncio.ensure_future(self.bot.route_direct_message(message))  # Arrives once the prompt waits for it
+
+        user.on_dm = answer
+        interaction = self.interaction(user)
+        await self.invoke("set", interaction)
+        clicked = await interaction.click("Set EPIC Account ID")
+        if "Setup completed successfully!" not in clicked.sent:
+            raise RuntimeError(f"/set failed for user {user.id}: {clicked.sent}")
+
+    async def view(self, index):
+        interaction = self.interaction(FakeUser(index + 1))
+        await self.invoke("view", interaction)
+
+    async def list_pages(self, _):
+        interaction = self.interaction(self.admin)
+        await self.invoke("list", interaction)
+        for _ in range(LIST_PAGES - 1):
+            await interaction.click("Next")
+
+    async def distribute(self, csv_bytes):
+        interaction = self.interaction(self.admin)
+        await self.invoke("distribute", interaction, file=FakeAttachment(csv_bytes))
+        if not any(content and "completed" in content for content in interaction.sent):
+            raise RuntimeError(f"/distribute failed: {interaction.sent[-1]}")
+
+    def payout_csv(self):
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(["EpicID"] + POINT_COLUMNS)
+        writer.writerows([f"{index:032x}"] + [1] * len(POINT_COLUMNS) for index in range(self.users))
+        return text.getvalue().encode('utf-8')
+
+    async def run(self):
+        scenarios = (
+            ("set", range(self.users), self.set_epic_id),
+            ("view", range(self.users), self.view),
+            ("list", range(max(1, self.users // 10)), self.list_pages),
+            ("distribute", [self.payout_csv()] * DISTRIBUTE_RUNS, self.distribute),
+        )
+        results = {}
+        for name, items, task in scenarios:
+            if name == "distribute":
+                self.concurrency, concurrency = 1, self.concurrency  # Payouts from one bank wallet run one after another
+            latencies, elapsed = await self.drive(items, task)
+            if name == "distribute":
+                self.concurrency = concurrency
+            results[name] = {
+                "calls": len(latencies),
+                "throughput": len(latencies) / elapsed,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+            }
+        return results
+
+
+# Import Discord_bot against the stub API and throwaway databases, nothing connects to Discord
+def import_bot(stub, workdir):
+    api_url, balance_url, transfer_url = stub.urls
+    os.environ.update({
+        "DISCORD_TOKEN": "offline", "DW_TOKEN": "dw-token", "BEAR_TOKEN": "bear-token",
+        "API_URL": api_url, "BALANCE_API_URL": balance_url, "TRANSFER_API_URL": transfer_url,
+        "EPIC_ID_STORE": "sqlite", "EPIC_ID_DB": os.path.join(workdir, "epic_ids.db"),
+        "PAYOUT_JOURNAL_DB": os.path.join(workdir, "payout_jobs.db"), "WALLET_CACHE_PERSIST": "0",
+        "METRICS_PORT": "0", "SHARD_COUNT": "0", "SHARD_IDS": "", "PAYOUT_WORKERS": "inline",
+        "DISTRIBUTE_REQUESTS_PER_SECOND": "0",  # Unthrottled, the stub is local
+    })
+    os.chdir(workdir)  # The legacy epic_ids.json and other relative paths resolve here
+    bot_module = importlib.import_module("Discord_bot")
+    bot_module.admin_role_name = ADMIN_ROLE
+    bot_module.button_limits.configure("set", capacity=10**9, per=1)  # Each simulated user clicks once, never throttle the harness
+    return bot_module
+
+
+def print_results(results, baseline=None):
+    print(f"  {'command':>10} {'calls':>6} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in results.items():
+        line = f"  {name:>10} {row['calls']:6} {row['throughput']:9.1f} {row['p50_ms']:9.2f} {row['p95_ms']:9.2f} {row['p99_ms']:9.2f}"
+        if baseline and name in baseline:
+            line += f"   p95 {row['p95_ms'] / baseline[name]['p95_ms'] - 1:+.0%} ops/s {row['throughput'] / baseline[name]['throughput'] - 1:+.0%}"
+        print(line)
+
+
+# Commands whose tail latency or time per call grew by more than tolerance against the baseline
+# Changes under min_delta_ms are ignored, sub-millisecond commands swing by half from run to run
+def regressions(results, baseline, tolerance, min_delta_ms):
+    failed = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        tail = "p95_ms" if row["calls"] >= MIN_TAIL_SAMPLES else "p50_ms"  # The p95 of a handful of payouts is just the slowest one
+        for now, before in ((row[tail], base[tail]), (1000 / row["throughput"], 1000 / base["throughput"])):
+            if now > before * (1 + tolerance) and now - before > min_delta_ms:
+                failed.append(name)
+                break
+    return failed
+
+
+async def main(args):
+    stub = await StubDeverseApi(latency=args.latency / 1000).start()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+    save_path = os.path.abspath(args.save) if args.save else None
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            bot_module = import_bot(stub, workdir)
+            harness = LoadHarness(bot_module, args.users, args.concurrency)
+            print(f"{args.users} users, {args.concurrency} concurrent, {args.latency:.0f} ms upstream latency")
+            try:
+                results = await harness.run()
+            finally:
+                await bot_module.deverse.close()
+                bot_module.epic_store.close()
+                bot_module.payout_journal.close()
+                bot_module.payout_schedules.close()
+    finally:
+        await stub.stop()
+
+    print_results(results, baseline)
+    if save_path:
+        with open(save_path, 'w') as file:
+            json.dump({"users": args.users, "concurrency": args.concurrency, "latency_ms": args.latency, "results": results}, file, indent=2)
+    if baseline is not None:
+        failed = regressions(results, baseline, args.tolerance, args.min_delta)
+        print(f"  {'FAIL' if failed else 'PASS'}: {', '.join(failed) + ' regressed' if failed else 'no command regressed'} beyond {args.tolerance:.0%}")
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of the bot commands")
+    parser.add_argument("--users", type=int, default=1000, help="Simulated users, each sets an EPIC ID and views their balance")
+    parser.add_argument("--concurrency", type=int, default=50, help="Commands in flight at once")
+    parser.add_argument("--latency", type=float, default=20, help="Upstream latency of the stub API in milliseconds")
+    parser.add_argument("--save", help="Write the results to this JSON file, e.g. as a new baseline")
+    parser.add_argument("--compare", help="Baseline JSON written by --save to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before --compare fails, 0.25 is 25%%")
+    parser.add_argument("--min-delta", type=float, default=2.0, help="Slowdowns smaller than this many milliseconds never fail --compare")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,56 @@
+# Load test of many simultaneous /dw-commands view users against a local stub API
+# Usage: python -m benchmarks.loadtest_view [users] [views_per_user] [latency_seconds]
+import sys
+import time
+import random
+import asyncio
+
+from cache import TTLCache, CoalescingCache
+from deverse_api import DeverseClient
+from benchmarks.stub_api import StubDeverseApi, percentile
+
+
+# The API work done by dw_view
+async def view(client, epic_id):
+    id_wallet, error = await client.get_wallet_by_epic_id(epic_id)
+    if id_wallet:
+        await client.get_wallet_balance(id_wallet)
+
+
+async def run(label, stub, users, views_per_user, cached):
+    client = DeverseClient(*stub.urls, dw_token="x", bear_token="x",
+                           wallet_cache=TTLCache(100000, 3600) if cached else None,
+                           balance_cache=CoalescingCache(100000, 5) if cached else None)
+    stub.calls = dict.fromkeys(stub.calls, 0)
+    latencies = []
+
+    async def one(epic_id):
+        await asyncio.sleep(random.random() * 0.5)  # Everyone reacts to the announcement within half a second
+        start = time.perf_counter()
+        await view(client, epic_id)
+        latencies.append(time.perf_counter() - start)
+
+    epic_ids = [f"{user:032d}" for user in range(users) for _ in range(views_per_user)]
+    try:
+        await asyncio.gather(*(one(epic_id) for epic_id in epic_ids))
+    finally:
+        await client.close()
+    print(f"{label:>9}: {len(epic_ids)} views  upstream wallet {stub.calls['wallet']:6d} balance {stub.calls['balance']:6d}  "
+          f"p50 {percentile(latencies, 50) * 1000:8.1f}ms  p99 {percentile(latencies, 99) * 1000:8.1f}ms")
+
+
+async def main(users, views_per_user, latency):
+    stub = StubDeverseApi(latency=latency).start_in_thread()
+    try:
+        print(f"{users} users x {views_per_user} views, {latency * 1000:.0f}ms upstream latency")
+        await run("uncached", stub, users, views_per_user, cached=False)
+        await run("cached", stub, users, views_per_user, cached=True)
+    finally:
+        stub.stop_thread()
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    views_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    asyncio.run(main(users, views_per_user, latency))
@@ -0,0 +1,86 @@
+# Kill a payout job mid-run against a local fake transfer API, resume it and check nobody is paid twice
+# Usage: python -m benchmarks.payout_job_crash [rows] [kill_after_transfers]
+import os
+import sys
+import time
+import signal
+import asyncio
+import tempfile
+import subprocess
+from collections import Counter
+
+from deverse_api import DeverseClient
+from payout_plan import build_payout_plan
+from payout_jobs import PayoutJournal, PayoutJobRunner
+from benchmarks.stub_api import StubDeverseApi, BANK_WALLET
+
+
+# Child process: run or resume a job until it completes or is killed
+async def run_child(db_path, job_id, urls):
+    client = DeverseClient(*urls, dw_token="x", bear_token="x")
+    journal = PayoutJournal(db_path)
+    runner = PayoutJobRunner(client, journal, lambda epic_id: "user", BANK_WALLET, max_in_flight=10, requests_per_second=None)
+    try:
+        await runner.run(job_id)
+    finally:
+        await client.close()
+        journal.close()
+
+
+def spawn(db_path, job_id, urls):
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.payout_job_crash", "--child", db_path, job_id, *urls])
+
+
+async def create_job(db_path, rows):
+    csv_bytes = ("EpicID,Points,OilPoints,EnergyPoints\n" + "".join(f"{i:032x},10,5,1\n" for i in range(rows))).encode()
+    plan = build_payout_plan(csv_bytes, lambda epic_id: "user", {1: 10**12, 2: 10**12, 3: 10**12})
+    journal = PayoutJournal(db_path)
+    job_id = await journal.create_job(csv_bytes, plan, rows)
+    return journal, job_id
+
+
+def main(rows, kill_after):
+    stub = StubDeverseApi(latency=0.01).start_in_thread()
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "payout_jobs.db")
+        journal, job_id = asyncio.run(create_job(db_path, rows))
+
+        child = spawn(db_path, job_id, stub.urls)
+        while len(stub.transfers) < kill_after and child.poll() is None:
+            time.sleep(0.01)
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+        sent_before = len(stub.transfers)
+        print(f"killed job {job_id} after {sent_before} transfers")
+
+        start = time.perf_counter()
+        child = spawn(db_path, job_id, stub.urls)
+        child.wait()
+        print(f"resumed job finished in {time.perf_counter() - start:.2f}s with exit code {child.returncode}")
+
+        async def report():
+            counts = await journal.transfer_counts(job_id)
+            job = await journal.get_job(job_id)
+            journal.close()
+            return counts, job["status"]
+
+        counts, status = asyncio.run(report())
+
+    stub.stop_thread()
+    keys = Counter(transfer["idempotency_key"] for transfer in stub.transfers)
+    duplicates = sum(count - 1 for count in keys.values() if count > 1)
+    expected = rows * 3
+    print(f"job status: {status}, journal: {counts}")
+    print(f"transfers received {len(stub.transfers)} of {expected}, duplicates {duplicates}, "
+          f"left for manual check {counts.get('sent', 0)}")
+    assert duplicates == 0, "a transfer was sent twice"
+    assert len(keys) + counts.get('sent', 0) >= expected, "a transfer was skipped"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        asyncio.run(run_child(sys.argv[2], sys.argv[3], sys.argv[4:7]))
+    else:
+        rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+        kill_after = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+        main(rows, kill_after)
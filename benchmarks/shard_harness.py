@@ -0,0 +1,278 @@
+# Multi-process harness for a sharded deployment: several processes share the registry, cooldowns, DM inbox and payout queue
+# Each phase prints what the processes observed and PASS or FAIL for the consistency it is meant to guarantee
+# Usage: python -m benchmarks.shard_harness [processes]
+import io
+import os
+import sys
+import csv
+import time
+import random
+import signal
+import asyncio
+import tempfile
+import multiprocessing
+from collections import Counter
+
+from registry import EpicIdRegistry
+from storage import SqliteRegistryStore, sync_registry
+from ratelimit import CommandRateLimits, SharedRateLimits
+from conversations import DmRouter, SharedDmInbox
+from deverse_api import DeverseClient
+from payout_plan import build_payout_plan
+from payout_jobs import PayoutJournal, PayoutJobRunner, PayoutWorker, BANK_WALLET_ID, JOB_COMPLETED, TRANSFER_SUCCEEDED
+from assets import ASSET_IDS, POINT_COLUMNS
+from benchmarks.stub_api import StubDeverseApi
+
+USERS = 300  # Discord users clicking set, edit and remove
+EPIC_IDS = 200  # Fewer IDs than users, so processes keep racing for the same ones
+CHURN_OPS = 1500  # Registry operations per process
+COOLDOWN_USERS = 20
+COOLDOWN_PER = 1.0  # One click per second per user
+COOLDOWN_DURATION = 3.0
+JOBS = 6
+JOB_ROWS = 150
+JOB_LEASE = 1.5  # Short so a killed worker's job is taken over quickly
+
+
+def verdict(ok):
+    return "PASS" if ok else "FAIL"
+
+
+def epic_id(i):
+    return f"{i:032x}"
+
+
+# Random set, edit and remove traffic through the same store-first path as the bot, then one final sync
+async def registry_churn(path, seed, barrier):
+    store = SqliteRegistryStore(path)
+    registry = EpicIdRegistry(store.load())
+    rng = random.Random(seed)
+    refused_locally = refused_by_store = 0
+    for _ in range(CHURN_OPS):
+        if rng.random() < 0.2:
+            await sync_registry(store, registry)
+        user_id = str(rng.randrange(USERS))
+        if user_id in registry and rng.random() < 0.2:
+            registry.apply(user_id, None)
+            await store.delete(user_id)
+            continue
+        new_epic_id = epic_id(rng.randrange(EPIC_IDS))
+        if registry.is_taken(new_epic_id):
+            refused_locally += 1
+            continue
+        try:
+            await store.put(user_id, new_epic_id)
+        except ValueError:
+            refused_by_store += 1  # Another process registered it since our last sync
+            continue
+        registry.apply(user_id, new_epic_id)
+
+    await asyncio.to_thread(barrier.wait)  # Every process has finished writing
+    await sync_registry(store, registry)
+    owners = {registry.user_for_epic_id(value) for _, value in registry.items()}
+    store.close()
+    return dict(registry.items()), len(owners) == len(registry), refused_locally, refused_by_store
+
+
+def registry_process(path, seed, barrier, results):
+    results.put(asyncio.run(registry_churn(path, seed, barrier)))
+
+
+def phase_registry(ctx, workdir, processes):
+    print(f"registry: {processes} processes x {CHURN_OPS} set/edit/remove on {USERS} users and {EPIC_IDS} EPIC IDs")
+    path = os.path.join(workdir, "epic_ids.db")
+    SqliteRegistryStore(path).close()  # Create the schema once up front
+    barrier = ctx.Barrier(processes)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=registry_process, args=(path, seed, barrier, results)) for seed in range(processes)]
+    start = time.perf_counter()
+    for process in workers:
+        process.start()
+    outcomes = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    store = SqliteRegistryStore(path)
+    stored = store.load()
+    store.close()
+    converged = all(registry == stored for registry, _, _, _ in outcomes)
+    indexed = all(ok for _, ok, _, _ in outcomes)
+    owners = Counter(value.lower() for value in stored.values())
+    print(f"  {elapsed:.1f}s, {len(stored)} registrations, {sum(o[2] for o in outcomes)} refused from memory, "
+          f"{sum(o[3] for o in outcomes)} refused by the store after a cross-process race")
+    print(f"  {verdict(converged)}: every process ends with exactly the stored registry")
+    print(f"  {verdict(indexed and max(owners.values(), default=1) == 1)}: no EPIC ID has two owners in any process")
+
+
+# Hammer the same users' buttons from every process, returns clicks allowed per user
+async def cooldown_clicks(path, shared, start_at):
+    limits = SharedRateLimits(path, capacity=1, per=COOLDOWN_PER) if shared else CommandRateLimits(capacity=1, per=COOLDOWN_PER)
+    allowed = Counter()
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    while time.time() < start_at + COOLDOWN_DURATION:
+        for user_id in range(COOLDOWN_USERS):
+            wait = await limits.acquire("set", user_id) if shared else limits.acquire("set", user_id)
+            if not wait:
+                allowed[user_id] += 1
+        await asyncio.sleep(0.01)
+    if shared:
+        limits.close()
+    return allowed
+
+
+def cooldown_process(path, shared, start_at, results):
+    results.put(asyncio.run(cooldown_clicks(path, shared, start_at)))
+
+
+def phase_cooldowns(ctx, workdir, processes):
+    print(f"cooldowns: {processes} processes click for the same {COOLDOWN_USERS} users for {COOLDOWN_DURATION:.0f}s, one click per {COOLDOWN_PER:.0f}s allowed")
+    path = os.path.join(workdir, "shared_state.db")
+    SharedRateLimits(path, 1, 1).close()
+    bound = int(COOLDOWN_DURATION / COOLDOWN_PER) + 1
+    for label, shared in (("per process", False), ("shared", True)):
+        results = ctx.Queue()
+        start_at = time.time() + 1.0  # All processes start together once spawned
+        workers = [ctx.Process(target=cooldown_process, args=(path, shared, start_at, results)) for _ in range(processes)]
+        for process in workers:
+            process.start()
+        allowed = sum((results.get() for _ in workers), Counter())
+        for process in workers:
+            process.join()
+        worst = max(allowed.values())
+        print(f"  {label:>11}: at most {worst} clicks allowed per user (limit {bound})")
+    print(f"  {verdict(worst <= bound)}: shared cooldowns hold across processes")
+
+
+def post_reply(path, delay, content):
+    time.sleep(delay)
+    inbox = SharedDmInbox(path)
+    asyncio.run(inbox.post(42, content))
+    inbox.close()
+
+
+async def wait_for_relayed_reply(path):
+    router = DmRouter()
+    inbox = SharedDmInbox(path)
+    await inbox.post(42, "stale")  # Sent before the prompt opened, must not answer it
+
+    async def relay():
+        while True:
+            await asyncio.sleep(0.05)
+            for message in await inbox.take(router.waiting()):
+                router.dispatch(message.author_id, message)
+
+    relay_task = asyncio.ensure_future(relay())
+    try:
+        start = time.perf_counter()
+        message = await router.wait_for_reply(42, timeout=10)
+        return message.content, time.perf_counter() - start
+    finally:
+        relay_task.cancel()
+        inbox.close()
+
+
+def phase_dm_relay(ctx, workdir):
+    print("dm relay: a prompt waits in one process, the reply arrives in another")
+    path = os.path.join(workdir, "shared_state.db")
+    sender = ctx.Process(target=post_reply, args=(path, 1.0, "fresh"))
+    sender.start()
+    content, elapsed = asyncio.run(wait_for_relayed_reply(path))
+    sender.join()
+    print(f"  prompt answered with {content!r} after {elapsed:.2f}s")
+    print(f"  {verdict(content == 'fresh')}: relayed replies reach the prompt, messages older than it are ignored")
+
+
+def queue_worker(registry_path, journal_path, urls, index):
+    async def run():
+        store = SqliteRegistryStore(registry_path)
+        registry = EpicIdRegistry(store.load())
+        client = DeverseClient(*urls, "dw-token", "bear-token")
+        runner = PayoutJobRunner(client, PayoutJournal(journal_path), registry.user_for_epic_id, BANK_WALLET_ID, 10, None)
+        await PayoutWorker(runner, f"worker-{index}", lease=JOB_LEASE, poll_interval=0.1).run_forever()
+    asyncio.run(run())
+
+
+async def queue_jobs(registry_path, journal_path):
+    store = SqliteRegistryStore(registry_path)
+    for i in range(JOB_ROWS):
+        await store.put(str(i), epic_id(i))
+    registry = EpicIdRegistry(store.load())
+    store.close()
+
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["EpicID"] + POINT_COLUMNS)
+    writer.writerows([epic_id(i)] + [1] * len(POINT_COLUMNS) for i in range(JOB_ROWS))
+    csv_bytes = text.getvalue().encode('utf-8')
+    plan = build_payout_plan(csv_bytes, registry.user_for_epic_id, {asset_id: 10**12 for asset_id in ASSET_IDS})
+
+    journal = PayoutJournal(journal_path)
+    job_ids = []
+    for _ in range(JOBS):
+        job_id = await journal.create_job(csv_bytes, plan, JOB_ROWS)
+        await journal.enqueue(job_id)
+        job_ids.append(job_id)
+    return journal, job_ids
+
+
+async def watch_jobs(journal, job_ids, workers):
+    killed = None
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        jobs = [await journal.get_job(job_id) for job_id in job_ids]
+        if killed is None:
+            running = [job for job in jobs if job["worker"] and job["done_rows"] > 0 and not job["has_results"]]
+            if running:
+                killed = running[0]
+                index = int(killed["worker"].rsplit("-", 1)[1])
+                os.kill(workers[index].pid, signal.SIGKILL)  # Dies mid-job without releasing its lease
+        if all(job["has_results"] for job in jobs):
+            return jobs, killed
+        await asyncio.sleep(0.1)
+    return jobs, killed
+
+
+def phase_job_queue(ctx, workdir, processes):
+    print(f"job queue: {JOBS} payout jobs of {JOB_ROWS} rows, {processes} worker processes, one killed mid-job")
+    registry_path = os.path.join(workdir, "payout_registry.db")
+    journal_path = os.path.join(workdir, "payout_jobs.db")
+    stub = StubDeverseApi(latency=0.01).start_in_thread()
+    try:
+        journal, job_ids = asyncio.run(queue_jobs(registry_path, journal_path))
+        workers = [ctx.Process(target=queue_worker, args=(registry_path, journal_path, stub.urls, index)) for index in range(processes)]
+        start = time.perf_counter()
+        for process in workers:
+            process.start()
+        jobs, killed = asyncio.run(watch_jobs(journal, job_ids, workers))
+        elapsed = time.perf_counter() - start
+        for process in workers:
+            process.terminate()
+            process.join()
+        succeeded = sum(asyncio.run(journal.transfer_counts(job_id)).get(TRANSFER_SUCCEEDED, 0) for job_id in job_ids)
+        journal.close()
+    finally:
+        stub.stop_thread()
+
+    keys = Counter(transfer["idempotency_key"] for transfer in stub.transfers)
+    completed = sum(job["status"] == JOB_COMPLETED for job in jobs)
+    print(f"  {elapsed:.1f}s, {completed}/{JOBS} jobs completed by {len({job['worker'] for job in jobs})} workers, "
+          f"{len(stub.transfers)} transfers sent, {succeeded} recorded as succeeded")
+    if killed is not None:
+        finisher = next(job["worker"] for job in jobs if job["job_id"] == killed["job_id"])
+        print(f"  job {killed['job_id']} was taken over from {killed['worker']} by {finisher}")
+    print(f"  {verdict(completed == JOBS)}: every queued job completes, including the one whose worker died")
+    print(f"  {verdict(max(keys.values()) == 1)}: no transfer was sent twice")
+
+
+def main(processes):
+    ctx = multiprocessing.get_context("spawn")  # Each process starts clean, as separate bot processes would
+    with tempfile.TemporaryDirectory() as workdir:
+        phase_registry(ctx, workdir, processes)
+        phase_cooldowns(ctx, workdir, processes)
+        phase_dm_relay(ctx, workdir)
+        phase_job_queue(ctx, workdir, processes)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
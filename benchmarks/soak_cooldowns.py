@@ -0,0 +1,60 @@
+# Soak test of the button cooldowns: a million distinct users click once each, spread over simulated hours
+# Prints tracked keys and traced memory as users arrive, the old defaultdict grows without bound, the buckets stay flat
+# Usage: python -m benchmarks.soak_cooldowns [users] [clicks_per_second]
+import sys
+import tracemalloc
+from collections import defaultdict
+
+from ratelimit import CommandRateLimits
+
+COOLDOWN_TIME = 10
+REPORT_EVERY = 100_000
+
+
+# Simulated clock so hours of traffic run in seconds
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def soak_defaultdict(users, rate, clock):
+    cooldowns = defaultdict(lambda: 0)  # The structure the bot used before
+    for user_id in range(users):
+        clock.now += 1 / rate
+        if clock.now >= cooldowns[user_id]:
+            cooldowns[user_id] = clock.now + COOLDOWN_TIME
+        if (user_id + 1) % REPORT_EVERY == 0:
+            yield user_id + 1, len(cooldowns)
+
+
+def soak_buckets(users, rate, clock):
+    limits = CommandRateLimits(capacity=1, per=COOLDOWN_TIME, clock=clock)
+    for user_id in range(users):
+        clock.now += 1 / rate
+        limits.acquire("set", user_id)
+        if (user_id + 1) % REPORT_EVERY == 0:
+            yield user_id + 1, sum(limits.stats().values())
+
+
+def run(label, soak, users, rate):
+    print(label)
+    tracemalloc.start()
+    for done, keys in soak(users, rate, FakeClock()):
+        current, _ = tracemalloc.get_traced_memory()
+        print(f"  {done:>9} users  {keys:>9} keys  {current / 1e6:7.1f} MB")
+    tracemalloc.stop()
+
+
+def main(users, rate):
+    print(f"{users} users, {rate} clicks/s, {COOLDOWN_TIME}s cooldown, {users / rate / 3600:.1f} simulated hours")
+    run("defaultdict", soak_defaultdict, users, rate)
+    run("token buckets", soak_buckets, users, rate)
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 100
+    main(users, rate)
@@ -0,0 +1,109 @@
+import asyncio
+import random
+import threading
+
+from aiohttp import web
+
+from assets import ASSET_IDS
+
+# Bank wallet used by /dw-commands distribute
+BANK_WALLET = "5DSFYPkB2b6auEwZxqbkAWa213EbBfDtRuaRrnivA3RvoMyg"
+
+
+# Local stand-in for the Deverse wallet, balance and transfer APIs
+class StubDeverseApi:
+    def __init__(self, latency=0.05, error_rate=0.0, bank_balance=10**12):
+        self.latency = latency  # Seconds added to every response
+        self.error_rate = error_rate  # Fraction of requests answered with a 503
+        self.bank_balance = bank_balance
+        self.calls = {"wallet": 0, "balance": 0, "transfer": 0}
+        self.transfers = []  # Payloads of successful transfers
+        self._runner = None
+        self.port = None
+
+    # Apply the configured latency and fault injection, returns an error response or None
+    async def _simulate(self, kind):
+        self.calls[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.Response(status=503, text="Service Unavailable")
+        return None
+
+    async def wallet(self, request):
+        error = await self._simulate("wallet")
+        if error:
+            return error
+        epic_id = request.match_info["epic_id"]
+        return web.json_response({"data": {"thx": {"id_wallet": f"wallet-{epic_id}"}}})
+
+    async def balance(self, request):
+        error = await self._simulate("balance")
+        if error:
+            return error
+        id_wallet = request.match_info["id_wallet"]
+        amount = self.bank_balance if id_wallet == BANK_WALLET else 100
+        balances = [{"asset_id": asset_id, "balance": amount} for asset_id in ASSET_IDS]
+        return web.json_response({"result": {"non_native_ft_balances": balances}})
+
+    async def transfer(self, request):
+        error = await self._simulate("transfer")
+        if error:
+            return error
+        payload = await request.json()
+        payload["idempotency_key"] = request.headers.get("Idempotency-Key")
+        self.transfers.append(payload)
+        return web.json_response({"ok": True})
+
+    # Start the stub server on a random local port
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_get("/wallet/{epic_id}", self.wallet)
+        app.router.add_get("/balance/{id_wallet}/{chain:.*}", self.balance)
+        app.router.add_post("/transfer", self.transfer)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # Run the stub on its own event loop in a background thread so blocking clients can be measured too
+    def start_in_thread(self):
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    # URLs in the same shape as the API_URL, BALANCE_API_URL and TRANSFER_API_URL environment variables
+    @property
+    def urls(self):
+        base = f"http://127.0.0.1:{self.port}"
+        return f"{base}/wallet/", f"{base}/balance/", f"{base}/transfer"
+
+
+# Nearest-rank percentile of a list of samples
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
@@ -0,0 +1,96 @@
+import time
+import asyncio
+
+# Circuit breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 5  # Consecutive failures that open the circuit
+DEFAULT_RECOVERY_TIME = 30  # Seconds the circuit stays open before a trial call is let through
+
+
+# Stops calls to an endpoint after repeated failures and lets a single trial call through once it may have recovered
+class CircuitBreaker:
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, recovery_time=DEFAULT_RECOVERY_TIME, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.clock = clock
+        self._state = CLOSED
+        self.failures = 0  # Consecutive failures while closed
+        self.opened_at = None
+        self._trial = False  # Whether the half-open trial call is in flight
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        if self._state == OPEN and self.clock() - self.opened_at >= self.recovery_time:
+            self._state = HALF_OPEN
+        return self._state
+
+    # Whether a call may go out now, in half-open state only one trial call at a time
+    def allow(self):
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    # Seconds until the circuit could let a call through again
+    def retry_after(self):
+        if self._state == OPEN:
+            return max(0.0, self.opened_at + self.recovery_time - self.clock())
+        return 0.0
+
+    def record_success(self):
+        self._state = CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def record_failure(self):
+        self._trial = False
+        if self._state == HALF_OPEN:
+            self._open()  # The trial call failed, wait another recovery period
+            return
+        self.failures += 1
+        if self._state == CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    # The call was cancelled before it had an outcome, free the trial slot without judging the endpoint
+    def record_abandoned(self):
+        self._trial = False
+
+    def _open(self):
+        self._state = OPEN
+        self.opened_at = self.clock()
+        self.failures = 0
+        self.times_opened += 1
+
+
+# Concurrency limit that grows by one per window of successful calls and halves when the endpoint is overloaded (AIMD)
+class AdaptiveLimit:
+    def __init__(self, maximum, minimum=1, initial=None, backoff_ratio=0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial or maximum)
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    # Release a slot and adapt the limit, overloaded means a timeout, a 429 or a 5xx
+    async def release(self, overloaded=False, adapt=True):
+        async with self._condition:
+            self.in_flight -= 1
+            if adapt:
+                if overloaded:
+                    self.limit = max(self.minimum, self.limit * self.backoff_ratio)
+                else:
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)  # About +1 after a full window succeeds
+            self._condition.notify_all()
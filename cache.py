@@ -0,0 +1,113 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+# Marker for a key that is not in the cache
+MISSING = object()
+
+
+# Bounded LRU cache whose entries expire after a time to live
+class TTLCache:
+    def __init__(self, maxsize, ttl, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (value, expires_at), oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Return the cached value or MISSING, expired entries are dropped on access
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)  # Mark as recently used
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return MISSING
+
+    # Store a value, evicting the least recently used entry when full
+    def set(self, key, value, ttl=None):
+        self._entries[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    # Live entries as (key, value, expires_at) for persistence
+    def snapshot(self):
+        now = self.clock()
+        return [(key, value, expires_at) for key, (value, expires_at) in self._entries.items() if expires_at > now]
+
+    # Reload entries saved by snapshot, skipping any that expired in the meantime
+    def restore(self, entries):
+        now = self.clock()
+        for key, value, expires_at in entries:
+            if expires_at > now:
+                self._entries[key] = (value, expires_at)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# TTL cache that shares one in-flight fetch between concurrent callers asking for the same key
+class CoalescingCache:
+    def __init__(self, maxsize, ttl, clock=time.time):
+        self.cache = TTLCache(maxsize, ttl, clock)
+        self._in_flight = {}  # key -> task fetching it
+        self._stale = set()  # Keys invalidated while their fetch was in flight
+        self.coalesced = 0  # Callers that joined a fetch already in flight
+
+    # Return (value, error) for a key, calling fetch() only when it is neither cached nor already being fetched
+    async def get_or_fetch(self, key, fetch):
+        value = self.cache.get(key)
+        if value is not MISSING:
+            return value, None
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)  # A cancelled caller must not cancel the fetch others are waiting on
+
+    async def _fetch(self, key, fetch):
+        try:
+            value, error = await fetch()
+            if not error and key not in self._stale:
+                self.cache.set(key, value)  # Only successful responses that are still current are cached
+            return value, error
+        finally:
+            del self._in_flight[key]
+            self._stale.discard(key)
+
+    def invalidate(self, key):
+        self.cache.invalidate(key)
+        if key in self._in_flight:
+            self._stale.add(key)  # The response in flight may predate the change
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats["coalesced"] = self.coalesced
+        stats["in_flight"] = len(self._in_flight)
+        return stats
@@ -0,0 +1,144 @@
+import time
+import heapq
+import asyncio
+import itertools
+
+from sqlite_store import SqliteStore
+
+DEFAULT_RELAY_MAX_AGE = 60  # Seconds a relayed DM waits for a prompt to pick it up
+DEFAULT_RELAY_INTERVAL = 0.5  # Seconds between polls of the shared inbox while prompts are pending
+
+
+# Raised in a flow that was waiting for a reply when the same user started a newer one
+class ConversationSuperseded(Exception):
+    pass
+
+
+# Routes direct messages to the flow waiting on their author, one pending reply per user
+# Lookups are a dict access per message and every timeout is driven by a single timer on the earliest deadline
+class DmRouter:
+    def __init__(self):
+        self._pending = {}  # user_id -> future of the flow waiting for that user
+        self._since = {}  # user_id -> (wall time the wait started, future), for replies relayed from other processes
+        self._deadlines = []  # Heap of (deadline, sequence, user_id, future), entries may be stale
+        self._sequence = itertools.count()  # Tie breaker, futures are never compared
+        self._timer = None
+        self._timer_at = None
+        self.routed = 0  # Messages handed to a waiting flow
+
+    def __len__(self):
+        return len(self._pending)
+
+    # Wait for the next message from a user, raises asyncio.TimeoutError after timeout seconds
+    async def wait_for_reply(self, user_id, timeout):
+        loop = asyncio.get_running_loop()
+        previous = self._pending.get(user_id)
+        if previous is not None and not previous.done():
+            previous.set_exception(ConversationSuperseded())  # Only the newest prompt receives the user's replies
+
+        future = loop.create_future()
+        self._pending[user_id] = future
+        self._since[user_id] = (time.time(), future)
+        heapq.heappush(self._deadlines, (loop.time() + timeout, next(self._sequence), user_id, future))
+        self._schedule(loop)
+        try:
+            return await future
+        finally:
+            if self._pending.get(user_id) is future:
+                del self._pending[user_id]
+            if self._since.get(user_id, (None, None))[1] is future:
+                del self._since[user_id]
+
+    # Hand a message to the flow waiting on its author, returns whether one was waiting
+    def dispatch(self, user_id, message):
+        future = self._pending.pop(user_id, None)
+        if future is None or future.done():
+            return False
+        future.set_result(message)
+        self.routed += 1
+        return True
+
+    # Users with a pending prompt and the wall time it started, only messages sent after that answer it
+    def waiting(self):
+        return {user_id: self._since[user_id][0] for user_id in self._pending}
+
+    def _schedule(self, loop):
+        if not self._deadlines:
+            return
+        deadline = self._deadlines[0][0]
+        if self._timer is not None:
+            if self._timer_at <= deadline:
+                return  # The running timer fires first and reschedules
+            self._timer.cancel()
+        self._timer = loop.call_at(deadline, self._expire, loop)
+        self._timer_at = deadline
+
+    def _expire(self, loop):
+        self._timer = None
+        now = loop.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, user_id, future = heapq.heappop(self._deadlines)
+            if not future.done():
+                future.set_exception(asyncio.TimeoutError())
+            if self._pending.get(user_id) is future:
+                del self._pending[user_id]
+        self._schedule(loop)
+
+
+# A direct message relayed through the shared inbox, carries what the prompts read from a discord.Message
+class RelayedMessage:
+    __slots__ = ("author_id", "content")
+
+    def __init__(self, author_id, content):
+        self.author_id = author_id
+        self.content = content
+
+
+# Direct messages handed between bot processes through a SQLite file
+# Only the process running shard 0 receives DMs, so replies to prompts opened on other shards are posted here
+class SharedDmInbox(SqliteStore):
+    def __init__(self, path, max_age=DEFAULT_RELAY_MAX_AGE):
+        super().__init__(path)
+        self.max_age = max_age
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dm_inbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                sent_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_dm_inbox_user ON dm_inbox (user_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_dm_inbox_sent_at ON dm_inbox (sent_at)")
+
+    def _expire(self, now):
+        self._conn.execute("DELETE FROM dm_inbox WHERE sent_at < ?", (now - self.max_age,))
+
+    def _post(self, user_id, content, sent_at):
+        with self._lock:
+            self._expire(sent_at)  # Pruned on every post too, otherwise DMs pile up while no prompt is pending
+            self._conn.execute("INSERT INTO dm_inbox (user_id, content, sent_at) VALUES (?, ?, ?)", (user_id, content, sent_at))
+
+    # Leave a DM no prompt of this process was waiting for
+    async def post(self, user_id, content):
+        await self._run(self._post, user_id, content, time.time())
+
+    def _take(self, waiting):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # A message is taken by exactly one process
+            try:
+                self._expire(time.time())
+                placeholders = ",".join("?" * len(waiting))
+                rows = self._conn.execute(f"SELECT user_id, content, sent_at FROM dm_inbox WHERE user_id IN ({placeholders}) ORDER BY id",
+                                          list(waiting)).fetchall()
+                self._conn.execute(f"DELETE FROM dm_inbox WHERE user_id IN ({placeholders})", list(waiting))
+            finally:
+                self._conn.execute("COMMIT")
+        return [RelayedMessage(user_id, content) for user_id, content, sent_at in rows if sent_at >= waiting[user_id]]  # Older ones predate the prompt
+
+    # Remove and return the relayed DMs of the waiting users, given as user_id -> time their prompt started
+    async def take(self, waiting):
+        if not waiting:
+            return []
+        return await self._run(self._take, waiting)
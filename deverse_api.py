@@ -0,0 +1,240 @@
+import asyncio
+import functools
+
+import aiohttp
+
+from cache import MISSING
+from metrics import instrument_api
+from breaker import CircuitBreaker, AdaptiveLimit, OPEN, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RECOVERY_TIME
+from registry import normalize_epic_id
+
+# Chain path used by the balance API
+CHAIN_INFO = "testnet_leafchain_aether/fts"
+
+# Defaults for the shared HTTP session
+DEFAULT_TIMEOUT = 10  # Total seconds allowed for a single API call
+DEFAULT_MAX_CONNECTIONS = 50  # Size of the keep-alive connection pool
+DEFAULT_MAX_CONCURRENCY = 20  # Number of API calls allowed in flight at once
+DEFAULT_NEGATIVE_TTL = 60  # Seconds to remember that an EPIC ID has no wallet
+
+# Error returned when the wallet API knows the EPIC ID but has no wallet for it
+WALLET_NOT_FOUND_MSG = "'id_wallet' not found in the response data."
+
+
+# Error message returned by the client, carries the HTTP status so callers can decide whether to retry
+# sent is False only when the API provably never acted on the request, such a request is safe to repeat even if it moves funds
+class ApiError(str):
+    def __new__(cls, message, status=None, transient=False, sent=True):
+        error = super().__new__(cls, message)
+        error.status = status
+        error.transient = transient or status == 429 or (status is not None and status >= 500)
+        error.sent = sent and status != 429  # A rate limited request is rejected before it is processed
+        return error
+
+
+# Error returned without calling an endpoint whose circuit breaker is open
+class CircuitOpenError(ApiError):
+    def __new__(cls, endpoint, retry_after):
+        error = super().__new__(cls, f"The {endpoint} API is temporarily unavailable. Please try again in {max(1, round(retry_after))} seconds.", transient=True, sent=False)
+        error.endpoint = endpoint
+        error.retry_after = retry_after
+        error.circuit_open = True  # Nothing was sent, so the call is always safe to repeat
+        return error
+
+
+# Send an API helper's request through the circuit breaker and adaptive limit of its endpoint
+def guarded(endpoint, failed_value):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return await self._guarded(endpoint, failed_value, lambda: func(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+# Async client for the Deverse wallet, balance and transfer APIs
+class DeverseClient:
+    def __init__(self, api_url, balance_api_url, transfer_api_url, dw_token, bear_token,
+                 chain_info=CHAIN_INFO, timeout=DEFAULT_TIMEOUT,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 wallet_cache=None, negative_ttl=DEFAULT_NEGATIVE_TTL, balance_cache=None,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD, recovery_time=DEFAULT_RECOVERY_TIME):
+        self.api_url = api_url
+        self.balance_api_url = balance_api_url
+        self.transfer_api_url = transfer_api_url
+        self.dw_token = dw_token
+        self.bear_token = bear_token
+        self.chain_info = chain_info
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(max_concurrency)  # Bounds the number of concurrent API calls
+        self._session = None
+        self.wallet_cache = wallet_cache  # Optional TTLCache of normalized EPIC ID -> id_wallet, None marks a missing wallet
+        self.negative_ttl = negative_ttl
+        self.balance_cache = balance_cache  # Optional CoalescingCache of id_wallet -> balance data
+        # One breaker and one adaptive concurrency limit per endpoint, a failing transfer API does not block balance lookups
+        self.breakers = {endpoint: CircuitBreaker(failure_threshold, recovery_time) for endpoint in ("wallet", "balance", "transfer")}
+        self.limits = {endpoint: AdaptiveLimit(max_concurrency) for endpoint in ("wallet", "balance", "transfer")}
+
+    # Create the shared session on first use so it is bound to the running event loop
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    # Close the shared session when the bot shuts down
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # Fail fast while the endpoint's circuit is open, otherwise run the request under its adaptive limit
+    # Timeouts, 429s, 5xx and connection errors count against the endpoint, other errors mean it is answering fine
+    async def _guarded(self, endpoint, failed_value, request):
+        breaker = self.breakers[endpoint]
+        if breaker.state == OPEN:
+            return failed_value, CircuitOpenError(endpoint, breaker.retry_after())
+
+        limit = self.limits[endpoint]
+        await limit.acquire()
+        if not breaker.allow():  # Checked again, the circuit may have opened while this call waited for a slot
+            await limit.release(adapt=False)
+            return failed_value, CircuitOpenError(endpoint, breaker.retry_after())
+        try:
+            value, error = await request()
+        except asyncio.CancelledError:
+            breaker.record_abandoned()
+            await asyncio.shield(limit.release(adapt=False))
+            raise
+        overloaded = bool(error) and error.transient
+        if overloaded:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        await limit.release(overloaded)
+        return value, error
+
+    # Per-call timeout override, falls back to the client timeout
+    # An explicit timeout=None would disable aiohttp's timeout for the request instead of using the session's
+    def _call_timeout(self, timeout):
+        return aiohttp.ClientTimeout(total=timeout if timeout is not None else self.timeout)
+
+    # Retrieve the wallet ID for an EPIC ID, answering from the wallet cache when possible
+    async def get_wallet_by_epic_id(self, epic_id, timeout=None):
+        if self.wallet_cache is None:
+            return await self._fetch_wallet_by_epic_id(epic_id, timeout)
+
+        cache_key = normalize_epic_id(epic_id)
+        id_wallet = self.wallet_cache.get(cache_key)
+        if id_wallet is not MISSING:
+            return (id_wallet, None) if id_wallet else (None, ApiError(WALLET_NOT_FOUND_MSG, 200))
+
+        id_wallet, error = await self._fetch_wallet_by_epic_id(epic_id, timeout)
+        if id_wallet:
+            self.wallet_cache.set(cache_key, id_wallet)
+        elif error == WALLET_NOT_FOUND_MSG:
+            self.wallet_cache.set(cache_key, None, ttl=self.negative_ttl)  # Remember the miss briefly, the wallet may be created soon
+        return id_wallet, error
+
+    # Forget the cached wallet of an EPIC ID after it is edited or removed
+    def invalidate_wallet(self, epic_id):
+        if self.wallet_cache is not None:
+            self.wallet_cache.invalidate(normalize_epic_id(epic_id))
+
+    @instrument_api("wallet")
+    @guarded("wallet", None)
+    async def _fetch_wallet_by_epic_id(self, epic_id, timeout=None):
+        wallet_api_url = f"{self.api_url}{epic_id}"
+        wallet_headers = {"x-dw-api-key": f"{self.dw_token}"}
+
+        try:
+            session = await self._get_session()
+            async with self._semaphore:
+                async with session.get(wallet_api_url, headers=wallet_headers, timeout=self._call_timeout(timeout)) as wallet_response:
+                    if wallet_response.status in [200, 201]:
+                        wallet_json = await wallet_response.json(content_type=None)
+                        wallet_data = wallet_json.get('data', {})
+                        id_wallet = wallet_data.get('thx', {}).get('id_wallet')
+                        if id_wallet:
+                            return id_wallet, None  # Successfully retrieved the wallet ID
+                        else:
+                            return None, ApiError(WALLET_NOT_FOUND_MSG, wallet_response.status)  # Handle the case where 'id_wallet' is missing
+                    else:
+                        text = await wallet_response.text()
+                        return None, ApiError(f"API responded with status code: {wallet_response.status}. Response: {text}", wallet_response.status)
+        except asyncio.TimeoutError:
+            return None, ApiError("API request timed out.", transient=True)
+        except aiohttp.ClientConnectorError as e:
+            return None, ApiError(str(e), transient=True, sent=False)  # The connection never opened, nothing reached the API
+        except aiohttp.ClientConnectionError as e:
+            return None, ApiError(str(e), transient=True)  # Connection problems are worth retrying
+        except Exception as e:
+            return None, ApiError(str(e))  # Return None for id_wallet and an error message if something goes wrong
+
+    # Retrieve the balance of a wallet, concurrent requests for the same wallet share one fetch
+    async def get_wallet_balance(self, id_wallet, timeout=None, use_cache=True):
+        if self.balance_cache is None or not use_cache:
+            return await self._fetch_wallet_balance(id_wallet, timeout)
+        return await self.balance_cache.get_or_fetch(id_wallet, lambda: self._fetch_wallet_balance(id_wallet, timeout))
+
+    # Forget the cached balance of a wallet after a transfer changes it
+    def invalidate_balance(self, id_wallet):
+        if self.balance_cache is not None:
+            self.balance_cache.invalidate(id_wallet)
+
+    @instrument_api("balance")
+    @guarded("balance", None)
+    async def _fetch_wallet_balance(self, id_wallet, timeout=None):
+        balance_api_url = f"{self.balance_api_url}{id_wallet}/{self.chain_info}"
+        balance_headers = {"Authorization": f"Bearer {self.bear_token}"}
+
+        try:
+            session = await self._get_session()
+            async with self._semaphore:
+                async with session.get(balance_api_url, headers=balance_headers, timeout=self._call_timeout(timeout)) as balance_response:
+                    if balance_response.status == 200:
+                        balance_json = await balance_response.json(content_type=None)
+                        return balance_json.get('result', {}), None  # Return the balance data if the API call is successful
+                    else:
+                        return None, ApiError(f"API responded with status code: {balance_response.status}.", balance_response.status)
+        except asyncio.TimeoutError:
+            return None, ApiError("API request timed out.", transient=True)
+        except aiohttp.ClientConnectorError as e:
+            return None, ApiError(str(e), transient=True, sent=False)  # The connection never opened, nothing reached the API
+        except aiohttp.ClientConnectionError as e:
+            return None, ApiError(str(e), transient=True)  # Connection problems are worth retrying
+        except Exception as e:
+            return None, ApiError(str(e))  # Return None for balance data and an error message if something goes wrong
+
+    # Transfer resources to a wallet, the idempotency key lets the API recognise a repeated request
+    @instrument_api("transfer")
+    @guarded("transfer", False)
+    async def transfer_resource(self, id_wallet, points, asset_id, timeout=None, idempotency_key=None):
+        transfer_payload = {
+            "receiver_id_wallet_address": id_wallet,
+            "transfer_value_human": points.item() if hasattr(points, "item") else points,  # Unwrap numpy scalars coming from pandas
+            "native": False,
+            "asset_id": asset_id
+        }
+        transfer_headers = {"Authorization": f"Bearer {self.bear_token}"}
+        if idempotency_key:
+            transfer_headers["Idempotency-Key"] = idempotency_key
+
+        try:
+            session = await self._get_session()
+            async with self._semaphore:
+                async with session.post(self.transfer_api_url, headers=transfer_headers, json=transfer_payload, timeout=self._call_timeout(timeout)) as transfer_response:
+                    if transfer_response.status == 200:
+                        self.invalidate_balance(id_wallet)  # The receiver's cached balance is now out of date
+                        return True, None  # Return True if the transfer was successful
+                    else:
+                        return False, ApiError(f"API responded with status code: {transfer_response.status}.", transfer_response.status)
+        except asyncio.TimeoutError:
+            return False, ApiError("API request timed out.", transient=True)
+        except aiohttp.ClientConnectorError as e:
+            return False, ApiError(str(e), transient=True, sent=False)  # The connection never opened, nothing reached the API
+        except aiohttp.ClientConnectionError as e:
+            return False, ApiError(str(e), transient=True)  # Connection problems are worth retrying
+        except Exception as e:
+            return False, ApiError(str(e))  # Return False and an error message if something goes wrong
@@ -0,0 +1,220 @@
+import time
+import random
+import asyncio
+
+from assets import ASSETS, ASSET_IDS
+from payout_report import PayoutReport, OUTCOME_PAID, OUTCOME_FAILED, OUTCOME_IN_FLIGHT, OUTCOME_NO_WALLET, OUTCOME_UNREGISTERED, OUTCOME_INSUFFICIENT
+
+# Defaults for the distribution engine
+DEFAULT_MAX_IN_FLIGHT = 10  # Number of rows processed concurrently
+DEFAULT_REQUESTS_PER_SECOND = 20  # Upstream request budget shared by all rows
+DEFAULT_MAX_RETRIES = 3  # Retries for a transient failure before giving up
+DEFAULT_BACKOFF = 0.5  # Base delay in seconds for exponential backoff
+DEFAULT_PROGRESS_INTERVAL = 2.0  # Minimum seconds between progress updates
+DEFAULT_MAX_PAUSE = 900  # Seconds a row waits for an open circuit to close before it fails
+PAUSE_POLL = 0.5  # Shortest wait between checks of an open circuit
+
+
+# Token bucket that spaces out upstream requests to a requests-per-second budget
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate  # None disables the limit
+        self.capacity = burst or max(1, int(rate or 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:  # Waiters are served in order so nobody starves
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Running balance of the bank during a payout, each row reserves its points before any transfer is made
+class BudgetTracker:
+    def __init__(self, balances):
+        self.remaining = dict(balances)
+        self.reserved = dict.fromkeys(balances, 0)
+
+    # Reserve all assets of a row at once, returns False without reserving anything if one does not fit
+    def reserve(self, points_by_asset):
+        if any(points > self.remaining[asset_id] for asset_id, points in points_by_asset.items()):
+            return False
+        for asset_id, points in points_by_asset.items():
+            self.remaining[asset_id] -= points
+            self.reserved[asset_id] += points
+        return True
+
+    # Give back points whose transfer failed
+    def release(self, asset_id, points):
+        self.remaining[asset_id] += points
+        self.reserved[asset_id] -= points
+
+
+# A failed transfer is only retried when the API provably never acted on it
+# A timeout, a dropped connection or a 5xx may come after the transfer was applied, and retrying would pay twice
+def is_retryable_transfer(error):
+    return not getattr(error, 'sent', True)
+
+
+# Runs wallet lookups and transfers for a payout concurrently under a rate limit
+class DistributionEngine:
+    def __init__(self, client, max_in_flight=DEFAULT_MAX_IN_FLIGHT, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, max_pause=DEFAULT_MAX_PAUSE):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_pause = max_pause
+        self.paused = 0  # Rows currently waiting for an open circuit
+
+    # Call an API helper under the rate limit, retrying transient failures with exponential backoff and jitter
+    # While the endpoint's circuit is open the row pauses instead of retrying, for up to max_pause seconds
+    async def call(self, func, *args, retry_if=None, **kwargs):
+        retry_if = retry_if or (lambda error: getattr(error, 'transient', False))
+        attempt = 0
+        paused = 0.0
+        while True:
+            await self.limiter.acquire()
+            result, error = await func(*args, **kwargs)
+            if getattr(error, 'circuit_open', False) and paused < self.max_pause:
+                delay = min(max(error.retry_after, PAUSE_POLL), self.max_pause - paused)
+                paused += delay
+                self.paused += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.paused -= 1
+                continue  # Nothing was sent, so the pause does not use up a retry
+            if not error or attempt == self.max_retries or not retry_if(error):
+                return result, error
+            await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+    # Distribute one CSV row, failed transfers hand their points back to the budget
+    # With a journal every transfer is recorded before it is sent and after it completes, so a restarted job can skip it
+    # With a report every outcome is also recorded in structured form
+    async def distribute_row(self, epic_id, user_id, points_by_asset, budget=None, journal=None, index=None, report=None):
+        id_wallet, error = await self.call(self.client.get_wallet_by_epic_id, epic_id)
+        if error or not id_wallet:
+            for asset_id, points in points_by_asset.items():
+                if budget is not None:
+                    budget.release(asset_id, points)
+                if journal is not None and points > 0:
+                    await journal.record_failure(index, asset_id, epic_id, points, error)
+                if report is not None and points > 0:
+                    report.record(index, epic_id, user_id, OUTCOME_NO_WALLET, asset_id, points, error)
+            return
+
+        for asset in ASSETS:
+            asset_id = asset.asset_id
+            points = points_by_asset[asset_id]
+            if points > 0:
+                idempotency_key = None
+                if journal is not None:
+                    idempotency_key = await journal.begin_transfer(index, asset_id, epic_id, points)
+                success, error = await self.call(self.client.transfer_resource, id_wallet, points, asset_id,
+                                                  retry_if=is_retryable_transfer, idempotency_key=idempotency_key)
+                if journal is not None:
+                    await journal.finish_transfer(index, asset_id, success, error)
+                if report is not None:
+                    report.record(index, epic_id, user_id, OUTCOME_PAID if success else OUTCOME_FAILED, asset_id, points, None if success else error)
+                if not success and budget is not None:
+                    budget.release(asset_id, points)
+
+    # Process (epic_id, points per asset in ASSETS order...) rows and return the report of their outcomes
+    # Rows may be a list or an async iterator, which is consumed lazily so large payouts are never fully in memory
+    # The plan decides what each row receives and the budget guarantees the bank is never overdrawn
+    async def run(self, rows, lookup_user, budget, plan=None, progress=None, progress_interval=DEFAULT_PROGRESS_INTERVAL, total=None, journal=None, report=None):
+        if not hasattr(rows, '__aiter__'):
+            rows = list(rows)
+            total = len(rows)
+            rows = _aiter(rows)
+        if report is None:
+            report = PayoutReport()
+        iterator = rows.__aiter__()
+        iterator_lock = asyncio.Lock()
+        next_index = 0
+        done = 0
+        last_report = time.monotonic()
+
+        async def next_row():
+            nonlocal next_index
+            async with iterator_lock:
+                try:
+                    row = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return None, None
+                next_index += 1
+                return next_index - 1, row
+
+        async def worker():
+            nonlocal done, last_report
+            while True:
+                index, row = await next_row()
+                if row is None:
+                    return
+                epic_id, *points = row
+                points_by_asset = dict(zip(ASSET_IDS, points))
+
+                user_id = lookup_user(epic_id)
+                if not user_id:
+                    report.record(index, epic_id, None, OUTCOME_UNREGISTERED)  # The EPIC ID is not registered in the server
+                else:
+                    if plan is not None:
+                        points_by_asset = plan.apply(index, points_by_asset)
+                    if journal is not None and points_by_asset is not None:
+                        points_by_asset = await self._skip_finished(journal, index, epic_id, user_id, points_by_asset, report)
+                    if points_by_asset is None or not budget.reserve(points_by_asset):
+                        report.record(index, epic_id, user_id, OUTCOME_INSUFFICIENT)  # Skip the distribution if there aren't enough resources
+                    elif any(points > 0 for points in points_by_asset.values()):
+                        await self.distribute_row(epic_id, user_id, points_by_asset, budget, journal, index, report)
+
+                done += 1
+                now = time.monotonic()
+                if progress and now - last_report >= progress_interval:
+                    last_report = now
+                    await progress(done, total)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.max_in_flight)]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()  # gather leaves the other workers sending transfers after one fails
+            await asyncio.gather(*workers, return_exceptions=True)  # Stopped before the job is marked failed and can be resumed
+            raise
+        if progress:
+            await progress(done, total)
+        return report
+
+    # Leave out transfers a previous run of the job already made and report their earlier outcomes, returns the remaining points
+    async def _skip_finished(self, journal, index, epic_id, user_id, points_by_asset, report):
+        finished = await journal.finished_transfers(index)
+        if not finished:
+            return points_by_asset
+
+        remaining = dict(points_by_asset)
+        for asset in ASSETS:
+            if asset.asset_id not in finished:
+                continue
+            state, points, error = finished[asset.asset_id]
+            remaining[asset.asset_id] = 0
+            outcome = {"succeeded": OUTCOME_PAID, "failed": OUTCOME_FAILED}.get(state, OUTCOME_IN_FLIGHT)  # In flight ones must be checked by hand
+            report.record(index, epic_id, user_id, outcome, asset.asset_id, points, error)
+        return remaining
+
+
+# Wrap a list of rows as an async iterator
+async def _aiter(rows):
+    for row in rows:
+        yield row
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter, deque
+
+DEFAULT_LAG_INTERVAL = 0.1  # Seconds between heartbeats on the event loop
+DEFAULT_LAG_THRESHOLD = 0.25  # Lag in seconds that counts as a stall and gets its stack logged
+DEFAULT_LAG_WINDOW = 3000  # Recent lag samples kept for percentiles, about 5 minutes of heartbeats
+STALL_HISTORY = 10  # Recent stalls kept for the diagnostics command
+STACK_LIMIT = 20  # Innermost frames logged for a stall
+
+# Audit events that mean synchronous I/O, flagged in dev mode when they happen on the loop thread
+# time.sleep only raises its event from Python 3.12, before that a sleep shows up as a stall instead
+BLOCKING_EVENTS = {"open", "time.sleep", "socket.connect", "socket.getaddrinfo", "socket.gethostbyname", "sqlite3.connect",
+                   "subprocess.Popen", "os.system", "urllib.Request", "shutil.copyfile", "shutil.rmtree"}
+IGNORED_CALLERS = {"linecache.py", "tokenize.py"}  # Source lookups for the tracebacks asyncio debug mode records
+
+_audit_hook_installed = False  # Audit hooks cannot be removed, one per process forwards to the active monitor
+_active_monitor = None
+_in_hook = threading.local()  # Set while the hook runs on a thread
+
+
+# Measures event loop lag with a heartbeat task and logs the loop thread's stack while it is blocked
+# A watchdog thread takes the stack during the stall, by the time the loop runs again the culprit has returned
+class LoopLagMonitor:
+    def __init__(self, interval=DEFAULT_LAG_INTERVAL, threshold=DEFAULT_LAG_THRESHOLD, window=DEFAULT_LAG_WINDOW, app_root=None, histogram=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.app_root = app_root  # Frames under this directory are named as the blocking code
+        self.histogram = histogram  # Optional metrics histogram fed with every lag sample
+        self.lags = deque(maxlen=window)
+        self.stalls = deque(maxlen=STALL_HISTORY)  # {"at", "lag", "task", "where", "stack"}, newest last
+        self.stall_count = 0
+        self.blocking_calls = Counter()  # (event, "file:line") -> calls seen on the loop thread in dev mode
+        self._loop = None
+        self._loop_thread = None
+        self._last_beat = None
+        self._stall = None  # Stall being observed, its lag is filled in once the loop runs again
+        self._stop = threading.Event()
+
+    # Heartbeat coroutine, run it as a task on the loop to monitor
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        watchdog = threading.Thread(target=self._watch, name="LoopLagMonitor", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._last_beat = now
+                self._record(max(0.0, now - expected))
+        finally:
+            self._stop.set()
+
+    def _record(self, lag):
+        self.lags.append(lag)
+        if self.histogram is not None:
+            self.histogram.observe(lag)
+        stall = self._stall
+        if stall is not None:
+            self._stall = None
+            stall["lag"] = lag
+            print(f"Event loop blocked for {lag * 1000:.0f} ms in {stall['where']}.")
+
+    # Watchdog thread, snapshots the loop thread once per stall
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._last_beat
+            if beat == reported or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            reported = beat
+            task = asyncio.current_task(self._loop)
+            stall = {
+                "at": time.time(),
+                "lag": None,
+                "task": task.get_name() if task is not None else None,
+                "where": self._where(frame),
+                "stack": "".join(traceback.format_stack(frame, limit=STACK_LIMIT)),
+            }
+            self.stalls.append(stall)
+            self.stall_count += 1
+            self._stall = stall
+            print(f"Event loop stalled for over {self.threshold * 1000:.0f} ms in task {stall['task']}, blocking stack:\n{stall['stack']}")
+
+    # Innermost frame of the application itself, library frames below it are what it called
+    def _where(self, frame):
+        innermost = frame
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if self.app_root is None or filename.startswith(self.app_root):
+                return f"{frame.f_code.co_name} ({os.path.basename(filename)}:{frame.f_lineno})"
+            frame = frame.f_back
+        return f"{innermost.f_code.co_name} ({os.path.basename(innermost.f_code.co_filename)}:{innermost.f_lineno})"
+
+    # Dev mode: asyncio debug logging of slow callbacks, plus a report of every call site doing synchronous I/O on the loop
+    # Audit hooks slow down the whole process, keep this out of production
+    def detect_blocking_calls(self, loop):
+        global _audit_hook_installed, _active_monitor
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.threshold
+        _active_monitor = self
+        if not _audit_hook_installed:
+            sys.addaudithook(_audit_hook)
+            _audit_hook_installed = True
+
+    def _on_audit(self, event, args):
+        if event not in BLOCKING_EVENTS or threading.get_ident() != self._loop_thread:
+            return
+        if event == "socket.connect" and args[0].gettimeout() == 0:
+            return  # Non-blocking sockets are how the loop itself does I/O
+        frame = sys._getframe(2)  # Skip this method and the hook
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename in IGNORED_CALLERS:
+            return
+        key = (event, f"{filename}:{frame.f_lineno}")
+        self.blocking_calls[key] += 1
+        if self.blocking_calls[key] == 1:  # Log each call site once
+            print(f"Blocking call {event} on the event loop thread at {key[1]}:\n{''.join(traceback.format_stack(frame, limit=STACK_LIMIT))}")
+
+    # Lag percentiles in milliseconds over the recent window
+    def stats(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0, "stalls": self.stall_count}
+
+        def percentile(pct):
+            return lags[min(len(lags) - 1, int(pct / 100 * len(lags)))] * 1000
+
+        return {"samples": len(lags), "p50": percentile(50), "p95": percentile(95), "p99": percentile(99),
+                "max": lags[-1] * 1000, "stalls": self.stall_count}
+
+
+def _audit_hook(event, args):
+    monitor = _active_monitor
+    if monitor is None or getattr(_in_hook, "active", False):
+        return
+    _in_hook.active = True  # Formatting a stack opens source files, which would re-enter the hook
+    try:
+        monitor._on_audit(event, args)
+    except Exception:
+        pass  # An audit hook must never break the call it observes
+    finally:
+        _in_hook.active = False
@@ -0,0 +1,200 @@
+import time
+import bisect
+import functools
+
+from aiohttp import web
+
+# Histogram buckets in seconds, from a cached lookup to a slow upstream call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Monotonic count per label combination, label values are passed positionally in labelnames order
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> count
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+# Current value, either set directly or read from a function at scrape time
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    # Compute the value only when metrics are scraped, costs nothing on the hot path
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            yield f"{self.name} {self._function()}"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+# Distribution of observed values in fixed buckets, cumulated only when rendered
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts with +Inf last, sum, count]
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+# Set of metrics rendered together in the Prometheus text format
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Registry shared by the bot and its helper modules
+REGISTRY = MetricsRegistry()
+
+COMMAND_LATENCY = REGISTRY.histogram("dw_command_duration_seconds", "Time spent handling an app command", ["command"])
+COMMAND_CALLS = REGISTRY.counter("dw_command_calls_total", "App command invocations by outcome", ["command", "outcome"])
+API_LATENCY = REGISTRY.histogram("dw_api_request_duration_seconds", "Latency of Deverse API calls", ["endpoint"])
+API_RESPONSES = REGISTRY.counter("dw_api_responses_total", "Deverse API responses by status", ["endpoint", "status"])
+
+
+# Status label of an API result: "ok", "circuit_open", the HTTP status, "transient" for timeouts and connection errors, or "error"
+def api_status(error):
+    if not error:
+        return "ok"
+    if getattr(error, "circuit_open", False):
+        return "circuit_open"
+    status = getattr(error, "status", None)
+    if status is not None:
+        return str(status)
+    return "transient" if getattr(error, "transient", False) else "error"
+
+
+# Record latency and status of an API helper returning a (value, error) tuple
+def instrument_api(endpoint):
+    observe, inc, clock = API_LATENCY.observe, API_RESPONSES.inc, time.perf_counter  # Bound once, saves lookups per call
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = clock()
+            value, error = await func(*args, **kwargs)
+            observe(clock() - start, endpoint)
+            inc(endpoint, "ok" if not error else api_status(error))
+            return value, error
+        return wrapper
+    return decorator
+
+
+# Record latency and outcome of an app command, place it below @app_commands.command
+def instrument_command(name):
+    observe, inc, clock = COMMAND_LATENCY.observe, COMMAND_CALLS.inc, time.perf_counter
+
+    def decorator(func):
+        @functools.wraps(func)  # discord.py reads the parameters through __wrapped__
+        async def wrapper(*args, **kwargs):
+            start = clock()
+            outcome = "error"
+            try:
+                result = await func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                observe(clock() - start, name)
+                inc(name, outcome)
+        return wrapper
+    return decorator
+
+
+# Serve the registry on /metrics, returns the runner so the caller can stop it
+async def start_metrics_server(host, port, registry=REGISTRY):
+    async def handle_metrics(request):
+        return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
@@ -0,0 +1,133 @@
+import io
+import asyncio
+
+from assets import POINT_COLUMNS
+
+# pandas and numpy are imported inside the functions that need them, they only load on the first payout
+
+# Columns of the payout CSV, one points column per asset in ASSETS order
+REQUIRED_COLUMNS = ["EpicID"] + POINT_COLUMNS
+
+DEFAULT_CHUNK_SIZE = 50_000  # Rows parsed at a time, bounds the memory used by pandas
+MAX_EXAMPLES = 10  # Problem rows quoted in the validation summary
+
+
+# Raised when the CSV cannot be parsed at all
+class PayoutCsvError(Exception):
+    pass
+
+
+# Result of validating every row of a payout CSV before any transfer starts
+class PayoutValidation:
+    def __init__(self):
+        self.total_rows = 0
+        self.invalid_ids = 0
+        self.invalid_points = 0
+        self.negative_points = 0
+        self.duplicate_ids = 0
+        self.examples = []  # (line number, problem) pairs
+
+    @property
+    def invalid_rows(self):
+        return self.invalid_ids + self.invalid_points + self.negative_points + self.duplicate_ids
+
+    @property
+    def valid_rows(self):
+        return self.total_rows - self.invalid_rows
+
+    @property
+    def ok(self):
+        return self.total_rows > 0 and self.invalid_rows == 0
+
+    def _add_examples(self, lines, problem):
+        for line in lines[:MAX_EXAMPLES - len(self.examples)]:
+            self.examples.append((int(line), problem))
+
+    def summary(self):
+        lines = [f"Rows: {self.total_rows}", f"Valid rows: {self.valid_rows}"]
+        if self.invalid_ids:
+            lines.append(f"Invalid EPIC IDs: {self.invalid_ids}")
+        if self.invalid_points:
+            lines.append(f"Non-numeric points: {self.invalid_points}")
+        if self.negative_points:
+            lines.append(f"Negative points: {self.negative_points}")
+        if self.duplicate_ids:
+            lines.append(f"Duplicate EPIC IDs: {self.duplicate_ids}")
+        if self.examples:
+            lines.append("First problems:")
+            lines.extend(f"- line {line}: {problem}" for line, problem in sorted(self.examples))
+        return "\n".join(lines)
+
+
+# Parse the CSV bytes chunk by chunk with stripped column names, normalized EPIC IDs and numeric points
+def iter_payout_chunks(csv_bytes, chunk_size=DEFAULT_CHUNK_SIZE):
+    import pandas as pd
+
+    try:
+        reader = pd.read_csv(io.BytesIO(csv_bytes), dtype=str, keep_default_na=False, chunksize=chunk_size)
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip()  # Strip any whitespace from the column names
+            missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+            if missing:
+                names = [f"'{column}'" for column in REQUIRED_COLUMNS]
+                raise PayoutCsvError(f"The CSV file must contain {', '.join(names[:-1])}, and {names[-1]} columns.")
+
+            chunk = chunk[REQUIRED_COLUMNS].copy()
+            chunk["RawEpicID"] = chunk["EpicID"].str.strip()
+            chunk["EpicID"] = chunk["RawEpicID"].str.lower()  # Normalize the EPIC IDs for case-insensitive comparison
+            for column in POINT_COLUMNS:
+                chunk[column] = pd.to_numeric(chunk[column].str.strip(), errors="coerce")
+            chunk.index = chunk.index + 2  # Index becomes the line number in the file, after the header
+            yield chunk
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+        raise PayoutCsvError(f"The CSV file could not be read. {e}")
+
+
+# Validate every row with vectorized checks: EPIC ID format, numeric non-negative points and duplicate IDs
+def validate_payout_csv(csv_bytes, chunk_size=DEFAULT_CHUNK_SIZE):
+    import numpy as np
+    import pandas as pd
+
+    validation = PayoutValidation()
+    seen_hashes = []  # 64-bit hashes of the normalized IDs, far smaller than the strings themselves
+
+    for chunk in iter_payout_chunks(csv_bytes, chunk_size):
+        validation.total_rows += len(chunk)
+
+        # Same rule as is_valid_epic_id: 32 alphanumeric characters
+        bad_id = ~(chunk["RawEpicID"].str.len().eq(32) & chunk["RawEpicID"].str.isalnum())
+        points = chunk[POINT_COLUMNS]
+        bad_points = points.isna().any(axis=1) & ~bad_id
+        negative = (points < 0).any(axis=1) & ~bad_id & ~bad_points
+
+        validation.invalid_ids += int(bad_id.sum())
+        validation.invalid_points += int(bad_points.sum())
+        validation.negative_points += int(negative.sum())
+        validation._add_examples(chunk.index[bad_id], "EPIC ID must be 32 alphanumeric characters")
+        validation._add_examples(chunk.index[bad_points], "points must be numeric")
+        validation._add_examples(chunk.index[negative], "points must not be negative")
+
+        valid_ids = chunk.loc[~(bad_id | bad_points | negative), "EpicID"]  # Each bad row is counted under one problem only
+        seen_hashes.append((pd.util.hash_pandas_object(valid_ids, index=False).to_numpy(), valid_ids.index.to_numpy()))
+
+    if seen_hashes:
+        hashes = np.concatenate([chunk_hashes for chunk_hashes, _ in seen_hashes])
+        lines = np.concatenate([chunk_lines for _, chunk_lines in seen_hashes])
+        order = np.argsort(hashes, kind="stable")
+        repeated = np.zeros(len(hashes), dtype=bool)
+        repeated[order[1:]] = hashes[order[1:]] == hashes[order[:-1]]  # Every occurrence after the first of an ID
+        validation.duplicate_ids = int(repeated.sum())
+        validation._add_examples(np.sort(lines[repeated]), "EPIC ID appears more than once")
+
+    return validation
+
+
+# Yield (epic_id, points per asset...) rows, parsing one chunk at a time off the event loop
+async def aiter_payout_rows(csv_bytes, chunk_size=DEFAULT_CHUNK_SIZE):
+    chunks = iter_payout_chunks(csv_bytes, chunk_size)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            return
+        for row in chunk[REQUIRED_COLUMNS].itertuples(index=False, name=None):
+            yield row
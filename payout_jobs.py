@@ -0,0 +1,416 @@
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+
+from sqlite_store import SqliteStore
+from payout_csv import aiter_payout_rows
+from payout_plan import PayoutPlan
+from assets import WalletBalance
+from distribution import DistributionEngine, BudgetTracker
+from payout_report import PayoutReport
+
+# Job states, "queued" jobs wait for a payout worker process to claim them
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# Transfer states, "sent" means the request went out but its outcome was never recorded
+TRANSFER_SENT = "sent"
+TRANSFER_SUCCEEDED = "succeeded"
+TRANSFER_FAILED = "failed"
+
+DEFAULT_JOB_LEASE = 60  # Seconds a worker owns a claimed job without renewing, after that another worker may take it over
+DEFAULT_QUEUE_POLL = 1.0  # Seconds between polls of the job queue
+BANK_WALLET_ID = "5DSFYPkB2b6auEwZxqbkAWa213EbBfDtRuaRrnivA3RvoMyg"  # Bot bank account that pays out distributions
+
+# Columns added to the jobs table after its first release, created on open if missing
+_QUEUE_COLUMNS = {
+    "worker": "TEXT",  # Worker process running the job, NULL for jobs run inside the bot
+    "lease_until": "REAL",
+    "done_rows": "INTEGER NOT NULL DEFAULT 0",
+    "results": "TEXT",  # Outcome of a queued job as JSON, read back by the bot that queued it
+    "requests_per_second": "REAL",  # Upstream budget of this job, NULL uses the runner's default
+}
+
+
+# Idempotency key of one transfer, stable across restarts of the job
+def idempotency_key(job_id, row_index, asset_id):
+    return f"{job_id}-{row_index}-{asset_id}"
+
+
+# Durable record of payout jobs and of every transfer they make, stored in SQLite
+class PayoutJournal(SqliteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA synchronous=FULL")  # A recorded transfer must survive a power cut
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                admin_id TEXT,
+                channel_id TEXT,
+                total_rows INTEGER NOT NULL,
+                plan TEXT NOT NULL,
+                csv BLOB NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS transfers (
+                job_id TEXT NOT NULL,
+                row_index INTEGER NOT NULL,
+                asset_id INTEGER NOT NULL,
+                epic_id TEXT NOT NULL,
+                points REAL NOT NULL,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                state TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job_id, row_index, asset_id)
+            )
+        """)
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in _QUEUE_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    # Create a job holding the CSV and the plan it was validated against, returns the job ID
+    # A process that runs the job itself passes its owner ID, the job is then leased to it from the start
+    async def create_job(self, csv_bytes, plan, total_rows, admin_id=None, channel_id=None, requests_per_second=None, owner=None, lease=DEFAULT_JOB_LEASE):
+        job_id = uuid.uuid4().hex[:12]
+        plan_data = json.dumps({
+            "policy": plan.policy,
+            "balances": plan.balances,
+            "totals": plan.totals,
+            "rows": plan.rows,
+            "cutoff": plan.cutoff,
+            "scale": plan.scale,
+        })
+        now = time.time()
+        await self._run(self._execute,
+                        "INSERT INTO jobs (job_id, status, created_at, updated_at, admin_id, channel_id, total_rows, plan, csv, requests_per_second, worker, lease_until) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, JOB_RUNNING, now, now, admin_id, channel_id, total_rows, plan_data, csv_bytes, requests_per_second,
+                         owner, now + lease if owner is not None else None))
+        return job_id
+
+    # Load a job without its CSV and results, or None if it does not exist
+    async def get_job(self, job_id):
+        rows = await self._run(self._execute,
+                               "SELECT job_id, status, created_at, updated_at, admin_id, channel_id, total_rows, plan, worker, lease_until, done_rows, requests_per_second, "
+                               "results IS NOT NULL AS has_results FROM jobs WHERE job_id = ?", (job_id,))
+        return dict(rows[0]) if rows else None
+
+    async def get_job_csv(self, job_id):
+        rows = await self._run(self._execute, "SELECT csv FROM jobs WHERE job_id = ?", (job_id,))
+        return rows[0]["csv"] if rows else None
+
+    # Most recent jobs first
+    async def list_jobs(self, limit=10):
+        rows = await self._run(self._execute,
+                               "SELECT job_id, status, created_at, updated_at, admin_id, total_rows FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    # Running jobs nobody holds a live lease on, their process stopped without finishing them
+    async def unfinished_jobs(self):
+        rows = await self._run(self._execute, "SELECT job_id FROM jobs WHERE status = ? AND (lease_until IS NULL OR lease_until < ?) ORDER BY created_at",
+                               (JOB_RUNNING, time.time()))
+        return [row["job_id"] for row in rows]
+
+    async def set_status(self, job_id, status):
+        await self._run(self._execute, "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id))
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, results = NULL, updated_at = ? "
+                "WHERE job_id = ? AND status != ? AND NOT (worker IS NOT NULL AND status = ? AND lease_until > ?)",
+                (JOB_QUEUED, time.time(), job_id, JOB_COMPLETED, JOB_RUNNING, time.time())).rowcount
+        if not updated:
+            raise ValueError(f"Job {job_id} has already completed or is running in a worker.")
+
+    # Hand a job to the payout worker processes, raises ValueError if it is finished or a worker holds it
+    async def enqueue(self, job_id):
+        await self._run(self._enqueue, job_id)
+
+    def _claim(self, worker, lease):
+        with self._lock:
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")  # Two workers never claim the same job
+            try:
+                row = self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = ? OR (status = ? AND worker IS NOT NULL AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED, JOB_RUNNING, now)).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE jobs SET status = ?, worker = ?, lease_until = ?, updated_at = ? WHERE job_id = ?",
+                                       (JOB_RUNNING, worker, now + lease, now, row["job_id"]))
+            finally:
+                self._conn.execute("COMMIT")
+        return row["job_id"] if row is not None else None
+
+    # Claim the oldest queued job, or one whose worker stopped renewing its lease, returns its ID or None
+    async def claim_job(self, worker, lease=DEFAULT_JOB_LEASE):
+        return await self._run(self._claim, worker, lease)
+
+    def _renew(self, job_id, worker, lease):
+        with self._lock:
+            return self._conn.execute("UPDATE jobs SET lease_until = ? WHERE job_id = ? AND worker = ? AND status = ?",
+                                      (time.time() + lease, job_id, worker, JOB_RUNNING)).rowcount == 1
+
+    # Extend the lease of a claimed job, returns False if the worker no longer owns it
+    async def renew_lease(self, job_id, worker, lease=DEFAULT_JOB_LEASE):
+        return await self._run(self._renew, job_id, worker, lease)
+
+    def _take(self, job_id, owner, lease):
+        with self._lock:
+            now = time.time()
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, updated_at = ? "
+                "WHERE job_id = ? AND status != ? AND (worker IS NULL OR worker = ? OR lease_until IS NULL OR lease_until < ?)",
+                (JOB_RUNNING, owner, now + lease, now, job_id, JOB_COMPLETED, owner, now)).rowcount == 1
+
+    # Claim a given job for a process that runs it itself, returns False if it has completed or another owner's lease is live
+    async def take_job(self, job_id, owner, lease=DEFAULT_JOB_LEASE):
+        return await self._run(self._take, job_id, owner, lease)
+
+    # Give up the lease of a job this owner stopped running, so it can be resumed right away
+    async def release_job(self, job_id, owner):
+        await self._run(self._execute, "UPDATE jobs SET lease_until = NULL WHERE job_id = ? AND worker = ?", (job_id, owner))
+
+    async def set_progress(self, job_id, done_rows):
+        await self._run(self._execute, "UPDATE jobs SET done_rows = ? WHERE job_id = ?", (done_rows, job_id))
+
+    # Store the outcome of a queued job and release its lease
+    async def save_results(self, job_id, results):
+        await self._run(self._execute, "UPDATE jobs SET results = ?, lease_until = NULL, updated_at = ? WHERE job_id = ?",
+                        (json.dumps(results), time.time(), job_id))
+
+    async def get_results(self, job_id):
+        rows = await self._run(self._execute, "SELECT results FROM jobs WHERE job_id = ?", (job_id,))
+        return json.loads(rows[0]["results"]) if rows and rows[0]["results"] is not None else None
+
+    # Wait for a worker to finish a queued job, returns its PayoutReport or raises ValueError if it failed
+    # A finished job without results whose lease has run out belongs to a worker that died before saving them
+    async def wait_for_job(self, job_id, progress=None, poll_interval=DEFAULT_QUEUE_POLL):
+        reported = None
+        while True:
+            job = await self.get_job(job_id)
+            if job["has_results"]:
+                results = await self.get_results(job_id)
+                if "error" in results:
+                    raise ValueError(results["error"])
+                return PayoutReport(results["rows"])
+            if job["status"] in (JOB_FAILED, JOB_COMPLETED) and (job["lease_until"] is None or job["lease_until"] < time.time()):
+                raise ValueError(f"Job {job_id} ended as {job['status']} but its worker stopped before saving the outcome. Check it with the inspect action.")
+            if progress and job["status"] == JOB_RUNNING and job["done_rows"] != reported:
+                reported = job["done_rows"]
+                await progress(reported, job["total_rows"])
+            await asyncio.sleep(poll_interval)
+
+    # Number of transfers per state for a job
+    async def transfer_counts(self, job_id):
+        rows = await self._run(self._execute, "SELECT state, COUNT(*) AS count FROM transfers WHERE job_id = ? GROUP BY state", (job_id,))
+        return {row["state"]: row["count"] for row in rows}
+
+    # Transfers that were sent but never completed, their outcome must be checked by hand
+    async def uncertain_transfers(self, job_id, limit=20):
+        rows = await self._run(self._execute,
+                               "SELECT row_index, asset_id, epic_id, points, idempotency_key FROM transfers WHERE job_id = ? AND state = ? ORDER BY row_index LIMIT ?",
+                               (job_id, TRANSFER_SENT, limit))
+        return [dict(row) for row in rows]
+
+    async def finished_transfers(self, job_id, row_index):
+        rows = await self._run(self._execute, "SELECT asset_id, state, points, error FROM transfers WHERE job_id = ? AND row_index = ?", (job_id, row_index))
+        return {row["asset_id"]: (row["state"], _points(row["points"]), row["error"]) for row in rows}
+
+    async def begin_transfer(self, job_id, row_index, asset_id, epic_id, points):
+        key = idempotency_key(job_id, row_index, asset_id)
+        await self._run(self._execute,
+                        "INSERT INTO transfers (job_id, row_index, asset_id, epic_id, points, idempotency_key, state, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, row_index, asset_id, epic_id, float(points), key, TRANSFER_SENT, time.time()))
+        return key
+
+    async def finish_transfer(self, job_id, row_index, asset_id, success, error=None):
+        await self._run(self._execute,
+                        "UPDATE transfers SET state = ?, error = ?, updated_at = ? WHERE job_id = ? AND row_index = ? AND asset_id = ?",
+                        (TRANSFER_SUCCEEDED if success else TRANSFER_FAILED, None if success else str(error), time.time(), job_id, row_index, asset_id))
+
+    async def record_failure(self, job_id, row_index, asset_id, epic_id, points, error):
+        await self._run(self._execute,
+                        "INSERT INTO transfers (job_id, row_index, asset_id, epic_id, points, idempotency_key, state, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, row_index, asset_id, epic_id, float(points), idempotency_key(job_id, row_index, asset_id), TRANSFER_FAILED, str(error), time.time()))
+
+    # The journal view of a single job, passed to the distribution engine
+    def for_job(self, job_id):
+        return JobJournal(self, job_id)
+
+
+# Show whole amounts stored as REAL without a decimal point
+def _points(value):
+    return int(value) if float(value).is_integer() else value
+
+
+# Journal calls bound to one job
+class JobJournal:
+    def __init__(self, journal, job_id):
+        self.journal = journal
+        self.job_id = job_id
+
+    async def finished_transfers(self, row_index):
+        return await self.journal.finished_transfers(self.job_id, row_index)
+
+    async def begin_transfer(self, row_index, asset_id, epic_id, points):
+        return await self.journal.begin_transfer(self.job_id, row_index, asset_id, epic_id, points)
+
+    async def finish_transfer(self, row_index, asset_id, success, error=None):
+        await self.journal.finish_transfer(self.job_id, row_index, asset_id, success, error)
+
+    async def record_failure(self, row_index, asset_id, epic_id, points, error):
+        await self.journal.record_failure(self.job_id, row_index, asset_id, epic_id, points, error)
+
+
+# Renew the lease on a running job, cancels task once another process has taken the job over
+async def _hold_lease(journal, job_id, owner, lease, task):
+    while True:
+        await asyncio.sleep(lease / 3)
+        if not await journal.renew_lease(job_id, owner, lease):
+            task.cancel()  # The new owner's journal skips what this one already sent
+            return
+
+
+# Runs journaled payout jobs, both fresh ones and ones resumed after a restart
+# With an owner ID, as inside a bot process, each job is claimed and leased first so no other process runs it at the same time
+class PayoutJobRunner:
+    def __init__(self, client, journal, lookup_user, bank_wallet, max_in_flight, requests_per_second, owner=None, lease=DEFAULT_JOB_LEASE):
+        self.client = client
+        self.journal = journal
+        self.lookup_user = lookup_user
+        self.bank_wallet = bank_wallet
+        self.max_in_flight = max_in_flight
+        self.requests_per_second = requests_per_second
+        self.owner = owner  # None when a payout worker has already claimed the job
+        self.lease = lease
+        self.active = {}  # job_id -> task, so a job is never run twice at once in this process
+
+    # Run a job from wherever its journal says it stopped, returns the report of its outcomes or raises ValueError
+    # Outcomes are recorded in report when one is given, otherwise in a new one
+    # balances is the bank balance the job was just planned against, None reads it fresh as a resumed job must
+    async def run(self, job_id, progress=None, report=None, balances=None):
+        if job_id in self.active:
+            raise ValueError(f"Job {job_id} is already running.")
+        if self.owner is not None:
+            task = asyncio.ensure_future(self._run_leased(job_id, progress, report, balances))
+        else:
+            task = asyncio.ensure_future(self._run(job_id, progress, report, balances))
+        self.active[job_id] = task
+        try:
+            return await task
+        finally:
+            del self.active[job_id]
+
+    async def _run_leased(self, job_id, progress, report, balances):
+        if not await self.journal.take_job(job_id, self.owner, self.lease):
+            raise ValueError(f"Job {job_id} has already completed or is running in another process.")
+        task = asyncio.ensure_future(self._run(job_id, progress, report, balances))
+        heartbeat = asyncio.ensure_future(_hold_lease(self.journal, job_id, self.owner, self.lease, task))
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                raise  # This process is shutting down
+            raise ValueError(f"Job {job_id} was taken over by another process after its lease ran out.")
+        finally:
+            heartbeat.cancel()
+            await self.journal.release_job(job_id, self.owner)
+
+    async def _run(self, job_id, progress, report, balances):
+        job = await self.journal.get_job(job_id)
+        if job is None:
+            raise ValueError(f"Job {job_id} does not exist.")
+        if job["status"] == JOB_COMPLETED:
+            raise ValueError(f"Job {job_id} has already completed.")
+
+        # From here on the job never stays "running" on failure, or the next restart would resume a payout the admin was told had failed
+        try:
+            if balances is None:
+                # The bank balance is read fresh, it already reflects transfers made before a restart
+                bot_balance_data, error = await self.client.get_wallet_balance(self.bank_wallet, use_cache=False)
+                if error or not bot_balance_data:
+                    raise ValueError(f"Failed to check Bot Bank Account balance. {error}")
+                balances = WalletBalance.from_api(bot_balance_data).as_dict()
+
+            plan_data = json.loads(job["plan"])
+            plan = PayoutPlan(plan_data["policy"], {int(k): v for k, v in plan_data["balances"].items()},
+                              {int(k): v for k, v in plan_data["totals"].items()}, plan_data["rows"],
+                              cutoff=plan_data["cutoff"], scale={int(k): v for k, v in plan_data["scale"].items()} if plan_data["scale"] else None)
+
+            await self.journal.set_status(job_id, JOB_RUNNING)
+            csv_bytes = await self.journal.get_job_csv(job_id)
+            requests_per_second = job["requests_per_second"] if job["requests_per_second"] is not None else self.requests_per_second
+            engine = DistributionEngine(self.client, max_in_flight=self.max_in_flight, requests_per_second=requests_per_second)
+            report = await engine.run(aiter_payout_rows(csv_bytes), self.lookup_user, BudgetTracker(balances), plan=plan,
+                                      progress=progress, total=job["total_rows"], journal=self.journal.for_job(job_id), report=report)
+        except Exception:
+            await self.journal.set_status(job_id, JOB_FAILED)
+            raise
+        await self.journal.set_status(job_id, JOB_COMPLETED)
+        return report
+
+
+# Runs queued payout jobs, one worker per process and several processes per queue
+# A claimed job is leased, the worker renews the lease while it runs and gives the job up if another worker took it over
+class PayoutWorker:
+    def __init__(self, runner, worker_id, lease=DEFAULT_JOB_LEASE, poll_interval=DEFAULT_QUEUE_POLL):
+        self.runner = runner
+        self.journal = runner.journal
+        self.worker_id = worker_id
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.completed = 0  # Jobs this worker finished, successfully or not
+        self._stopping = False
+
+    # Claim and run one job, returns its ID or None if the queue was empty
+    async def run_once(self):
+        job_id = await self.journal.claim_job(self.worker_id, self.lease)
+        if job_id is None:
+            return None
+
+        async def progress(done, total):
+            await self.journal.set_progress(job_id, done)
+
+        report = PayoutReport()
+        task = asyncio.ensure_future(self.runner.run(job_id, progress, report))
+        heartbeat = asyncio.ensure_future(_hold_lease(self.journal, job_id, self.worker_id, self.lease, task))
+        try:
+            await task
+            results = {"rows": report.rows}
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                raise  # The worker itself is shutting down, the lease runs out and another worker resumes the job
+            return job_id  # Lost the lease
+        except Exception as e:  # Journal errors too, the bot waits for a result and the worker must keep serving the queue
+            await self.journal.set_status(job_id, JOB_FAILED)
+            results = {"error": str(e) if isinstance(e, ValueError) else f"Unexpected error: {e}"}
+        finally:
+            heartbeat.cancel()
+        await self.journal.save_results(job_id, results)
+        self.completed += 1
+        return job_id
+
+    # Poll the queue until stop() is called
+    async def run_forever(self):
+        while not self._stopping:
+            try:
+                if await self.run_once() is not None:
+                    continue
+            except Exception as e:
+                print(f"Payout worker {self.worker_id} failed to serve the queue, retrying: {e}")  # A claimed job is taken over once its lease runs out
+            await asyncio.sleep(self.poll_interval)
+
+    def stop(self):
+        self._stopping = True
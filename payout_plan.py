@@ -0,0 +1,107 @@
+import math
+
+from assets import ASSET_IDS, ASSETS_BY_ID, POINT_COLUMNS
+from payout_csv import DEFAULT_CHUNK_SIZE, iter_payout_chunks
+
+# What to do when the CSV asks for more than the bank holds
+SHORTFALL_POLICIES = {
+    "reject": "Reject the payout",
+    "order": "Pay rows in CSV order until the bank runs out",
+    "pro_rata": "Scale every row down to fit the bank",
+}
+
+TRANSFER_DECIMALS = 6  # Decimal places kept when a row is scaled down, transfers carry fractional points as human readable amounts
+
+
+# Show whole amounts without a decimal point
+def format_points(value):
+    value = float(value)
+    return f"{int(value):,}" if value.is_integer() else f"{value:,.2f}"
+
+
+# Scale points down, rounding towards zero at the transfer precision so the scaled rows never add up to more than the bank holds
+def scale_points(points, scale):
+    factor = 10 ** TRANSFER_DECIMALS
+    scaled = math.floor(points * scale * factor + 1e-9) / factor  # The epsilon absorbs float error such as 0.3 * 10**6 = 299999.99999999994
+    return int(scaled) if scaled.is_integer() else scaled
+
+
+# Exact plan of what a payout will send, computed from CSV totals before any transfer starts
+class PayoutPlan:
+    def __init__(self, policy, balances, totals, rows, cutoff=None, scale=None):
+        self.policy = policy
+        self.balances = balances  # Bank balance per asset
+        self.totals = totals  # Points requested per asset by rows of registered users
+        self.rows = rows
+        self.cutoff = cutoff  # Rows at or after this position are not paid, order policy only
+        self.scale = scale  # Factor applied to each asset, pro-rata policy only
+
+    @property
+    def shortfall_assets(self):
+        return [asset_id for asset_id in ASSET_IDS if self.totals[asset_id] > self.balances[asset_id]]
+
+    @property
+    def fits(self):
+        return not self.shortfall_assets
+
+    # Whether the payout may start, a shortfall is only acceptable under the order or pro-rata policy
+    @property
+    def feasible(self):
+        return self.fits or self.policy != "reject"
+
+    # Points to send for the row at a position, or None when the plan leaves it out
+    def apply(self, index, points_by_asset):
+        if self.cutoff is not None and index >= self.cutoff:
+            return None
+        if self.scale:
+            return {asset_id: points if self.scale[asset_id] >= 1.0 else scale_points(points, self.scale[asset_id])
+                    for asset_id, points in points_by_asset.items()}  # Assets the bank covers are paid exactly as requested
+        return points_by_asset
+
+    def summary(self):
+        lines = [f"{ASSETS_BY_ID[asset_id].name}: requested {format_points(self.totals[asset_id])}, available {format_points(self.balances[asset_id])}" for asset_id in ASSET_IDS]
+        if self.fits:
+            lines.append("The bank covers the whole payout.")
+        elif self.policy == "order":
+            paid = self.rows if self.cutoff is None else self.cutoff
+            lines.append(f"Policy: {SHORTFALL_POLICIES['order']}. The first {paid} of {self.rows} rows will be paid.")
+        elif self.policy == "pro_rata":
+            factors = ", ".join(f"{ASSETS_BY_ID[asset_id].name} x{self.scale[asset_id]:.4f}" for asset_id in ASSET_IDS)
+            lines.append(f"Policy: {SHORTFALL_POLICIES['pro_rata']} ({factors}).")
+        else:
+            short = ", ".join(ASSETS_BY_ID[asset_id].name for asset_id in self.shortfall_assets)
+            lines.append(f"Not enough {short} in the Bot Bank Account, the payout was rejected.")
+        return "\n".join(lines)
+
+
+# Sum the CSV per asset with vectorized operations and work out which rows the bank can pay
+def build_payout_plan(csv_bytes, lookup_user, balances, policy="reject", chunk_size=DEFAULT_CHUNK_SIZE):
+    if policy not in SHORTFALL_POLICIES:
+        raise ValueError(f"Unknown shortfall policy '{policy}'.")
+
+    import numpy as np  # Loaded on first use, see payout_csv
+
+    available = np.array([balances[asset_id] for asset_id in ASSET_IDS], dtype=float)
+    running = np.zeros(len(ASSET_IDS))
+    cutoff = None
+    offset = 0
+
+    for chunk in iter_payout_chunks(csv_bytes, chunk_size):
+        registered = chunk["EpicID"].map(lookup_user).notna()  # Rows of unknown users are never paid, so they use no budget
+        points = chunk[POINT_COLUMNS].where(registered, 0).to_numpy(dtype=float)
+        cumulative = running + points.cumsum(axis=0)
+        if cutoff is None:
+            over = (cumulative > available).any(axis=1)
+            if over.any():
+                cutoff = offset + int(over.argmax())  # First row that would overdraw any asset
+        running = cumulative[-1] if len(cumulative) else running
+        offset += len(chunk)
+
+    totals = {asset_id: float(running[i]) for i, asset_id in enumerate(ASSET_IDS)}
+    plan = PayoutPlan(policy, balances, totals, offset)
+    if not plan.fits:
+        if policy == "order":
+            plan.cutoff = cutoff
+        elif policy == "pro_rata":
+            plan.scale = {asset_id: min(1.0, balances[asset_id] / totals[asset_id]) if totals[asset_id] else 1.0 for asset_id in ASSET_IDS}
+    return plan
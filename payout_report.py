@@ -0,0 +1,118 @@
+from collections import Counter
+
+from assets import ASSETS, ASSETS_BY_ID
+from metrics import api_status
+from registry_export import write_csv
+
+# Outcome of one transfer, or of a whole row that never got as far as a transfer
+OUTCOME_PAID = "paid"
+OUTCOME_FAILED = "failed"
+OUTCOME_IN_FLIGHT = "in_flight"  # Sent before a restart without a recorded outcome, must be checked by hand
+OUTCOME_NO_WALLET = "no_wallet"
+OUTCOME_UNREGISTERED = "unregistered"
+OUTCOME_INSUFFICIENT = "insufficient"
+
+# Row level outcomes as shown in the summary
+SKIPPED_ROWS = {
+    OUTCOME_UNREGISTERED: "EPIC ID not registered",
+    OUTCOME_INSUFFICIENT: "not enough resources",
+    OUTCOME_NO_WALLET: "wallet not found",
+}
+
+REPORT_COLUMNS = ["Row", "EpicID", "UserID", "Asset", "Points", "Outcome", "Reason", "Error"]
+MESSAGE_LIMIT = 2000  # Characters Discord accepts in one message
+
+
+# Short category of an API error, failures are grouped by it in the summary
+def failure_reason(error):
+    if not error:
+        return "not found"
+    status = api_status(error)
+    if status == "circuit_open":
+        return "API unavailable"
+    if status == "transient":
+        return "timed out or unreachable"
+    if status == "error":
+        return "error"
+    return f"HTTP {status}"
+
+
+# Structured outcome of every transfer of a payout, with running totals for progress updates
+# Rows are plain lists so a payout worker can hand the report to the bot as JSON
+class PayoutReport:
+    def __init__(self, rows=None):
+        self.rows = []  # [row index, epic_id, user_id, asset_id or None, points, outcome, reason, error]
+        self.paid = Counter()  # asset_id -> points paid
+        self.failed = Counter()  # asset_id -> points of failed transfers
+        self.unpaid = Counter()  # asset_id -> points not paid for any reason other than a plan or budget decision
+        self.outcomes = Counter()  # Per transfer, or per row for rows that never reached a transfer
+        self.reasons = Counter()
+        self._no_wallet_rows = set()  # A missing wallet is recorded once per asset but counted once per row
+        for row in rows or ():
+            self._add(row)
+
+    def _add(self, row):
+        index, _, _, asset_id, points, outcome, reason, _ = row
+        self.rows.append(row)
+        if outcome == OUTCOME_NO_WALLET:
+            if index in self._no_wallet_rows:
+                reason = None
+            else:
+                self._no_wallet_rows.add(index)
+                self.outcomes[outcome] += 1
+        else:
+            self.outcomes[outcome] += 1
+        if outcome == OUTCOME_PAID:
+            self.paid[asset_id] += points
+        elif asset_id is not None:
+            self.unpaid[asset_id] += points
+            if outcome == OUTCOME_FAILED:
+                self.failed[asset_id] += points
+        if reason:
+            self.reasons[reason] += 1
+
+    def record(self, index, epic_id, user_id, outcome, asset_id=None, points=0, error=None):
+        reason = failure_reason(error) if outcome in (OUTCOME_FAILED, OUTCOME_NO_WALLET) else None
+        self._add([index, epic_id, user_id, asset_id, points, outcome, reason, str(error) if error else None])
+
+    # Transfers made so far, for progress messages
+    def progress_line(self):
+        failed = self.outcomes[OUTCOME_FAILED] + self.outcomes[OUTCOME_NO_WALLET]
+        return f"{self.outcomes[OUTCOME_PAID]} transfers made, {failed} failed."
+
+    # Totals and failure categories, always short enough for one Discord message
+    def summary(self, title):
+        lines = [title, f"Paid in {self.outcomes[OUTCOME_PAID]} transfers: {_amounts(self.paid)}"]
+        failed = self.outcomes[OUTCOME_FAILED]
+        if failed:
+            lines.append(f"Failed transfers: {failed} ({_amounts(self.failed)})")
+        skipped = [f"{label}: {self.outcomes[outcome]}" for outcome, label in SKIPPED_ROWS.items() if self.outcomes[outcome]]
+        if skipped:
+            lines.append(f"Rows not paid: {', '.join(skipped)}")
+        if self.unpaid:
+            lines.append(f"Not paid in total: {_amounts(self.unpaid)}")
+        if self.reasons:
+            lines.append("Failure reasons: " + ", ".join(f"{reason} x{count}" for reason, count in self.reasons.most_common(5)))
+        if self.outcomes[OUTCOME_IN_FLIGHT]:
+            lines.append(f"Check manually: {self.outcomes[OUTCOME_IN_FLIGHT]} transfers were in flight when the job stopped.")
+        lines.append("Every row's outcome is in the attached CSV.")
+        text = "\n".join(lines)
+        return text if len(text) <= MESSAGE_LIMIT else text[:MESSAGE_LIMIT - 3] + "..."
+
+    # Stream every outcome in row order into a gzip-compressed CSV, returns a file object at the start
+    def export_csv(self):
+        order = {asset.asset_id: position for position, asset in enumerate(ASSETS)}
+        rows = sorted(self.rows, key=lambda row: (row[0], order.get(row[3], -1)))  # Workers finish rows out of order
+        return write_csv(REPORT_COLUMNS, (
+            (index + 2, epic_id, user_id or "", ASSETS_BY_ID[asset_id].name if asset_id is not None else "", points or "", outcome, reason or "", error or "")
+            for index, epic_id, user_id, asset_id, points, outcome, reason, error in rows), compress=True)  # Row 2 is the first data line of the CSV
+
+
+# "1200 DP, 30 Oil" in asset order, assets with nothing to show are left out
+def _amounts(amounts):
+    parts = [f"{_number(amounts[asset.asset_id])} {asset.name}" for asset in ASSETS if amounts[asset.asset_id]]
+    return ", ".join(parts) or "nothing"
+
+
+def _number(value):
+    return f"{int(value):,}" if float(value).is_integer() else f"{value:,}"
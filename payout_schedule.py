@@ -0,0 +1,212 @@
+import re
+import time
+import uuid
+import sqlite3
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlite_store import SqliteStore
+
+# Schedule states
+SCHEDULE_ACTIVE = "active"
+SCHEDULE_PAUSED = "paused"
+SCHEDULE_CANCELLED = "cancelled"
+SCHEDULE_DONE = "done"  # A one-off schedule that has run
+
+# Seconds between runs of each repeat option, None runs once
+REPEATS = {"once": None, "daily": 24 * 3600, "weekly": 7 * 24 * 3600}
+
+DEFAULT_OFF_PEAK = "02:00-06:00"  # UTC hours when the upstream APIs are quiet
+DEFAULT_SCHEDULER_POLL = 30  # Seconds between checks for due schedules
+
+_RELATIVE = re.compile(r"^in\s+(\d+)\s*([mhd])$")
+_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+# Daily window in UTC, may wrap past midnight like 22:00-04:00
+class OffPeakWindow:
+    def __init__(self, start, end):
+        self.start = start  # Minutes after midnight
+        self.end = end
+
+    @classmethod
+    def parse(cls, text):
+        try:
+            start, end = (_minutes(part) for part in text.split("-"))
+        except ValueError:
+            raise ValueError(f"Invalid off-peak window '{text}'. Use HH:MM-HH:MM in UTC.")
+        return cls(start, end)
+
+    def contains(self, when):
+        minute = when.hour * 60 + when.minute
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+    # The given time if it falls inside the window, otherwise the next time the window opens
+    def next_opening(self, when):
+        if self.contains(when):
+            return when
+        opening = when.replace(hour=self.start // 60, minute=self.start % 60, second=0, microsecond=0)
+        return opening if opening > when else opening + timedelta(days=1)
+
+    def __str__(self):
+        return f"{self.start // 60:02d}:{self.start % 60:02d}-{self.end // 60:02d}:{self.end % 60:02d} UTC"
+
+
+def _minutes(text):
+    hours, minutes = text.strip().split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(text)
+    return hours * 60 + minutes
+
+
+# Parse when a schedule first runs, returns (UTC datetime, whether it is bound to the off-peak window)
+# Accepts "offpeak", "in 30m" / "in 2h" / "in 1d", "HH:MM" (next occurrence) and "YYYY-MM-DD HH:MM", all in UTC
+def parse_start_time(text, now, window):
+    text = text.strip().lower()
+    if text in ("offpeak", "off-peak"):
+        return window.next_opening(now), True
+    match = _RELATIVE.match(text)
+    if match:
+        return now + timedelta(seconds=int(match.group(1)) * _UNITS[match.group(2)]), False
+    try:
+        if len(text) <= 5:
+            minutes = _minutes(text)
+            start = now.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+            return (start if start > now else start + timedelta(days=1)), False
+        start = datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError(f"Could not understand the time '{text}'. Use HH:MM, YYYY-MM-DD HH:MM, 'in 2h' or 'offpeak', all in UTC.")
+    if start <= now:
+        raise ValueError(f"{start:%Y-%m-%d %H:%M} UTC is in the past.")
+    return start, False
+
+
+# Durable schedules of payout CSVs, stored in SQLite next to the payout journal
+class ScheduleStore(SqliteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS schedules (
+                schedule_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                admin_id TEXT,
+                channel_id TEXT,
+                filename TEXT,
+                total_rows INTEGER NOT NULL,
+                policy TEXT,
+                repeat TEXT NOT NULL,
+                off_peak INTEGER NOT NULL,
+                next_run REAL NOT NULL,
+                runs INTEGER NOT NULL DEFAULT 0,
+                last_run REAL,
+                last_job_id TEXT,
+                last_error TEXT,
+                csv BLOB NOT NULL
+            )
+        """)
+
+    # Store a payout CSV to run at next_run, a UTC datetime, returns the schedule ID
+    async def create(self, csv_bytes, total_rows, next_run, repeat="once", off_peak=False, policy=None, admin_id=None, channel_id=None, filename=None):
+        if repeat not in REPEATS:
+            raise ValueError(f"Unknown repeat '{repeat}'.")
+        schedule_id = uuid.uuid4().hex[:8]
+        await self._run(self._execute,
+                        "INSERT INTO schedules (schedule_id, status, created_at, admin_id, channel_id, filename, total_rows, policy, repeat, off_peak, next_run, csv) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (schedule_id, SCHEDULE_ACTIVE, time.time(), admin_id, channel_id, filename, total_rows, policy, repeat, int(off_peak),
+                         next_run.timestamp(), csv_bytes))
+        return schedule_id
+
+    # Schedules without their CSV, pending ones first, finished ones only when asked for
+    async def list(self, include_finished=False, limit=20):
+        finished = "" if include_finished else f"WHERE status NOT IN ('{SCHEDULE_CANCELLED}', '{SCHEDULE_DONE}')"
+        rows = await self._run(self._execute,
+                               "SELECT schedule_id, status, filename, total_rows, policy, repeat, off_peak, next_run, runs, last_run, last_job_id, last_error "
+                               f"FROM schedules {finished} ORDER BY next_run LIMIT ?", (limit,))
+        return [dict(row) for row in rows]
+
+    async def get(self, schedule_id):
+        rows = await self._run(self._execute, "SELECT * FROM schedules WHERE schedule_id = ?", (schedule_id,))
+        return dict(rows[0]) if rows else None
+
+    # Move a schedule between active and paused, or cancel it, returns False if it has already finished
+    async def set_status(self, schedule_id, status):
+        rows = await self._run(self._execute,
+                               "UPDATE schedules SET status = ? WHERE schedule_id = ? AND status IN (?, ?) RETURNING schedule_id",
+                               (status, schedule_id, SCHEDULE_ACTIVE, SCHEDULE_PAUSED))
+        return bool(rows)
+
+    def _claim_due(self, now, window):
+        claimed = []
+        with self._lock:
+            due = self._conn.execute("SELECT * FROM schedules WHERE status = ? AND next_run <= ? ORDER BY next_run",
+                                     (SCHEDULE_ACTIVE, now)).fetchall()
+            for schedule in due:
+                schedule = dict(schedule)
+                current = datetime.fromtimestamp(now, timezone.utc)
+                if schedule["off_peak"] and not window.contains(current):
+                    next_run, status, run = window.next_opening(current).timestamp(), SCHEDULE_ACTIVE, False  # Missed its window, wait for the next one
+                elif REPEATS[schedule["repeat"]] is None:
+                    next_run, status, run = schedule["next_run"], SCHEDULE_DONE, True
+                else:
+                    interval = REPEATS[schedule["repeat"]]
+                    missed = int((now - schedule["next_run"]) // interval) + 1  # Runs missed while the bot was down collapse into this one
+                    next_run, status, run = schedule["next_run"] + missed * interval, SCHEDULE_ACTIVE, True
+                # Conditional on the old next_run so only one bot process claims the run
+                updated = self._conn.execute("UPDATE schedules SET next_run = ?, status = ? WHERE schedule_id = ? AND next_run = ? AND status = ?",
+                                             (next_run, status, schedule["schedule_id"], schedule["next_run"], SCHEDULE_ACTIVE)).rowcount
+                if updated and run:
+                    claimed.append(schedule)
+        return claimed
+
+    # Claim every schedule that is due and move it to its next run, returns the claimed schedules with their CSV
+    async def claim_due(self, now, window):
+        return await self._run(self._claim_due, now, window)
+
+    async def record_run(self, schedule_id, job_id, error=None):
+        await self._run(self._execute, "UPDATE schedules SET runs = runs + 1, last_run = ?, last_job_id = ?, last_error = ? WHERE schedule_id = ?",
+                        (time.time(), job_id, error, schedule_id))
+
+
+# Starts due schedules in the background, run(schedule) performs one run and returns its job ID or raises ValueError
+class PayoutScheduler:
+    def __init__(self, store, run, window, poll_interval=DEFAULT_SCHEDULER_POLL):
+        self.store = store
+        self.run = run
+        self.window = window
+        self.poll_interval = poll_interval
+        self.running = {}  # schedule_id -> task of its current run
+
+    async def tick(self):
+        for schedule in await self.store.claim_due(time.time(), self.window):
+            schedule_id = schedule["schedule_id"]
+            if schedule_id in self.running:
+                await self.store.record_run(schedule_id, None, "Skipped, the previous run was still going.")
+                continue
+            self.running[schedule_id] = asyncio.ensure_future(self._run(schedule))
+
+    async def _run(self, schedule):
+        job_id, error = None, None
+        try:
+            job_id = await self.run(schedule)
+        except ValueError as e:
+            error = str(e)
+        except Exception as e:
+            error = f"Unexpected error: {e}"
+            print(f"Scheduled distribution {schedule['schedule_id']} failed: {e}")
+        finally:
+            del self.running[schedule["schedule_id"]]
+        await self.store.record_run(schedule["schedule_id"], job_id, error)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Checking scheduled distributions failed, retrying: {e}")
+            await asyncio.sleep(self.poll_interval)
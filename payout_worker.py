@@ -0,0 +1,76 @@
+# Payout worker processes for a sharded deployment, they run the distribution jobs queued by the bot processes
+# Run the bots with PAYOUT_WORKERS=external and point both at the same EPIC_ID_DB and PAYOUT_JOURNAL_DB files
+# Usage: python payout_worker.py [processes]
+import os
+import sys
+import socket
+import asyncio
+import multiprocessing
+
+from dotenv import load_dotenv
+
+from deverse_api import DeverseClient
+from registry import EpicIdRegistry
+from storage import SqliteRegistryStore, sync_registry
+from payout_jobs import PayoutJournal, PayoutJobRunner, PayoutWorker, BANK_WALLET_ID
+from distribution import DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUESTS_PER_SECOND
+
+load_dotenv()
+
+REGISTRY_SYNC_INTERVAL = float(os.getenv("REGISTRY_SYNC_INTERVAL", 1))  # Seconds between replays of registrations changed by the bots
+
+
+# Keep the worker's copy of the registry current, payouts look up the owner of every EPIC ID in it
+async def follow_registry(store, registry):
+    while True:
+        await asyncio.sleep(REGISTRY_SYNC_INTERVAL)
+        try:
+            await sync_registry(store, registry)
+        except Exception as e:
+            print(f"Registry sync failed, retrying: {e}")  # A dead sync task would leave payouts looking up a stale registry
+
+
+async def run_worker(worker_id):
+    store = SqliteRegistryStore(os.getenv("EPIC_ID_DB", "epic_ids.db"))
+    registry = EpicIdRegistry(store.load())
+    client = DeverseClient(os.getenv("API_URL"), os.getenv("BALANCE_API_URL"), os.getenv("TRANSFER_API_URL"),
+                           os.getenv("DW_TOKEN"), os.getenv("BEAR_TOKEN"),
+                           failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5)),
+                           recovery_time=float(os.getenv("BREAKER_RECOVERY_TIME", 30)))
+    journal = PayoutJournal(os.getenv("PAYOUT_JOURNAL_DB", "payout_jobs.db"))
+    runner = PayoutJobRunner(client, journal, registry.user_for_epic_id, BANK_WALLET_ID,
+                             int(os.getenv("DISTRIBUTE_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)),
+                             float(os.getenv("DISTRIBUTE_REQUESTS_PER_SECOND", DEFAULT_REQUESTS_PER_SECOND)))
+    worker = PayoutWorker(runner, worker_id)
+    sync_task = asyncio.ensure_future(follow_registry(store, registry))
+    print(f"Payout worker {worker_id} started with {len(registry)} registered EPIC IDs.")
+    try:
+        await worker.run_forever()
+    finally:
+        sync_task.cancel()
+        await client.close()
+        journal.close()
+        store.close()
+
+
+def worker_process(index):
+    asyncio.run(run_worker(f"{socket.gethostname()}-{os.getpid()}-{index}"))
+
+
+def main(processes):
+    if processes == 1:
+        worker_process(0)
+        return
+    workers = [multiprocessing.Process(target=worker_process, args=(index,), daemon=True) for index in range(processes)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()  # Claimed jobs are taken over by the next worker once their lease runs out
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005  # Seconds between stack samples
+DEFAULT_TOP = 15  # Functions listed in a report
+
+
+# Sampling profiler for one thread, usually the event loop thread
+# A background thread reads the target's current stack at a fixed interval, the target itself runs untouched
+class SamplingProfiler:
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._reset()
+
+    def _reset(self):
+        self.samples = 0
+        self.own = Counter()  # Function -> samples where it was running
+        self.total = Counter()  # Function -> samples where it was anywhere on the stack
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            raise ValueError("The profiler is already running.")
+        self._reset()
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._sample_loop, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    # Stop sampling and return the report
+    def stop(self, top=DEFAULT_TOP):
+        if not self.running:
+            raise ValueError("The profiler is not running.")
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.report(top)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            seen = set()
+            leaf = True
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if leaf:
+                    self.own[key] += 1
+                    leaf = False
+                if key not in seen:  # Recursive calls count once per sample
+                    self.total[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+
+    def report(self, top=DEFAULT_TOP):
+        duration = time.monotonic() - self.started_at if self.started_at else 0
+        lines = [f"{self.samples} samples over {duration:.1f}s, every {self.interval * 1000:g} ms"]
+        if not self.samples:
+            return "\n".join(lines)
+        lines.append(f"{'own':>6} {'total':>6}  function")
+        for key, own in self.own.most_common(top):
+            filename, lineno, name = key
+            lines.append(f"{own / self.samples:6.1%} {self.total[key] / self.samples:6.1%}  {name} ({os.path.basename(filename)}:{lineno})")
+        return "\n".join(lines)
@@ -0,0 +1,178 @@
+import time
+import heapq
+import itertools
+
+from sqlite_store import SqliteStore
+
+DEFAULT_SWEEP_INTERVAL = 60  # Seconds between background sweeps of idle buckets
+
+
+# Token buckets keyed by anything hashable, a bucket is forgotten as soon as it has refilled
+# Refill deadlines sit in a heap, so expiring idle keys costs O(log n) each and needs no full scan
+class TokenBuckets:
+    def __init__(self, capacity, per, clock=time.monotonic):
+        self.capacity = capacity  # Tokens a key can spend in a burst
+        self.per = per  # Seconds to refill the whole bucket
+        self.refill_rate = capacity / per
+        self.clock = clock
+        self._buckets = {}  # key -> (tokens, updated_at, full_at)
+        self._deadlines = []  # Heap of (full_at, sequence, key), entries may be stale
+        self._sequence = itertools.count()  # Tie breaker, keys of mixed types are never compared
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        tokens, updated_at, _ = bucket
+        return min(self.capacity, tokens + (now - updated_at) * self.refill_rate)
+
+    # Seconds until the key could spend cost tokens, 0.0 if it can right now
+    def retry_after(self, key, cost=1):
+        tokens = self._tokens(key, self.clock())
+        return 0.0 if tokens >= cost else (cost - tokens) / self.refill_rate
+
+    # Spend cost tokens, returns 0.0 on success or the seconds to wait, nothing is spent when refused
+    def acquire(self, key, cost=1):
+        now = self.clock()
+        self.sweep(now)
+        tokens = self._tokens(key, now)
+        if tokens < cost:
+            return (cost - tokens) / self.refill_rate
+        tokens -= cost
+        full_at = now + (self.capacity - tokens) / self.refill_rate  # After this the bucket equals a fresh one
+        self._buckets[key] = (tokens, now, full_at)
+        heapq.heappush(self._deadlines, (full_at, next(self._sequence), key))
+        return 0.0
+
+    # Drop every bucket that has refilled, returns how many were dropped
+    def sweep(self, now=None):
+        now = self.clock() if now is None else now
+        removed = 0
+        while self._deadlines and self._deadlines[0][0] <= now:
+            full_at, _, key = heapq.heappop(self._deadlines)
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket[2] == full_at:  # A later acquire pushed a newer deadline for this key
+                del self._buckets[key]
+                removed += 1
+        return removed
+
+    def stats(self):
+        return {"keys": len(self._buckets), "pending_deadlines": len(self._deadlines)}
+
+
+# Per-user token buckets for each command, with an optional bucket shared by all users of a command
+class CommandRateLimits:
+    def __init__(self, capacity, per, clock=time.monotonic):
+        self.default = (capacity, per)
+        self.clock = clock
+        self._limits = {}  # command -> (per-user buckets, shared buckets or None)
+
+    # Override the limits of one command, global_capacity and global_per cap all users together
+    def configure(self, command, capacity, per, global_capacity=None, global_per=None):
+        shared = TokenBuckets(global_capacity, global_per, self.clock) if global_capacity else None
+        self._limits[command] = (TokenBuckets(capacity, per, self.clock), shared)
+
+    def _buckets(self, command):
+        if command not in self._limits:
+            self._limits[command] = (TokenBuckets(*self.default, self.clock), None)
+        return self._limits[command]
+
+    # Returns 0.0 if the user may run the command now, otherwise the seconds to wait
+    def acquire(self, command, user_id):
+        per_user, shared = self._buckets(command)
+        if shared is not None:
+            wait = shared.retry_after(command)
+            if wait:
+                return wait  # Checked first so a refused call does not spend the user's token
+        wait = per_user.acquire(user_id)
+        if wait or shared is None:
+            return wait
+        return shared.acquire(command)
+
+    def sweep(self):
+        return sum(buckets.sweep() for per_user, shared in self._limits.values() for buckets in (per_user, shared) if buckets is not None)
+
+    def stats(self):
+        return {command: len(per_user) for command, (per_user, _) in self._limits.items()}
+
+
+# The same per-user and shared limits kept in a SQLite file, for bot processes that each run some of the shards
+# A user's clicks can land on any process, so every acquire is one short write transaction on the shared file
+class SharedRateLimits(SqliteStore):
+    def __init__(self, path, capacity, per, clock=time.time):
+        super().__init__(path)
+        self.default = (capacity, per, None, None)
+        self.clock = clock  # Wall clock, monotonic clocks of different processes cannot be compared
+        self._limits = {}  # command -> (capacity, per, global capacity, global per)
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # Losing a cooldown in a power cut is harmless
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                full_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_full_at ON rate_limits (full_at)")
+
+    # Override the limits of one command, global_capacity and global_per cap all users together
+    def configure(self, command, capacity, per, global_capacity=None, global_per=None):
+        self._limits[command] = (capacity, per, global_capacity, global_per)
+
+    def _tokens(self, key, capacity, per, now):
+        row = self._conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return capacity
+        return min(capacity, row[0] + (now - row[1]) * capacity / per)
+
+    def _spend(self, key, tokens, capacity, per, now):
+        tokens -= 1
+        self._conn.execute("INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                           (key, tokens, now, now + (capacity - tokens) * per / capacity))
+
+    def _acquire(self, command, user_id):
+        capacity, per, global_capacity, global_per = self._limits.get(command, self.default)
+        with self._lock:
+            now = self.clock()
+            self._conn.execute("BEGIN IMMEDIATE")  # Serializes the read and the spend across processes
+            try:
+                if global_capacity:
+                    shared = self._tokens(f"{command}:*", global_capacity, global_per, now)
+                    if shared < 1:
+                        return (1 - shared) * global_per / global_capacity  # Checked first so a refused call does not spend the user's token
+                key = f"{command}:{user_id}"
+                tokens = self._tokens(key, capacity, per, now)
+                if tokens < 1:
+                    return (1 - tokens) * per / capacity
+                self._spend(key, tokens, capacity, per, now)
+                if global_capacity:
+                    self._spend(f"{command}:*", shared, global_capacity, global_per, now)
+                return 0.0
+            finally:
+                self._conn.execute("COMMIT")
+
+    # Returns 0.0 if the user may run the command now, otherwise the seconds to wait
+    async def acquire(self, command, user_id):
+        return await self._run(self._acquire, command, user_id)
+
+    def _sweep(self):
+        with self._lock:
+            return self._conn.execute("DELETE FROM rate_limits WHERE full_at <= ?", (self.clock(),)).rowcount
+
+    # Drop every bucket that has refilled, any process may sweep for all of them
+    async def sweep(self):
+        return await self._run(self._sweep)
+
+    def _stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT substr(key, 1, instr(key, ':') - 1) AS command, COUNT(*) FROM rate_limits "
+                "WHERE full_at > ? AND key NOT LIKE '%:*' GROUP BY command", (self.clock(),)).fetchall()
+        return dict(rows)
+
+    # Active cooldowns per command across every process
+    async def stats(self):
+        return await self._run(self._stats)
@@ -0,0 +1,65 @@
+from itertools import islice
+
+
+# Normalize an EPIC ID for case-insensitive comparison
+def normalize_epic_id(epic_id):
+    return epic_id.strip().lower()
+
+
+# Registry of Discord user IDs to EPIC IDs with a reverse index for O(1) lookups by EPIC ID
+class EpicIdRegistry:
+    def __init__(self, user_epic_ids=None):
+        self._by_user = {}  # Discord user ID -> EPIC ID as provided by the user
+        self._by_epic_id = {}  # Normalized EPIC ID -> Discord user ID
+        for user_id, epic_id in (user_epic_ids or {}).items():
+            self._by_user[user_id] = epic_id
+            self._by_epic_id.setdefault(normalize_epic_id(epic_id), user_id)  # Older data may hold the same ID in different cases, the first owner keeps it
+
+    def __contains__(self, user_id):
+        return user_id in self._by_user
+
+    def __len__(self):
+        return len(self._by_user)
+
+    def __bool__(self):
+        return bool(self._by_user)
+
+    # Get the EPIC ID registered for a Discord user
+    def get(self, user_id, default=None):
+        return self._by_user.get(user_id, default)
+
+    # Iterate over (user_id, epic_id) pairs
+    def items(self):
+        return self._by_user.items()
+
+    # A slice of (user_id, epic_id) pairs in registration order, used for paginated listings
+    def page(self, offset, limit):
+        return list(islice(self._by_user.items(), offset, offset + limit))
+
+    # The forward mapping, used for persistence
+    def as_dict(self):
+        return self._by_user
+
+    # Find the Discord user who registered an EPIC ID, ignoring case and surrounding whitespace
+    def user_for_epic_id(self, epic_id):
+        return self._by_epic_id.get(normalize_epic_id(epic_id))
+
+    # Check whether an EPIC ID is already registered by anyone
+    def is_taken(self, epic_id):
+        return normalize_epic_id(epic_id) in self._by_epic_id
+
+    # Apply a change already committed to the shared store, None removes the user
+    # The store enforces uniqueness, so a local owner of the same ID is stale and only loses the reverse entry
+    def apply(self, user_id, epic_id):
+        previous = self._by_user.pop(user_id, None)
+        if previous is not None:
+            self._drop_reverse(user_id, previous)
+        if epic_id is not None:
+            self._by_user[user_id] = epic_id
+            self._by_epic_id[normalize_epic_id(epic_id)] = user_id
+        return previous
+
+    def _drop_reverse(self, user_id, epic_id):
+        key = normalize_epic_id(epic_id)
+        if self._by_epic_id.get(key) == user_id:
+            del self._by_epic_id[key]
@@ -0,0 +1,43 @@
+import io
+import csv
+import gzip
+import tempfile
+from itertools import islice
+
+from assets import ASSETS, POINT_COLUMNS
+
+# Columns of the exported list, the same as the payout CSV template
+EXPORT_COLUMNS = ["EpicID"] + POINT_COLUMNS
+
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # Bytes kept in memory before the export spills to disk
+WRITE_BATCH_SIZE = 10_000  # Rows handed to the csv writer at once
+
+
+# Stream rows into a CSV under a header, optionally gzip-compressed, handing them to the csv writer in batches
+# Returns a file object positioned at the start, ready for discord.File
+def write_csv(header, rows, compress=False):
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    raw = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) if compress else buffer
+    text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    writer = csv.writer(text, lineterminator='\n')  # Same line endings as the old pandas export
+    writer.writerow(header)
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, WRITE_BATCH_SIZE))
+        if not batch:
+            break
+        writer.writerows(batch)
+
+    text.flush()
+    text.detach()  # Keep the underlying buffer open when the wrapper goes away
+    if compress:
+        raw.close()  # Writes the gzip trailer, the buffer itself stays open
+    buffer.seek(0)
+    return buffer
+
+
+# Stream EPIC IDs into a payout template CSV, optionally gzip-compressed
+def export_registry_csv(epic_ids, compress=False):
+    zeros = (0,) * len(ASSETS)
+    return write_csv(EXPORT_COLUMNS, ((epic_id, *zeros) for epic_id in epic_ids), compress)
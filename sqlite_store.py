@@ -0,0 +1,26 @@
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Base class for state kept in a SQLite file that bot and worker processes share
+# Queries run on one dedicated thread so the event loop never waits on disk, subclasses create their tables after calling __init__
+class SqliteStore:
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)  # One thread keeps writes ordered
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)  # Autocommit, transactions are explicit
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Readers in other processes do not block the writer
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._conn.close()
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from registry import normalize_epic_id
+from sqlite_store import SqliteStore
+
+DEFAULT_CHANGE_LOG_MAX_AGE = 24 * 3600  # Seconds a registry change stays in the log, every live process replays it within seconds
+DEFAULT_PRUNE_INTERVAL = 3600  # Seconds between prunes of the change log
+
+
+# Base class for EPIC ID registry storage, blocking I/O runs on a dedicated thread so the event loop never waits on disk
+class RegistryStore:
+    last_change = 0  # Change number the loaded registry reflects, only shared stores advance it
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=type(self).__name__)  # One thread keeps writes ordered
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # Load every registration as a {user_id: epic_id} dict, called once at startup
+    def load(self):
+        raise NotImplementedError
+
+    def _put(self, user_id, epic_id):
+        raise NotImplementedError
+
+    def _delete(self, user_id):
+        raise NotImplementedError
+
+    # Persist a single registration, raises ValueError if another user already holds the EPIC ID
+    async def put(self, user_id, epic_id):
+        await self._run(self._put, user_id, epic_id)
+
+    # Remove a single registration
+    async def delete(self, user_id):
+        await self._run(self._delete, user_id)
+
+    # Registrations changed by any process since a change number, as (seq, user_id, epic_id) with None for a removal
+    # Only stores shared between processes keep a change log, the others never report changes
+    def _changes_since(self, seq):
+        return []
+
+    async def changes_since(self, seq):
+        return await self._run(self._changes_since, seq)
+
+    def _prune_changes(self, max_age):
+        pass
+
+    # Drop change log entries old enough that every process has applied them
+    async def prune_changes(self, max_age):
+        await self._run(self._prune_changes, max_age)
+
+    # Cached wallet lookups saved by the previous run as (epic_id, id_wallet, expires_at), only some stores keep them
+    def load_wallet_cache(self):
+        return []
+
+    def _save_wallet_cache(self, entries):
+        pass
+
+    # Replace the saved wallet lookups
+    async def save_wallet_cache(self, entries):
+        await self._run(self._save_wallet_cache, entries)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+# Legacy storage that rewrites the whole JSON file, now through an atomic rename
+class JsonRegistryStore(RegistryStore):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._data = {}
+        self._owners = {}  # Normalized EPIC ID -> user ID, checked on every write like the UNIQUE index of the SQLite store
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            self._data = {}
+        self._owners = {}
+        for user_id, epic_id in self._data.items():
+            self._owners.setdefault(normalize_epic_id(epic_id), user_id)  # Older data may hold the same ID twice, the first owner keeps it
+        return dict(self._data)
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)  # A crash mid-write leaves the previous file intact
+
+    def _drop_owner(self, user_id):
+        previous = self._data.get(user_id)
+        if previous is not None and self._owners.get(normalize_epic_id(previous)) == user_id:
+            del self._owners[normalize_epic_id(previous)]
+
+    def _put(self, user_id, epic_id):
+        key = normalize_epic_id(epic_id)
+        owner = self._owners.get(key)
+        if owner is not None and owner != user_id:
+            raise ValueError(f"EPIC ID {epic_id} is already registered by another user.")  # Two users submitted the same ID at once
+        self._drop_owner(user_id)
+        self._data[user_id] = epic_id
+        self._owners[key] = user_id
+        self._write()
+
+    def _delete(self, user_id):
+        self._drop_owner(user_id)
+        self._data.pop(user_id, None)
+        self._write()
+
+
+# SQLite storage in WAL mode that writes one row per change
+# Several bot processes can share the file, every write is also appended to a change log the others replay
+class SqliteRegistryStore(SqliteStore, RegistryStore):
+    def __init__(self, path, legacy_json_path=None):
+        super().__init__(path)  # SqliteStore sets up the executor RegistryStore.__init__ would
+        self.legacy_json_path = legacy_json_path
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # Durable across crashes in WAL mode, without an fsync per write
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS epic_ids (
+                user_id TEXT PRIMARY KEY,
+                epic_id TEXT NOT NULL,
+                epic_id_normalized TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_epic_ids_normalized ON epic_ids (epic_id_normalized)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS epic_id_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                epic_id TEXT,
+                changed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS wallet_cache (
+                epic_id TEXT PRIMARY KEY,
+                id_wallet TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    # Import epic_ids.json the first time the database is opened, then set the file aside
+    def _migrate_from_json(self):
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
+        if self._conn.execute("SELECT 1 FROM epic_ids LIMIT 1").fetchone():
+            return  # Already migrated
+
+        with open(self.legacy_json_path, 'r') as f:
+            legacy = json.load(f)
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for user_id, epic_id in legacy.items():
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO epic_ids (user_id, epic_id, epic_id_normalized) VALUES (?, ?, ?)",
+                    (user_id, epic_id, normalize_epic_id(epic_id)))
+                if cursor.rowcount == 0:
+                    print(f"Skipped duplicate EPIC ID {epic_id} for user {user_id} while migrating {self.legacy_json_path}.")
+            self._conn.execute("COMMIT")
+        os.replace(self.legacy_json_path, f"{self.legacy_json_path}.migrated")
+        print(f"Migrated {len(legacy)} EPIC IDs from {self.legacy_json_path} to {self.path}.")
+
+    def load(self):
+        self._migrate_from_json()
+        with self._lock:
+            self._conn.execute("BEGIN")  # The registry and the change number must come from the same snapshot
+            data = dict(self._conn.execute("SELECT user_id, epic_id FROM epic_ids"))
+            self.last_change = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM epic_id_changes").fetchone()[0]
+            self._conn.execute("COMMIT")
+        return data
+
+    # Write a change and its change log entry in one transaction
+    def _write(self, sql, params, user_id, epic_id):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(sql, params)
+                self._conn.execute("INSERT INTO epic_id_changes (user_id, epic_id, changed_at) VALUES (?, ?, ?)", (user_id, epic_id, time.time()))
+            except sqlite3.IntegrityError:
+                self._conn.execute("ROLLBACK")
+                raise ValueError(f"EPIC ID {epic_id} is already registered by another user.")  # Another process claimed it first
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _put(self, user_id, epic_id):
+        self._write("INSERT INTO epic_ids (user_id, epic_id, epic_id_normalized) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET epic_id = excluded.epic_id, epic_id_normalized = excluded.epic_id_normalized",
+                    (user_id, epic_id, normalize_epic_id(epic_id)), user_id, epic_id)
+
+    def _delete(self, user_id):
+        self._write("DELETE FROM epic_ids WHERE user_id = ?", (user_id,), user_id, None)
+
+    def _changes_since(self, seq):
+        with self._lock:
+            return self._conn.execute("SELECT seq, user_id, epic_id FROM epic_id_changes WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+
+    def _prune_changes(self, max_age):
+        with self._lock:
+            self._conn.execute("DELETE FROM epic_id_changes WHERE changed_at < ?", (time.time() - max_age,))
+
+    def load_wallet_cache(self):
+        with self._lock:
+            return self._conn.execute("SELECT epic_id, id_wallet, expires_at FROM wallet_cache").fetchall()
+
+    def _save_wallet_cache(self, entries):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM wallet_cache")
+            self._conn.executemany(
+                "INSERT INTO wallet_cache (epic_id, id_wallet, expires_at) VALUES (?, ?, ?)",
+                [entry for entry in entries if entry[1]])  # Negative entries are too short-lived to keep
+            self._conn.execute("COMMIT")
+
+
+# Build the registry store selected by the EPIC_ID_STORE setting
+def create_registry_store(kind, json_path, sqlite_path):
+    if kind == "json":
+        return JsonRegistryStore(json_path)
+    if kind == "sqlite":
+        return SqliteRegistryStore(sqlite_path, legacy_json_path=json_path)
+    raise ValueError(f"Unknown EPIC ID store '{kind}'. Use 'sqlite' or 'json'.")
+
+
+# Replay registrations changed by other processes sharing the store into an in-memory registry
+# on_change(old_epic_id, new_epic_id) is called for each change so cached wallets of both IDs can be dropped
+async def sync_registry(store, registry, on_change=None):
+    changes = await store.changes_since(store.last_change)
+    for seq, user_id, epic_id in changes:
+        previous = registry.apply(user_id, epic_id)
+        store.last_change = seq
+        if on_change is not None:
+            on_change(previous, epic_id)
+    return len(changes)